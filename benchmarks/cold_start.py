@@ -0,0 +1,110 @@
+"""Measure the cold start time of the backend.
+
+Every measurement runs in a fresh interpreter, like a new container would:
+
+- `import`: time to import `backend.app` (until uvicorn can start serving)
+- `warmup`: time to import `backend.app` and run the lifespan warmup
+  (agent graph compiled, heavy modules loaded)
+
+With `--importtime` the slowest modules of `import backend.app` are listed,
+based on `python -X importtime`.
+
+Usage:
+    uv run python benchmarks/cold_start.py --runs 5 --importtime
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+_SNIPPETS = {
+    "import": (
+        "import time; start = time.perf_counter(); import backend.app; "
+        "print(time.perf_counter() - start)"
+    ),
+    "warmup": (
+        "import time; start = time.perf_counter(); import backend.app; "
+        "from backend.warmup import warmup; warmup(); "
+        "print(time.perf_counter() - start)"
+    ),
+}
+
+
+def _env() -> dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        path for path in [str(SRC_DIR), env.get("PYTHONPATH", "")] if path
+    )
+    # The LLM client is created at import; no request is sent, so any value works
+    for name, value in [
+        ("AZURE_OPENAI_API_KEY", "benchmark"),
+        ("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+        ("AZURE_OPENAI_ENDPOINT", "https://benchmark.invalid"),
+    ]:
+        env.setdefault(name, value)
+    return env
+
+
+def measure(snippet: str, runs: int) -> list[float]:
+    """Run `snippet` in `runs` fresh interpreters and return the timings."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", snippet],
+            env=_env(),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def import_time_report(top: int) -> list[tuple[int, str]]:
+    """Return the `top` modules with the highest cumulative import time (us)."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.app"],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement")
+    parser.add_argument(
+        "--importtime", action="store_true", help="Show the slowest imports"
+    )
+    parser.add_argument("--top", type=int, default=15, help="Modules to show")
+    args = parser.parse_args()
+
+    for name, snippet in _SNIPPETS.items():
+        timings = measure(snippet, args.runs)
+        print(
+            f"{name:<8} median {statistics.median(timings):.3f}s"
+            f"  min {min(timings):.3f}s  max {max(timings):.3f}s"
+            f"  ({args.runs} runs)"
+        )
+
+    if args.importtime:
+        print("\nSlowest imports of backend.app (cumulative):")
+        for cumulative, module in import_time_report(args.top):
+            print(f"{cumulative / 1e6:8.3f}s  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import functools
+import os
+import re
+import time
+from collections import Counter
+from collections.abc import Callable
+
+import orjson
+
+# Per-run budgets; 0 disables a budget
+RUN_MAX_LLM_CALLS = int(os.getenv("RUN_MAX_LLM_CALLS", "15"))
+RUN_MAX_TOKENS = int(os.getenv("RUN_MAX_TOKENS", "200000"))
+RUN_MAX_SECONDS = float(os.getenv("RUN_MAX_SECONDS", "180"))
+RUN_MAX_SQL_SECONDS = float(os.getenv("RUN_MAX_SQL_SECONDS", "60"))
+# Times the same tool call, or the same error, may occur in a run; one more
+# and the run is stopped as a loop
+LOOP_MAX_REPEATS = int(os.getenv("LOOP_MAX_REPEATS", "2"))
+
+# Tools whose time counts against RUN_MAX_SQL_SECONDS
+SQL_TOOLS = {"sql_db_query", "sql_db_query_candidates", "sql_db_query_checker"}
+
+# Nodes that spend the budget: they call the model or the database
+_SPENDING_NODES = {
+    "call_model",
+    "tools",
+    "suggest_follow_up_question",
+    "execute_plan",
+    "repair_plan",
+}
+
+# Tool results that report a failure
+_ERROR_PREFIXES = ("Error", "Query is NOT valid")
+_NUMBER = re.compile(r"\d+")
+
+STOP_REASONS = {
+    "llm_calls": "the limit of model calls was reached",
+    "tokens": "the token budget was used up",
+    "seconds": "the time limit was reached",
+    "sql_seconds": "the database time budget was used up",
+    "repeated_call": "the same tool call kept repeating",
+    "repeated_error": "the same error kept coming back",
+}
+
+
+def tool_call_signature(tool_call: dict) -> str:
+    """Identify a tool call by its name and arguments, ignoring whitespace and case."""
+    args = orjson.dumps(tool_call["args"], option=orjson.OPT_SORT_KEYS).decode()
+    return f"call:{tool_call['name']}:{' '.join(args.lower().split())}"
+
+
+def error_signature(tool_name: str, content: str) -> str | None:
+    """Identify the error a tool returned, or None if it succeeded.
+
+    Only the first line is kept and numbers (positions, line numbers) are
+    dropped, so the same mistake in a slightly different query matches.
+    """
+    if not content.startswith(_ERROR_PREFIXES):
+        return None
+    first_line = content.split("\n", 1)[0].strip()
+    return f"error:{tool_name}:{_NUMBER.sub('#', first_line)}"
+
+
+def tokens_used(message) -> int:
+    """Total tokens of an LLM response, 0 if the client did not report usage."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0)
+
+
+def _pending_calls(state: dict) -> list[str]:
+    last_message = state["messages"][-1] if state["messages"] else None
+    tool_calls = getattr(last_message, "tool_calls", None) or []
+    return [tool_call_signature(tool_call) for tool_call in tool_calls]
+
+
+def _loop_reason(state: dict) -> str | None:
+    counts = Counter(state.get("tool_signatures") or [])
+    # Calls the model just asked for count before they run
+    counts.update(_pending_calls(state))
+    for signature, count in counts.items():
+        if count > LOOP_MAX_REPEATS:
+            return (
+                "repeated_call" if signature.startswith("call:") else "repeated_error"
+            )
+    return None
+
+
+def _budget_reason(state: dict) -> str | None:
+    usage = budget_usage(state)
+    for reason, limit in budget_limits().items():
+        if limit and usage[reason] >= limit:
+            return reason
+    return None
+
+
+def stop_reason(state: dict) -> str | None:
+    """Why the run has to stop now, or None if it may go on.
+
+    A run stops when it used up a budget or repeats itself: the same tool call
+    or the same error more than `LOOP_MAX_REPEATS` times.
+    """
+    if LOOP_MAX_REPEATS > 0:
+        reason = _loop_reason(state)
+        if reason:
+            return reason
+    return _budget_reason(state)
+
+
+def budget_limits() -> dict[str, float]:
+    return {
+        "llm_calls": RUN_MAX_LLM_CALLS,
+        "tokens": RUN_MAX_TOKENS,
+        "seconds": RUN_MAX_SECONDS,
+        "sql_seconds": RUN_MAX_SQL_SECONDS,
+    }
+
+
+def budget_usage(state: dict) -> dict[str, float]:
+    """How much of each budget the run has used so far."""
+    started_at = state.get("started_at") or time.time()
+    return {
+        "llm_calls": state.get("llm_calls", 0),
+        "tokens": state.get("tokens", 0),
+        "seconds": round(time.time() - started_at, 3),
+        "sql_seconds": round(state.get("sql_seconds", 0.0), 3),
+    }
+
+
+def guard(router: Callable[[dict], str]) -> Callable[[dict], str]:
+    """Wrap a graph router to go to `stop_run` instead of a node that spends
+    the budget once the run has to stop (see `stop_reason`)."""
+
+    @functools.wraps(router)
+    def guarded(state: dict) -> str:
+        destination = router(state)
+        if destination in _SPENDING_NODES and stop_reason(state):
+            return "stop_run"
+        return destination
+
+    return guarded
@@ -0,0 +1,145 @@
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import pyarrow as pa
+
+from backend.agent.retrieval import schema_index
+from backend.database import get_engine
+from backend.utils.arrow_utils import fetch_arrow_table
+from backend.utils.metrics import metrics
+from backend.utils.run_log import run_log
+
+logger = logging.getLogger(__name__)
+
+# Most candidate queries per call; below 2 the candidates tool is disabled
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "3"))
+# Seconds after which Postgres cancels a candidate query
+SQL_CANDIDATE_TIMEOUT = float(os.getenv("SQL_CANDIDATE_TIMEOUT", "10"))
+# "first": use the first valid non-empty result; "model": show all results
+# and let the model pick one with sql_db_query
+SQL_CANDIDATES_PICK = os.getenv("SQL_CANDIDATES_PICK", "first")
+
+
+@dataclass
+class CandidateResult:
+    query: str
+    table: pa.Table | None = None
+    error: str | None = None
+    # Literals that are not values of their column (see SchemaIndex.check_literals)
+    warnings: list[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def usable(self) -> bool:
+        """Whether the query returned rows without filtering on unknown values.
+
+        A misspelled value still gives a row for aggregates like COUNT(*).
+        """
+        return self.table is not None and self.table.num_rows > 0 and not self.warnings
+
+
+def _run_candidate(datasource: str, query: str) -> CandidateResult:
+    start = time.perf_counter()
+    result = CandidateResult(query)
+    try:
+        result.warnings = schema_index.check_literals(datasource, query)
+    except Exception as e:
+        logger.warning(f"Checking the literals of a candidate failed: {e}")
+    try:
+        result.table = fetch_arrow_table(
+            get_engine(datasource),
+            query,
+            read_only=True,
+            timeout=SQL_CANDIDATE_TIMEOUT,
+        )
+    except Exception as e:
+        result.error = str(e).split("\n")[0]
+    result.seconds = time.perf_counter() - start
+    if result.error:
+        outcome = "error"
+    else:
+        outcome = "rows" if result.table.num_rows else "empty"
+    run_log.log_query(
+        "sql_db_query_candidates",
+        datasource,
+        query,
+        result.seconds,
+        row_count=result.table.num_rows if result.table is not None else None,
+        error=result.error,
+    )
+    metrics.increment("sql_candidates", outcome=outcome)
+    return result
+
+
+def run_candidates(
+    datasource: str, queries: list[str], wait_for_all: bool = False
+) -> list[CandidateResult | None]:
+    """Run candidate queries concurrently, each in a read-only transaction.
+
+    The results are checked for literals that are not values of their column.
+
+    Results are returned in the order of `queries`. Unless `wait_for_all`,
+    this returns as soon as the first usable result in that order is known;
+    candidates that were not needed are cancelled if they have not started
+    (their result is None) and otherwise end within the timeout.
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=len(queries), thread_name_prefix="sql-candidate"
+    )
+    # Each thread runs in a copy of this context, so its spans join the trace
+    futures: list[Future] = [
+        executor.submit(
+            contextvars.copy_context().run, _run_candidate, datasource, query
+        )
+        for query in queries
+    ]
+    results: list[CandidateResult | None] = [None] * len(queries)
+    try:
+        for index, future in enumerate(futures):
+            results[index] = future.result()
+            if results[index].usable and not wait_for_all:
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def pick_candidate(results: list[CandidateResult | None]) -> CandidateResult | None:
+    """The first usable candidate in the given order.
+
+    If there is none, the first that ran without error: no rows can be the answer.
+    """
+    finished = [result for result in results if result is not None]
+    for result in finished:
+        if result.usable:
+            return result
+    for result in finished:
+        if result.error is None:
+            return result
+    return None
+
+
+def describe_candidates(
+    results: list[CandidateResult | None], picked: CandidateResult | None
+) -> str:
+    """One line per candidate on how it went, for the model."""
+    lines = []
+    for number, result in enumerate(results, start=1):
+        if result is None:
+            status = "not needed"
+        elif result is picked:
+            status = "used"
+        elif result.error:
+            status = f"Error: {result.error}"
+        elif result.table.num_rows:
+            status = f"{result.table.num_rows} rows"
+        else:
+            status = "no rows"
+        if result is not None and result.warnings:
+            status += " " + " ".join(result.warnings)
+        lines.append(f"Candidate {number}: {status}")
+    return "\n".join(lines)
@@ -0,0 +1,357 @@
+import logging
+import os
+
+from sqlalchemy import inspect, text
+
+from backend.agent.catalog_probe import catalog_probe
+from backend.database import datasources, get_engine
+from backend.utils.shared_cache import cache_key, shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds the schema catalog stays in the shared cache
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+# Whether the retrieval index behind find_relevant_tables and lookup_values is
+# built; without it the agent has neither tool
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() == "true"
+
+
+def _table_names(datasource: str) -> list[str]:
+    engine = get_engine(datasource)
+    inspector = inspect(engine)
+    names = inspector.get_table_names()
+    if engine.dialect.name == "postgresql":
+        # The rollups are materialized views
+        names += inspector.get_materialized_view_names()
+    return names
+
+
+def list_tables(datasource: str) -> list[str]:
+    """List the tables (and materialized views) of a datasource."""
+    return shared_cache.get_or_set(
+        "schema",
+        f"{datasource}/tables",
+        lambda: _table_names(datasource),
+        SCHEMA_CACHE_TTL,
+    )
+
+
+def describe_tables(datasource: str, tables: list[str]) -> dict[str, str]:
+    """Describe the columns and sample rows of existing tables.
+
+    Descriptions are cached per table; the tables missing from the cache are
+    described together in one catalog probe (see `CatalogProbe`).
+    """
+    descriptions = {
+        table: shared_cache.get("schema", f"{datasource}/table/{table}")
+        for table in tables
+    }
+    missing = [
+        table for table, description in descriptions.items() if description is None
+    ]
+    for table, description in catalog_probe.describe(datasource, missing).items():
+        shared_cache.set(
+            "schema", f"{datasource}/table/{table}", description, SCHEMA_CACHE_TTL
+        )
+        descriptions[table] = description
+    return descriptions
+
+
+# Seconds between checks whether the schema of a datasource changed
+SCHEMA_FINGERPRINT_TTL = float(os.getenv("SCHEMA_FINGERPRINT_TTL", "60"))
+
+# Hash of every column and constraint in the public schema; it changes
+# whenever a table, view, column, type or key changes
+_PG_FINGERPRINT_QUERY = """
+SELECT md5(
+    COALESCE((
+        SELECT string_agg(
+            c.relname || '.' || a.attname || ':'
+                || format_type(a.atttypid, a.atttypmod),
+            ',' ORDER BY c.relname, a.attnum
+        )
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        WHERE c.relnamespace = 'public'::regnamespace
+            AND c.relkind IN ('r', 'p', 'v', 'm')
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+    ), '')
+    || COALESCE((
+        SELECT string_agg(conname || pg_get_constraintdef(oid), ',' ORDER BY conname)
+        FROM pg_constraint
+        WHERE connamespace = 'public'::regnamespace
+    ), '')
+)
+"""
+
+_PG_ROW_COUNTS_QUERY = """
+SELECT relname, reltuples::bigint
+FROM pg_class
+WHERE relnamespace = 'public'::regnamespace AND relkind IN ('r', 'p', 'm')
+"""
+
+# Short type names for the digest, checked in order against the SQL type
+_TYPE_FAMILIES = [
+    ("bool", "bool"),
+    ("interval", "interval"),
+    ("int", "int"),
+    ("serial", "int"),
+    ("numeric", "num"),
+    ("decimal", "num"),
+    ("real", "float"),
+    ("double", "float"),
+    ("float", "float"),
+    ("timestamp", "timestamp"),
+    ("date", "date"),
+    ("time", "time"),
+    ("bytea", "bytes"),
+    ("blob", "bytes"),
+    ("binary", "bytes"),
+    ("json", "json"),
+    ("uuid", "uuid"),
+    ("[]", "array"),
+]
+
+
+def _short_type(sql_type) -> str:
+    name = str(sql_type).lower()
+    for marker, family in _TYPE_FAMILIES:
+        if marker in name:
+            return family
+    return "text"
+
+
+def _schema_fingerprint(datasource: str) -> str:
+    engine = get_engine(datasource)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            return connection.execute(text(_PG_FINGERPRINT_QUERY)).scalar()
+    inspector = inspect(engine)
+    parts = []
+    for table in sorted(inspector.get_table_names()):
+        columns = inspector.get_columns(table)
+        parts.append(
+            table + ":" + ",".join(f"{c['name']} {c['type']}" for c in columns)
+        )
+    return cache_key(*parts)
+
+
+def _row_counts(datasource: str, tables: list[str]) -> dict[str, int]:
+    engine = get_engine(datasource)
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            # Planner estimates; -1 means the table was never analyzed
+            counts = dict(connection.execute(text(_PG_ROW_COUNTS_QUERY)).all())
+        else:
+            counts = {}
+        for table in tables:
+            if counts.get(table, -1) < 0:
+                counts[table] = connection.execute(
+                    text(f'SELECT COUNT(*) FROM "{table}"')
+                ).scalar()
+    return counts
+
+
+def _approximate(count: int) -> str:
+    """Shorten a row count for the prompt, e.g. 2155 -> 2.2k, 123456789 -> 123M."""
+    for divisor, suffix in ((1_000_000_000, "G"), (1_000_000, "M"), (1000, "k")):
+        if count >= divisor:
+            # Two significant digits below 10, 9.95 would round up to 1e+01
+            if count / divisor < 9.95:
+                return f"{count / divisor:.2g}{suffix}"
+            return f"{round(count / divisor)}{suffix}"
+    return str(count)
+
+
+def _build_schema_digest(datasource: str) -> str:
+    engine = get_engine(datasource)
+    inspector = inspect(engine)
+    tables = _table_names(datasource)
+    counts = _row_counts(datasource, tables)
+    lines = []
+    for table in sorted(tables):
+        primary_key = set(
+            inspector.get_pk_constraint(table).get("constrained_columns") or []
+        )
+        references = {}
+        for foreign_key in inspector.get_foreign_keys(table):
+            for column, referred in zip(
+                foreign_key["constrained_columns"], foreign_key["referred_columns"]
+            ):
+                target = foreign_key["referred_table"]
+                references[column] = (
+                    target if referred == column else f"{target}.{referred}"
+                )
+        columns = []
+        for column in inspector.get_columns(table):
+            entry = column["name"]
+            column_type = _short_type(column["type"])
+            if column_type != "text":
+                entry += f" {column_type}"
+            if column["name"] in primary_key:
+                entry += " PK"
+            if column["name"] in references:
+                entry += f" ->{references[column['name']]}"
+            columns.append(entry)
+        lines.append(
+            f"{table} ({_approximate(counts.get(table, 0))} rows): "
+            + ", ".join(columns)
+        )
+    return "\n".join(lines)
+
+
+def schema_fingerprint(datasource: str) -> str:
+    """Hash of a datasource's schema, rechecked every `SCHEMA_FINGERPRINT_TTL` seconds."""
+    return shared_cache.get_or_set(
+        "schema",
+        f"{datasource}/fingerprint",
+        lambda: _schema_fingerprint(datasource),
+        SCHEMA_FINGERPRINT_TTL,
+    )
+
+
+def schema_digest(datasource: str) -> str:
+    """Compact digest of a datasource's schema for the prompt.
+
+    One line per table with its approximate row count and its columns with
+    short types (omitted for text), primary keys (`PK`) and foreign keys
+    (`->table`). The digest
+    is cached under the schema fingerprint, so it is rebuilt when the schema
+    changes, and at least every `SCHEMA_CACHE_TTL` seconds for the row
+    counts; the fingerprint itself is checked every `SCHEMA_FINGERPRINT_TTL`
+    seconds.
+    """
+    fingerprint = schema_fingerprint(datasource)
+    return shared_cache.get_or_set(
+        "schema",
+        f"{datasource}/digest/{fingerprint}",
+        lambda: _build_schema_digest(datasource),
+        SCHEMA_CACHE_TTL,
+    )
+
+
+# Rows inserted, updated or deleted per table since the statistics were reset
+_PG_TABLE_CHANGES_QUERY = """
+SELECT relname, n_tup_ins + n_tup_upd + n_tup_del
+FROM pg_stat_user_tables
+WHERE schemaname = 'public'
+"""
+
+
+def table_versions(datasource: str) -> dict[str, str]:
+    """A version per table that changes whenever its schema or data changes.
+
+    On Postgres the version is the table's change counter, elsewhere its row
+    count; both are combined with the schema fingerprint.
+    """
+    fingerprint = schema_fingerprint(datasource)
+    engine = get_engine(datasource)
+    tables = _table_names(datasource)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            changes = dict(connection.execute(text(_PG_TABLE_CHANGES_QUERY)).all())
+    else:
+        changes = _row_counts(datasource, tables)
+    return {table: f"{fingerprint}:{changes.get(table, 0)}" for table in tables}
+
+
+# Text columns with at most this many distinct values have their values indexed
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", "200"))
+
+# Columns with longer values hold free text (notes, descriptions), not literals
+_MAX_VALUE_LENGTH = 100
+
+# Estimated distinct values per column from the planner statistics
+_PG_DISTINCT_QUERY = """
+SELECT s.attname,
+    CASE WHEN s.n_distinct < 0
+        THEN -s.n_distinct * GREATEST(c.reltuples, 0)
+        ELSE s.n_distinct
+    END
+FROM pg_stats s
+JOIN pg_class c
+    ON c.relname = s.tablename AND c.relnamespace = 'public'::regnamespace
+WHERE s.schemaname = 'public' AND s.tablename = :table
+"""
+
+
+def _column_values(datasource: str, table: str) -> dict[str, list[str]]:
+    engine = get_engine(datasource)
+    quote = engine.dialect.identifier_preparer.quote
+    columns = [
+        column["name"]
+        for column in inspect(engine).get_columns(table)
+        if _short_type(column["type"]) == "text"
+    ]
+    values = {}
+    with engine.connect() as connection:
+        estimates = {}
+        if engine.dialect.name == "postgresql":
+            # Skip the probe of columns the statistics already rule out
+            estimates = dict(
+                connection.execute(text(_PG_DISTINCT_QUERY), {"table": table}).all()
+            )
+        for column in columns:
+            if estimates.get(column, 0) > VALUE_INDEX_MAX_DISTINCT:
+                continue
+            rows = connection.execute(
+                text(
+                    f"SELECT DISTINCT {quote(column)} FROM {quote(table)}"
+                    f" WHERE {quote(column)} IS NOT NULL LIMIT :limit"
+                ),
+                {"limit": VALUE_INDEX_MAX_DISTINCT + 1},
+            ).scalars()
+            distinct = sorted(str(value) for value in rows)
+            if len(distinct) > VALUE_INDEX_MAX_DISTINCT:
+                continue
+            if any(len(value) > _MAX_VALUE_LENGTH for value in distinct):
+                continue
+            values[column] = distinct
+    return values
+
+
+def column_values(datasource: str, table: str, version: str) -> dict[str, list[str]]:
+    """Distinct values of the low-cardinality text columns of a table.
+
+    Only columns with at most `VALUE_INDEX_MAX_DISTINCT` distinct values, none
+    longer than 100 characters, are included. The values are cached per table
+    `version` (see `table_versions`), so workers share the probe queries.
+    """
+    return shared_cache.get_or_set(
+        "schema",
+        f"{datasource}/values/{table}/{version}",
+        lambda: _column_values(datasource, table),
+        SCHEMA_CACHE_TTL,
+    )
+
+
+# Datasources with more tables are not listed in the prompt; the agent
+# retrieves the tables it needs with find_relevant_tables instead
+PROMPT_MAX_TABLES = int(os.getenv("PROMPT_MAX_TABLES", "40"))
+
+
+def datasources_prompt() -> str:
+    """Describe every datasource and the digest of its schema for the agent."""
+    sections = []
+    for name in datasources.names():
+        source = datasources.get(name)
+        try:
+            digest = schema_digest(name)
+        except Exception as e:
+            logger.warning(f"Could not build the schema digest of {name}: {e}")
+            digest = "Schema unavailable, use sql_db_list_tables and sql_db_schema."
+        else:
+            table_count = digest.count("\n") + 1
+            if table_count > PROMPT_MAX_TABLES:
+                tool = (
+                    "find_relevant_tables"
+                    if RETRIEVAL_ENABLED
+                    else "sql_db_list_tables and sql_db_schema"
+                )
+                digest = (
+                    f"{table_count} tables, too many to list;"
+                    f" use {tool} to find the ones you need."
+                )
+        sections.append(f"## {name}: {source.description}\n{digest}")
+    return "\n\n".join(sections)
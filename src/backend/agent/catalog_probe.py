@@ -0,0 +1,157 @@
+import logging
+from collections import OrderedDict
+
+import orjson
+from sqlalchemy import Connection, inspect, text
+
+from backend.database import datasources
+from backend.utils.shared_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Columns of the requested tables, as a JSON array of [name, type] per table
+_PG_COLUMNS_QUERY = """
+SELECT c.relname::text, 0, json_agg(
+    json_build_array(a.attname, format_type(a.atttypid, a.atttypmod))
+    ORDER BY a.attnum
+)::text
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+WHERE c.relnamespace = 'public'::regnamespace
+    AND c.relname IN ({tables})
+    AND a.attnum > 0
+    AND NOT a.attisdropped
+GROUP BY c.relname
+"""
+
+
+def _literal(value: str) -> str:
+    """Quote a string as a SQL literal (standard_conforming_strings is on)."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _format_description(table: str, columns: list, rows: list[tuple]) -> str:
+    schema_str = ", ".join(f"{name} ({column_type})" for name, column_type in columns)
+    return f"Table: {table}\nSchema: {schema_str}\nSample rows: {rows}"
+
+
+class CatalogProbe:
+    """Describe tables and check queries on the read-only engine of a datasource.
+
+    On Postgres, the columns and sample rows of all the requested tables come
+    back from one statement: a UNION ALL of the column catalog and of a
+    `row_to_json` of each table's sample rows, all as text. The statement is
+    prepared on the server under a name derived from the tables, with the
+    PREPARE sent in the same round trip as the first EXECUTE, so describing
+    any set of tables takes one round trip and describing it again skips
+    parsing and planning. Each connection keeps its `max_prepared` most
+    recently used statements.
+    """
+
+    def __init__(self, sample_rows: int = 3, max_prepared: int = 64):
+        self.sample_rows = sample_rows
+        self.max_prepared = max_prepared
+
+    def _probe_query(self, connection: Connection, tables: list[str]) -> str:
+        quote = connection.dialect.identifier_preparer.quote
+        parts = [
+            _PG_COLUMNS_QUERY.format(tables=", ".join(_literal(t) for t in tables))
+        ]
+        for table in tables:
+            parts.append(
+                f"SELECT {_literal(table)}, 1, row_to_json(s)::text"
+                f" FROM (SELECT * FROM {quote(table)} LIMIT {self.sample_rows}) s"
+            )
+        return "\nUNION ALL\n".join(f"({part.strip()})" for part in parts)
+
+    def _execute_prepared(
+        self, connection: Connection, name: str, query: str
+    ) -> list[tuple]:
+        # Statements prepared on this session; the info lives with the
+        # DBAPI connection across checkouts
+        prepared: OrderedDict = connection.info.setdefault(
+            "catalog_probe_statements", OrderedDict()
+        )
+        statement = f"EXECUTE {name}"
+        if name in prepared:
+            prepared.move_to_end(name)
+        else:
+            statement = f"PREPARE {name} AS {query};\n{statement}"
+            if len(prepared) >= self.max_prepared:
+                oldest, _ = prepared.popitem(last=False)
+                statement = f"DEALLOCATE {oldest};\n{statement}"
+        try:
+            # No parameters, so `%` in identifiers is not a placeholder
+            rows = (
+                connection.execution_options(no_parameters=True)
+                .exec_driver_sql(statement)
+                .fetchall()
+            )
+        except Exception:
+            # Which statements exist on the session is unknown now
+            connection.invalidate()
+            raise
+        prepared[name] = True
+        return rows
+
+    def _describe_postgres(
+        self, connection: Connection, tables: list[str]
+    ) -> dict[str, str]:
+        name = "catalog_probe_" + cache_key(str(self.sample_rows), *tables)[:16]
+        rows = self._execute_prepared(
+            connection, name, self._probe_query(connection, tables)
+        )
+        columns = {table: [] for table in tables}
+        samples = {table: [] for table in tables}
+        for table, kind, payload in rows:
+            if kind == 0:
+                columns[table] = orjson.loads(payload)
+            else:
+                samples[table].append(tuple(orjson.loads(payload).values()))
+        return {
+            table: _format_description(table, columns[table], samples[table])
+            for table in tables
+        }
+
+    def _describe_generic(
+        self, connection: Connection, tables: list[str]
+    ) -> dict[str, str]:
+        quote = connection.dialect.identifier_preparer.quote
+        inspector = inspect(connection)
+        descriptions = {}
+        for table in tables:
+            columns = [
+                (column["name"], column["type"])
+                for column in inspector.get_columns(table)
+            ]
+            rows = connection.execute(
+                text(f"SELECT * FROM {quote(table)} LIMIT :limit"),
+                {"limit": self.sample_rows},
+            ).fetchall()
+            descriptions[table] = _format_description(table, columns, rows)
+        return descriptions
+
+    def describe(self, datasource: str, tables: list[str]) -> dict[str, str]:
+        """Describe the columns and sample rows of existing `tables`."""
+        if not tables:
+            return {}
+        engine = datasources.get_engine(datasource, read_only=True)
+        with engine.connect() as connection:
+            if engine.dialect.name == "postgresql":
+                return self._describe_postgres(connection, tables)
+            return self._describe_generic(connection, tables)
+
+    def explain(self, datasource: str, query: str) -> None:
+        """EXPLAIN `query` without running it; raises if it is not valid.
+
+        The read-only session also rejects a write smuggled in after a `;`.
+        """
+        engine = datasources.get_engine(datasource, read_only=True)
+        with engine.connect() as connection:
+            connection.execution_options(no_parameters=True).exec_driver_sql(
+                f"EXPLAIN {query}"
+            )
+
+
+# Create a global catalog probe
+catalog_probe = CatalogProbe()
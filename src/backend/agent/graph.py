@@ -1,33 +1,143 @@
+import os
+import threading
+from typing import Literal
+
 from langgraph.graph import END, START, StateGraph
+from langgraph.graph.state import CompiledStateGraph
 
+from backend.agent.budget import guard
 from backend.agent.node import (
     State,
     call_model,
     call_tool,
     create_visual,
     route_tools,
+    route_visual,
+    stop_run,
     suggest_follow_up_question,
 )
+from backend.agent.plan import (
+    execute_plan,
+    make_plan,
+    repair_plan,
+    route_execution,
+    route_plan,
+)
+from backend.utils.tracing import tracer
 
-# Build the graph
-graph = StateGraph(State)
-graph.add_node("call_model", call_model)
-graph.add_node("tools", call_tool)
-graph.add_node("create_visual", create_visual)
-graph.add_node("suggest_follow_up_question", suggest_follow_up_question)
+AgentMode = Literal["react", "plan"]
 
-graph.add_edge(START, "call_model")
-graph.add_conditional_edges(
-    "call_model",
-    route_tools,
-    {
-        "tools": "tools",
-        "suggest_follow_up_question": "suggest_follow_up_question",
-        "create_visual": "create_visual",
-        END: END,
-    },
-)
-graph.add_edge("tools", "call_model")
-graph.add_edge("create_visual", "call_model")
-graph.add_edge("suggest_follow_up_question", END)
-compiled_graph = graph.compile()
+# Graph used when a request does not choose one: "react" calls the model
+# before every tool step, "plan" plans all queries in one call and executes
+# them without the model (see backend.agent.plan)
+AGENT_MODE: AgentMode = os.getenv("AGENT_MODE", "react")
+
+
+def _add_node(graph: StateGraph, name: str, node) -> None:
+    # Every node run is a span of the run's trace (see backend.utils.tracing)
+    graph.add_node(name, tracer.traced(f"node.{name}")(node))
+
+
+def _to_model(state: State) -> str:
+    return "call_model"
+
+
+def _to_execution(state: State) -> str:
+    return "execute_plan"
+
+
+def build_graph(mode: AgentMode = "react") -> StateGraph:
+    """Build the (uncompiled) agent graph.
+
+    Every route into a node that calls the model or the database is guarded:
+    once the run used up a budget or loops, it goes to `stop_run` instead
+    (see backend.agent.budget).
+    """
+    graph = StateGraph(State)
+    _add_node(graph, "call_model", call_model)
+    _add_node(graph, "tools", call_tool)
+    _add_node(graph, "create_visual", create_visual)
+    _add_node(graph, "suggest_follow_up_question", suggest_follow_up_question)
+    _add_node(graph, "stop_run", stop_run)
+
+    if mode == "plan":
+        _add_node(graph, "make_plan", make_plan)
+        _add_node(graph, "execute_plan", execute_plan)
+        _add_node(graph, "repair_plan", repair_plan)
+        graph.add_edge(START, "make_plan")
+        graph.add_conditional_edges(
+            "make_plan",
+            guard(route_plan),
+            {
+                "execute_plan": "execute_plan",
+                "call_model": "call_model",
+                "stop_run": "stop_run",
+            },
+        )
+        graph.add_conditional_edges(
+            "execute_plan",
+            guard(route_execution),
+            {
+                "repair_plan": "repair_plan",
+                "create_visual": "create_visual",
+                "call_model": "call_model",
+                "stop_run": "stop_run",
+            },
+        )
+        graph.add_conditional_edges(
+            "repair_plan",
+            guard(_to_execution),
+            {"execute_plan": "execute_plan", "stop_run": "stop_run"},
+        )
+    else:
+        graph.add_edge(START, "call_model")
+
+    graph.add_conditional_edges(
+        "call_model",
+        guard(route_tools),
+        {
+            "tools": "tools",
+            "suggest_follow_up_question": "suggest_follow_up_question",
+            "create_visual": "create_visual",
+            "stop_run": "stop_run",
+            END: END,
+        },
+    )
+    graph.add_conditional_edges(
+        "tools",
+        guard(_to_model),
+        {"call_model": "call_model", "stop_run": "stop_run"},
+    )
+    graph.add_conditional_edges(
+        "create_visual",
+        guard(route_visual),
+        {
+            "call_model": "call_model",
+            "tools": "tools",
+            "create_visual": "create_visual",
+            "suggest_follow_up_question": "suggest_follow_up_question",
+            "stop_run": "stop_run",
+            END: END,
+        },
+    )
+    graph.add_edge("suggest_follow_up_question", END)
+    graph.add_edge("stop_run", END)
+    return graph
+
+
+_compiled_graphs: dict[str, CompiledStateGraph] = {}
+_compile_lock = threading.Lock()
+
+
+def get_compiled_graph(mode: AgentMode | None = None) -> CompiledStateGraph:
+    """Return the compiled agent graph of `mode`, compiling it once on first use.
+
+    Without a mode the graph of `AGENT_MODE` is returned. The graph is named
+    after its mode.
+    """
+    mode = mode or AGENT_MODE
+    if mode not in _compiled_graphs:
+        with _compile_lock:
+            if mode not in _compiled_graphs:
+                _compiled_graphs[mode] = build_graph(mode).compile(name=mode)
+    return _compiled_graphs[mode]
@@ -1,5 +1,7 @@
 import base64
 import logging
+import operator
+import time
 from typing import Annotated
 
 import pandas as pd
@@ -7,25 +9,74 @@ from langgraph.graph import END
 from langgraph.graph.message import add_messages
 from typing_extensions import TypedDict
 
-from backend.agent.tools import VISUALIZATION_TYPES, registry
+from backend.agent.budget import (
+    SQL_TOOLS,
+    STOP_REASONS,
+    error_signature,
+    stop_reason,
+    tokens_used,
+    tool_call_signature,
+)
+from backend.agent.results import result_registry
+from backend.agent.tools import SQL_CACHE_TTL, VISUALIZATION_TYPES, registry
+from backend.database import DEFAULT_DATASOURCE
+from backend.utils.charts import build_chart
 from backend.utils.get_langchain_llm import langchain_openai_client
+from backend.utils.metrics import metrics
+from backend.utils.rate_limit import call_with_rate_limit, llm_rate_limiter
+from backend.utils.run_log import run_log
+from backend.utils.shared_cache import cache_key, shared_cache
+from backend.utils.tracing import tracer
 
 
 # State type
 class State(TypedDict):
     messages: Annotated[list, add_messages]
-    data: pd.DataFrame | None = None
+    run_id: str
+    # ID of the latest query result in the result registry
+    data_id: str | None
     result: str | None
     visual_created: bool
     follow_up_question: str | None
     visualization_type: VISUALIZATION_TYPES | None
     visualization_image: str | None
+    # Budget spent by this run (see backend.agent.budget): LLM calls, tokens,
+    # seconds spent in SQL tools and the time.time() the run started
+    llm_calls: Annotated[int, operator.add]
+    tokens: Annotated[int, operator.add]
+    sql_seconds: Annotated[float, operator.add]
+    started_at: float
+    # Signatures of the tool calls and errors so far, to detect loops
+    tool_signatures: Annotated[list[str], operator.add]
+    # Why the run was cut short, None if it finished
+    stop_reason: str | None
+    # Plan-and-execute mode (see backend.agent.plan): the `Plan` as a dict
+    # (steps, visualization_type, python_code), the index of the next step to
+    # run, the repairs made so far and the error of the step that failed
+    plan: dict | None
+    plan_step: int
+    plan_repairs: int
+    plan_error: str | None
 
 
 # LLM
 llm = langchain_openai_client
 
 
+def invoke_llm(messages: list, **kwargs):
+    """Invoke the LLM paced by the shared adaptive rate limiter."""
+    with tracer.span("llm.invoke", messages=len(messages)) as span:
+        response = call_with_rate_limit(
+            llm_rate_limiter, llm.invoke, messages, **kwargs
+        )
+        if span is not None:
+            span.set(
+                tokens=tokens_used(response),
+                tool_calls=len(getattr(response, "tool_calls", None) or []),
+            )
+    return response
+
+
 def post_process_message(message: dict) -> str:
     if message.type == "ai":
         # logging.error(f"AI message: {message.tool_calls}")
@@ -43,19 +94,21 @@ def post_process_message(message: dict) -> str:
 def call_model(state: State) -> State:
     # Call the LLM with the current messages and available tools (schemas)
 
-    response_message = llm.invoke(
+    response_message = invoke_llm(
         state["messages"], tools=registry.list_tools_by_schema()
     )
     return {
         "messages": [
             post_process_message(response_message),
         ],
-        "data": state["data"],
+        "data_id": state["data_id"],
         "result": response_message.content,
         "visual_created": state["visual_created"],  # Initially set to False
         "follow_up_question": None,
         "visualization_type": state["visualization_type"],
         "visualization_image": state["visualization_image"],
+        "llm_calls": 1,
+        "tokens": tokens_used(response_message),
     }
 
 
@@ -71,7 +124,7 @@ def suggest_follow_up_question(state: State) -> State:
 
     {DB_instruction_prompt}
     """
-    response_message = llm.invoke(
+    response_message = invoke_llm(
         [
             {"type": "system", "content": system_prompt},
             state["messages"][1],
@@ -84,6 +137,8 @@ def suggest_follow_up_question(state: State) -> State:
         "visual_created": state["visual_created"],
         "visualization_type": state["visualization_type"],
         "visualization_image": state["visualization_image"],
+        "llm_calls": 1,
+        "tokens": tokens_used(response_message),
     }
 
 
@@ -93,13 +148,16 @@ def call_tool(state: State) -> State:
     last_message = state["messages"][-1]
     tool_calls = last_message.tool_calls
     new_messages = []
-    data = state["data"]
+    signatures = []
+    sql_seconds = 0.0
+    data_id = state["data_id"]
     visualization_type = state["visualization_type"]
 
     for tool_call in tool_calls:
         tool_name = tool_call["name"]
         tool_args = tool_call["args"]
         tool = registry.get_tool(tool_name)
+        seconds = 0.0
         if tool is None:
             result = f"Tool {tool_name} not found."
         elif tool_name == "create_visualization_with_python_code":
@@ -108,12 +166,28 @@ def call_tool(state: State) -> State:
             )
             continue
         else:
-            result = tool(**tool_args)
+            start = time.perf_counter()
+            with tracer.span(f"tool.{tool_name}"):
+                result = tool(**tool_args)
+            seconds = time.perf_counter() - start
+            if tool_name in SQL_TOOLS:
+                sql_seconds += seconds
 
         if isinstance(result, str):
             text_content = result
         elif isinstance(result, tuple):
-            text_content, data, visualization_type = result
+            # Tools choosing among several queries also return the one used
+            text_content, data, visualization_type, *query = result
+            if data is not None:
+                # Keep the DataFrame out of the graph state, refer to it by ID
+                data_id = tool_call["id"]
+                result_registry.put(
+                    state["run_id"],
+                    data_id,
+                    query[0] if query else tool_args.get("query", ""),
+                    data,
+                    tool_args.get("datasource", DEFAULT_DATASOURCE),
+                )
         else:
             raise ValueError(
                 f"Unexpected result type from tool {tool_name}: {type(result)}"
@@ -124,117 +198,242 @@ def call_tool(state: State) -> State:
             "content": str(text_content),
         }
         new_messages.append(tool_response_message)
+        signatures.append(tool_call_signature(tool_call))
+        error = error_signature(tool_name, str(text_content))
+        if error:
+            signatures.append(error)
+        run_log.log_tool_call(
+            tool_name,
+            tool_args,
+            seconds,
+            str(text_content).split("\n")[0] if error else None,
+        )
 
     return {
         "messages": new_messages,
-        "data": data,
+        "data_id": data_id,
         "result": None,
         "visualization_type": visualization_type,
         "visualization_image": state["visualization_image"],
+        "sql_seconds": sql_seconds,
+        "tool_signatures": signatures,
+    }
+
+
+def _render_visualization(python_code: str, df: pd.DataFrame) -> str:
+    """Run the generated plotting code on `df` and return the figure as base64 PNG."""
+    import io
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    local_vars = {
+        "pd": pd,
+        "sns": sns,
+        "plt": plt,
+        "df": df,
+    }
+
+    # Capture stdout for any print statements
+    stdout_buffer = io.StringIO()
+    result = "Error executing visualization code: no figure was created"
+
+    try:
+        # Switch backend to prevent showing plot windows
+        plt.switch_backend("Agg")
+
+        # Redirect stdout to capture print outputs
+        import sys
+
+        original_stdout = sys.stdout
+        sys.stdout = stdout_buffer
+
+        # Execute the visualization code using the same dict for globals and locals
+        # This allows functions defined in the code string to access variables
+        # defined at the top level of the same code string.
+        exec(python_code, {}, local_vars)
+
+        # Get print output
+        # stdout_content = stdout_buffer.getvalue()
+
+        # Restore stdout
+        sys.stdout = original_stdout
+
+        # Check if a matplotlib figure was created
+        fig = None
+        for var_name, var_value in local_vars.items():
+            if isinstance(var_value, plt.Figure):
+                fig = var_value
+                break
+
+        # If no explicit figure was assigned to a variable, get the current figure
+        if fig is None and plt.get_fignums():
+            fig = plt.gcf()
+
+        # Process visualization results
+        if fig:
+            # Save the figure to a BytesIO object
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", bbox_inches="tight")
+            buf.seek(0)
+
+            # Convert to base64 for easy display in web
+            result = base64.b64encode(buf.getvalue()).decode("utf-8")
+
+    except Exception as e:
+        result = f"Error executing visualization code: {e}"
+    return result
+
+
+def _visualize_with_code(state: State, tool_call: dict) -> State:
+    """Render the chart from the plotting code the model wrote."""
+    python_code = tool_call["args"]["python_code"]
+    stored = result_registry.get(state["run_id"], state["data_id"])
+    if stored is None:
+        # No query result, or it expired from the registry
+        result = (
+            "Error executing visualization code: no query result to plot,"
+            " run sql_db_query first"
+        )
+    else:
+        # Charts are cached by code and query, shared by all workers
+        chart_key = cache_key(python_code, stored.datasource, stored.query)
+        result = shared_cache.get("chart", chart_key)
+    if result is None:
+        # Slicing the Arrow table is zero-copy; only the 10 rows
+        # handed to the generated code are materialized in pandas
+        df = stored.table.slice(0, 10).to_pandas()
+        with tracer.span("render.code"):
+            result = _render_visualization(python_code, df)
+        if "Error executing visualization code" not in result:
+            shared_cache.set("chart", chart_key, result, SQL_CACHE_TTL)
+
+    tool_response_message = {
+        "type": "tool",
+        "tool_call_id": tool_call["id"],
+        "content": str(result),
     }
 
+    if "Error executing visualization code" not in result:
+        print(
+            "GRAPH GENERATED, visualization_type: ",
+            state["visualization_type"],
+            "visualization_image: ",
+            result,
+        )
+        return {
+            "messages": [tool_response_message],
+            "data_id": None,
+            "result": state["result"],
+            "visualization_type": state["visualization_type"],
+            "visualization_image": result,
+            "visual_created": True,
+        }
+    else:
+        logging.error("Error creating visualization")
+        return {
+            "messages": [tool_response_message],
+            "data_id": state["data_id"],
+            "result": state["result"],
+            "visualization_type": state["visualization_type"],
+            "visualization_image": result,
+            "visual_created": False,
+            "tool_signatures": [
+                tool_call_signature(tool_call),
+                error_signature(tool_call["name"], result),
+            ],
+        }
 
-def create_visual(state: State) -> State:  # noqa: C901
-    for last_message in state["messages"][::-1]:
-        if last_message.type == "ai":
-            for tool_call in last_message.tool_calls:
-                if tool_call["name"] == "create_visualization_with_python_code":
-                    tool_args = tool_call["args"]
-                    python_code = tool_args["python_code"]
-
-                    import io
-
-                    import matplotlib.pyplot as plt
-                    import seaborn as sns
-
-                    df = state["data"].head(10).copy(deep=True)
-
-                    local_vars = {
-                        "pd": pd,
-                        "sns": sns,
-                        "plt": plt,
-                        "df": df,
-                    }
-
-                    # Capture stdout for any print statements
-                    stdout_buffer = io.StringIO()
-
-                    try:
-                        # Switch backend to prevent showing plot windows
-                        plt.switch_backend("Agg")
-
-                        # Redirect stdout to capture print outputs
-                        import sys
-
-                        original_stdout = sys.stdout
-                        sys.stdout = stdout_buffer
-
-                        # Execute the visualization code using the same dict for globals and locals
-                        # This allows functions defined in the code string to access variables
-                        # defined at the top level of the same code string.
-                        exec(python_code, {}, local_vars)
-
-                        # Get print output
-                        # stdout_content = stdout_buffer.getvalue()
-
-                        # Restore stdout
-                        sys.stdout = original_stdout
-
-                        # Check if a matplotlib figure was created
-                        fig = None
-                        for var_name, var_value in local_vars.items():
-                            if isinstance(var_value, plt.Figure):
-                                fig = var_value
-                                break
-
-                        # If no explicit figure was assigned to a variable, get the current figure
-                        if fig is None and plt.get_fignums():
-                            fig = plt.gcf()
-
-                        # Process visualization results
-                        if fig:
-                            # Save the figure to a BytesIO object
-                            buf = io.BytesIO()
-                            fig.savefig(buf, format="png", bbox_inches="tight")
-                            buf.seek(0)
-
-                            # Convert to base64 for easy display in web
-                            result = base64.b64encode(buf.getvalue()).decode("utf-8")
-
-                    except Exception as e:
-                        result = f"Error executing visualization code: {e}"
-
-                    tool_response_message = {
-                        "type": "tool",
-                        "tool_call_id": tool_call["id"],
-                        "content": str(result),
-                    }
-
-                    if "Error executing visualization code" not in result:
-                        print(
-                            "GRAPH GENERATED, visualization_type: ",
-                            state["visualization_type"],
-                            "visualization_image: ",
-                            result,
-                        )
-                        return {
-                            "messages": [tool_response_message],
-                            "data": None,
-                            "result": state["result"],
-                            "visualization_type": state["visualization_type"],
-                            "visualization_image": result,
-                            "visual_created": True,
-                        }
-                    else:
-                        logging.error("Error creating visualization")
-                        return {
-                            "messages": [tool_response_message],
-                            "data": state["data"],
-                            "result": state["result"],
-                            "visualization_type": state["visualization_type"],
-                            "visualization_image": result,
-                            "visual_created": False,
-                        }
+
+def _visualize_with_builder(state: State) -> State:
+    """Chart the latest query result by its visualization type, without the model."""
+    image = None
+    stored = None
+    if state["data_id"] and state["visualization_type"]:
+        stored = result_registry.get(state["run_id"], state["data_id"])
+    if stored is not None:
+        chart_key = cache_key(
+            "builder", state["visualization_type"], stored.datasource, stored.query
+        )
+        image = shared_cache.get("chart", chart_key)
+        if image is None:
+            try:
+                with tracer.span(
+                    "render.chart", visualization_type=state["visualization_type"]
+                ):
+                    image = build_chart(stored.table, state["visualization_type"])
+            except Exception as e:
+                logging.error(f"Building the chart failed: {e}")
+            if image is not None:
+                shared_cache.set("chart", chart_key, image, SQL_CACHE_TTL)
+        metrics.increment(
+            "charts_built", outcome="chart" if image is not None else "none"
+        )
+    # The visualization step is done, with or without a chart
+    return {
+        "visualization_image": image or state["visualization_image"],
+        "visual_created": True,
+    }
+
+
+def create_visual(state: State) -> State:
+    """Chart the latest query result.
+
+    The plotting code of a `create_visualization_with_python_code` call is
+    only run for custom charts the model asked for; otherwise the chart is
+    built from the result's `visualization_type` (see backend.utils.charts).
+    """
+    last_message = state["messages"][-1]
+    for tool_call in getattr(last_message, "tool_calls", None) or []:
+        if tool_call["name"] == "create_visualization_with_python_code":
+            return _visualize_with_code(state, tool_call)
+    return _visualize_with_builder(state)
+
+
+def _latest_result_text(state: State) -> str | None:
+    """The summary the model was shown of the latest query result."""
+    for message in reversed(state["messages"]):
+        if getattr(message, "tool_call_id", None) == state["data_id"]:
+            return str(message.content)
+    return None
+
+
+def stop_run(state: State) -> State:
+    """Cut the run short and answer with the best result so far, without the model.
+
+    Tool calls the model still asked for are answered as not run, so the
+    history stays valid for the next turn. The answer is the model's own if it
+    already gave one, otherwise the latest query result, which is still charted.
+    """
+    reason = stop_reason(state) or "llm_calls"
+    explanation = STOP_REASONS[reason]
+    logging.warning(f"Stopping run {state['run_id']}: {explanation}")
+    metrics.increment("runs_stopped", reason=reason)
+
+    last_message = state["messages"][-1]
+    tool_calls = getattr(last_message, "tool_calls", None) or []
+    messages = [
+        {
+            "type": "tool",
+            "tool_call_id": tool_call["id"],
+            "content": f"Not run: {explanation}.",
+        }
+        for tool_call in tool_calls
+    ]
+    answer = state["result"]
+    if last_message.type != "ai" or tool_calls or not last_message.content:
+        answer = f"I stopped before finishing because {explanation}."
+        latest = _latest_result_text(state) if state["data_id"] else None
+        if latest:
+            answer += f" This is the latest result I found:\n\n{latest}"
+        else:
+            answer += " I have no result yet, please try a more specific question."
+        messages.append({"type": "ai", "content": answer})
+
+    update = {"messages": messages, "result": answer, "stop_reason": reason}
+    if not state["visual_created"]:
+        update.update(_visualize_with_builder(state))
+    return update
 
 
 # Routing function
@@ -254,3 +453,10 @@ def route_tools(state: State):
     elif state["follow_up_question"] is None:
         return "suggest_follow_up_question"
     return END
+
+
+def route_visual(state: State):
+    """Let the model see the result of its plotting code; a built chart needs no reply."""
+    if state["messages"][-1].type == "tool":
+        return "call_model"
+    return route_tools(state)
@@ -0,0 +1,286 @@
+import logging
+import os
+import time
+import uuid
+
+import pyarrow as pa
+from pydantic import BaseModel, Field
+
+from backend.agent.budget import tokens_used
+from backend.agent.node import State, llm
+from backend.agent.prompt import PLAN_PROMPT, REPAIR_PROMPT
+from backend.agent.results import result_registry
+from backend.agent.retrieval import format_retrieval, schema_index
+from backend.agent.tools import (
+    DATASOURCE_DESCRIPTION,
+    VISUALIZATION_TYPES,
+    CreateVisualizationWithPythonCode,
+    create_visualization_with_python_code,
+    sql_db_query,
+    sql_db_query_checker,
+)
+from backend.database import DEFAULT_DATASOURCE
+from backend.utils.metrics import metrics
+from backend.utils.rate_limit import call_with_rate_limit, llm_rate_limiter
+from backend.utils.run_log import run_log
+from backend.utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Most queries a plan may contain
+PLAN_MAX_STEPS = int(os.getenv("PLAN_MAX_STEPS", "5"))
+# Repair calls per run before the agent falls back to the tool loop
+PLAN_MAX_REPAIRS = int(os.getenv("PLAN_MAX_REPAIRS", "2"))
+
+
+class PlanStep(BaseModel):
+    purpose: str = Field(..., description="What this query finds out.")
+    query: str = Field(..., description="A complete, read-only SQL query.")
+    datasource: str = Field(DEFAULT_DATASOURCE, description=DATASOURCE_DESCRIPTION)
+
+
+class Plan(BaseModel):
+    steps: list[PlanStep] = Field(
+        ...,
+        description="The queries to run in order. The result of the last one answers the question.",
+    )
+    visualization_type: VISUALIZATION_TYPES = Field(
+        ..., description="The type of chart for the result of the last query."
+    )
+    python_code: str | None = Field(
+        None,
+        description="Only when the user asks for a chart the visualization type cannot show: "
+        + CreateVisualizationWithPythonCode.model_fields["python_code"].description,
+    )
+
+
+class RepairedQuery(BaseModel):
+    query: str = Field(..., description="The corrected SQL query.")
+
+
+def invoke_structured(schema: type[BaseModel], messages: list) -> tuple[BaseModel, int]:
+    """Invoke the LLM for a response in the shape of `schema`, paced like all calls.
+
+    Returns the response and the tokens it used.
+    """
+    with tracer.span(
+        "llm.invoke", messages=len(messages), schema=schema.__name__
+    ) as span:
+        response = call_with_rate_limit(
+            llm_rate_limiter,
+            llm.with_structured_output(schema, include_raw=True).invoke,
+            messages,
+        )
+        tokens = tokens_used(response["raw"])
+        if span is not None:
+            span.set(tokens=tokens)
+    if response["parsing_error"] is not None:
+        raise response["parsing_error"]
+    return response["parsed"], tokens
+
+
+def _latest_question(messages: list) -> str:
+    for message in reversed(messages):
+        if message.type == "human":
+            return str(message.content)
+    return ""
+
+
+def _tool_exchange(name: str, args: dict, content: str) -> tuple[str, list[dict]]:
+    """A tool call and its response as messages, as if the model had made the call."""
+    call_id = f"call_{uuid.uuid4().hex[:24]}"
+    return call_id, [
+        {
+            "type": "ai",
+            "content": "",
+            "tool_calls": [{"id": call_id, "name": name, "args": args}],
+        },
+        {"type": "tool", "tool_call_id": call_id, "content": content},
+    ]
+
+
+def _run_step(step: dict, visualization_type: str) -> tuple[str, pa.Table | None]:
+    """Validate and run a planned query.
+
+    Returns the text for the model and the result, which is None if the step
+    failed: the query is invalid, fails, or returns no rows while comparing
+    a column to a value it does not contain.
+    """
+    args = {"query": step["query"], "datasource": step["datasource"]}
+    start = time.perf_counter()
+    check = sql_db_query_checker(**args)
+    valid = check.startswith("Query is valid.")
+    run_log.log_tool_call(
+        sql_db_query_checker.name,
+        args,
+        time.perf_counter() - start,
+        None if valid else check.split("\n")[0],
+    )
+    if not valid:
+        return check, None
+    args.update(reasoning=step["purpose"], visualization_type=visualization_type)
+    start = time.perf_counter()
+    content, table, _ = sql_db_query(**args)
+    run_log.log_tool_call(
+        sql_db_query.name,
+        args,
+        time.perf_counter() - start,
+        content.split("\n")[0] if table is None else None,
+    )
+    warnings = check.split("\n")[1:]
+    if table is not None and table.num_rows == 0 and warnings:
+        return "\n".join(["The query returned no rows.", *warnings]), None
+    return content, table
+
+
+def make_plan(state: State) -> State:
+    """Ask the model for all queries, and any custom chart code, in a single call."""
+    question = _latest_question(state["messages"])
+    relevant = ""
+    if schema_index.enabled:
+        try:
+            relevant = format_retrieval(schema_index.search(question))
+        except Exception as e:
+            logger.warning(f"Retrieving tables for the plan failed: {e}")
+    prompt = PLAN_PROMPT.format(max_steps=PLAN_MAX_STEPS, relevant=relevant)
+    try:
+        plan, tokens = invoke_structured(
+            Plan, [*state["messages"], {"type": "system", "content": prompt}]
+        )
+    except Exception as e:
+        # The tool loop takes over
+        logger.error(f"Planning failed: {e}")
+        metrics.increment("plan_fallbacks", reason="plan")
+        return {"plan": None, "llm_calls": 1}
+    plan.steps = plan.steps[:PLAN_MAX_STEPS]
+    metrics.observe("plan_steps", len(plan.steps))
+    return {
+        "plan": plan.model_dump(),
+        "plan_step": 0,
+        "plan_repairs": 0,
+        "plan_error": None,
+        "visualization_type": plan.visualization_type,
+        "llm_calls": 1,
+        "tokens": tokens,
+    }
+
+
+def execute_plan(state: State) -> State:
+    """Run the remaining steps of the plan without consulting the model.
+
+    Every step is recorded as a `sql_db_query` call, so the model sees the
+    results as if it had made the calls. Stops at the first failing step;
+    once the repairs are used up the error is handed to the tool loop.
+    """
+    plan = state["plan"]
+    messages = []
+    data_id = state["data_id"]
+    start = time.perf_counter()
+    for index in range(state["plan_step"], len(plan["steps"])):
+        step = plan["steps"][index]
+        content, table = _run_step(step, plan["visualization_type"])
+        if table is None and state["plan_repairs"] < PLAN_MAX_REPAIRS:
+            return {
+                "messages": messages,
+                "data_id": data_id,
+                "plan_step": index,
+                "plan_error": content,
+                "sql_seconds": time.perf_counter() - start,
+            }
+        args = {
+            "query": step["query"],
+            "reasoning": step["purpose"],
+            "visualization_type": plan["visualization_type"],
+            "datasource": step["datasource"],
+        }
+        call_id, exchange = _tool_exchange(sql_db_query.name, args, content)
+        messages += exchange
+        if table is None:
+            metrics.increment("plan_fallbacks", reason="repairs")
+            return {
+                "messages": messages,
+                "data_id": data_id,
+                "plan_step": index,
+                "plan_error": content,
+                "sql_seconds": time.perf_counter() - start,
+            }
+        result_registry.put(
+            state["run_id"], call_id, step["query"], table, step["datasource"]
+        )
+        data_id = call_id
+
+    if plan["python_code"]:
+        # A custom chart, rendered by create_visual from this call
+        call_id = f"call_{uuid.uuid4().hex[:24]}"
+        messages.append(
+            {
+                "type": "ai",
+                "content": "",
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "name": create_visualization_with_python_code.name,
+                        "args": {"python_code": plan["python_code"]},
+                    }
+                ],
+            }
+        )
+    return {
+        "messages": messages,
+        "data_id": data_id,
+        "plan_step": len(plan["steps"]),
+        "plan_error": None,
+        "sql_seconds": time.perf_counter() - start,
+    }
+
+
+def repair_plan(state: State) -> State:
+    """Ask the model to correct the query of the failed step."""
+    plan = state["plan"]
+    index = state["plan_step"]
+    step = plan["steps"][index]
+    prompt = REPAIR_PROMPT.format(
+        purpose=step["purpose"],
+        datasource=step["datasource"],
+        query=step["query"],
+        error=state["plan_error"],
+    )
+    metrics.increment("plan_repairs")
+    tokens = 0
+    try:
+        repaired, tokens = invoke_structured(
+            RepairedQuery, [*state["messages"], {"type": "system", "content": prompt}]
+        )
+        query = repaired.query
+    except Exception as e:
+        logger.error(f"Repairing the plan failed: {e}")
+        query = step["query"]
+    steps = list(plan["steps"])
+    steps[index] = {**step, "query": query}
+    return {
+        "plan": {**plan, "steps": steps},
+        "plan_repairs": state["plan_repairs"] + 1,
+        "plan_error": None,
+        "llm_calls": 1,
+        "tokens": tokens,
+    }
+
+
+def route_plan(state: State) -> str:
+    """Execute the plan, or let the tool loop answer when there is nothing to run."""
+    if state.get("plan") and state["plan"]["steps"]:
+        return "execute_plan"
+    return "call_model"
+
+
+def route_execution(state: State) -> str:
+    """Repair a failed step, fall back to the tool loop, or let the model answer.
+
+    A custom chart is rendered first; the standard chart is built after the
+    answer, like in the tool loop.
+    """
+    if state["plan_error"] is None:
+        return "create_visual" if state["plan"]["python_code"] else "call_model"
+    if state["plan_repairs"] < PLAN_MAX_REPAIRS:
+        return "repair_plan"
+    return "call_model"
@@ -1,50 +1,14 @@
-DB_INSTRUCTION_PROMPT = """
-You will beworking with the Northwind database, a classic relational schema for business data. Here is a summary of the tables and their relationships:
-
-Main Tables and Relationships:
-
-- categories: Stores product categories. Each product belongs to a category.
-- customer_customer_demo: Junction table linking customers and customer_demographics, representing many-to-many relationships.
-- customer_demographics: Stores demographic information for customers.
-- customers: Stores customer information. Each order is placed by a customer.
-- employees: Stores employee information. Each order is handled by an employee. Employees are assigned to territories (many-to-many).
-- employee_territories: Junction table linking employees and territories.
-- order_details: Junction table linking orders and products, containing details for each product in an order (many-to-many).
-- orders: Stores order information. Linked to customers, employees, shippers, and order_details.
-- products: Stores product information. Each product belongs to a category and a supplier. Linked to order_details.
-- region: Stores region information. Linked to territories.
-- shippers: Stores shipping company information. Each order is shipped by a shipper.
-- suppliers: Stores supplier information. Each product has a supplier.
-- territories: Stores sales territory information. Linked to region and employee_territories.
-- us_states: Stores US state information (for address normalization).
-
-Key Relationship Types:
-
-One-to-Many:
-  - categories → products
-  - suppliers → products
-  - customers → orders
-  - employees → orders
-  - shippers → orders
-  - region → territories
-
-Many-to-Many (via junction tables):
-  - orders ↔ products (order_details)
-  - employees ↔ territories (employee_territories)
-  - customers ↔ customer_demographics (customer_customer_demo)
-
-Summary:
-The Northwind schema models a business where customers place orders for products, which are supplied by suppliers and shipped by shippers. Employees manage orders and are assigned to territories, which are grouped into regions. Junction tables are used for many-to-many relationships, ensuring data normalization and flexibility.
-
-Instructions:
-Use this schema context to inform your data analysis, SQL query generation, and insights. When asked about relationships, always refer to this structure. If you need to join tables, use the described relationships to construct accurate queries.
+import logging
 
-"""
+from backend.agent.catalog import RETRIEVAL_ENABLED, datasources_prompt, list_tables
+from backend.rollups import rollup_manager, rollup_prompt
+
+logger = logging.getLogger(__name__)
 
 # System prompt
 # To start you should ALWAYS look at the tables in the database to see what you
 # can query. Do NOT skip this step.
-SYSTEM_PROMPT = """
+SYSTEM_PROMPT_TEMPLATE = """
 # YOUR HIGH LEVEL TASKS
 
 You are an expert data analyst agent with deep knowledge of sql queries. Your task is to analyze data based on user's question and answer in a helpful way.
@@ -54,15 +18,17 @@ You are an expert data analyst agent with deep knowledge of sql queries. Your ta
 - Please keep going until the user's query is completely resolved, before ending your turn and yielding back to the user. Only terminate your turn when you are sure that the problem is solved.
 - You MUST plan extensively before each function call, and reflect extensively on the outcomes of the previous function calls.
 - DO NOT do this entire process by making function calls only, as this can impair your ability to solve the problem and think insightfully.
-- If it makes sense to crete a visualization to answer the data, please do so, also when user does not explicitly ask for it.
+- A chart of the result of your latest query is created automatically, using the visualization type you choose for the query; pick the type that shows the answer best. Only call create_visualization_with_python_code when the user asks for a chart that a bar, line, pie or scatter chart of the result cannot show.
 
 # SQL RELATED INSTRUCTIONS
 
 - Use the {dialect} dialect for all SQL queries.
-- To start you should ALWAYS look at the tables in the database to see what you
-can query. Do NOT skip this step.
-- Ask the schema of the most relevant tables from the point of view of answering the uses's question
-- If there are references to time suchs as "last quarter" or "last month", interpret
+- Pick the datasource that holds the data for the user's question and pass its
+name as the `datasource` argument of every SQL tool.
+- The tables and columns of every datasource are listed under DATASOURCES below.
+Only call sql_db_list_tables and sql_db_schema when a schema is marked unavailable
+or you need sample rows to see how values are formatted.
+{retrieval}- If there are references to time suchs as "last quarter" or "last month", interpret
 the time referring to last data that is available and check what is the most recent
 temporal data that exists in the database. If you are not sure how to interpret the time,
 ask the user for clarification.
@@ -77,11 +43,84 @@ executing a query, rewrite the query and try again.
 database.
 - DO NOT SUGGEST any follow up questions, only answer the question.
 
-# DATABASE INSTRUCTIONS
+# DATASOURCES
+
+The schema of every datasource, generated from the live database. Each line
+reads `table (approximate rows): column type, ...`. Columns without a type are
+text, `PK` marks primary key columns and `->table` a foreign key to that table.
+Use these column names directly; call sql_db_schema only to see sample rows.
+
+{datasources}
+{rollups}
+
+"""
+
+
+# Instructions for the retrieval tools, only registered with RETRIEVAL_ENABLED
+RETRIEVAL_PROMPT = """- Call find_relevant_tables when a datasource is too large to be listed, or to
+get the exact spelling of the names (countries, categories, ...) you filter on.
+- Before filtering on a name you are not sure how the database spells, call
+lookup_values instead of probing with SELECT DISTINCT queries.
+"""
+
+
+def rollups_prompt() -> str:
+    """Describe the rollups that exist in the database, if any.
+
+    The table list is cached like the schema and cleared when rollups are
+    created, so rollups that are disabled or failed are never advertised.
+    """
+    if not rollup_manager.enabled:
+        return ""
+    try:
+        tables = set(list_tables(rollup_manager.datasource))
+    except Exception as e:
+        logger.warning(f"Could not list the rollups: {e}")
+        return ""
+    rollups = [rollup for rollup in rollup_manager.rollups if rollup.name in tables]
+    if not rollups:
+        return ""
+    return "\n# ROLLUPS\n\n" + rollup_prompt(rollup_manager.datasource, rollups) + "\n"
+
+
+def build_system_prompt() -> str:
+    """Build the system prompt with a summary of the registered datasources."""
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        dialect="PostgreSQL",
+        datasources=datasources_prompt(),
+        retrieval=RETRIEVAL_PROMPT if RETRIEVAL_ENABLED else "",
+        rollups=rollups_prompt(),
+    )
+
+
+# Plan-and-execute mode: appended to the conversation for the planner
+PLAN_PROMPT = """
+# PLAN
+
+Plan how to answer the user's latest question in one go, without calling tools.
+Write every SQL query needed to answer it, at most {max_steps}, in the order they
+must run; each query must be complete and runnable on its own. The result of the
+last query is shown to the user and charted by its visualization type. Use the
+table and column names listed under DATASOURCES and the exact values below.
+If the question needs no data, return no steps.
+
+{relevant}
+"""
 
-{DB_INSTRUCTION_PROMPT}
+# Plan-and-execute mode: asks for a corrected query after a step failed
+REPAIR_PROMPT = """
+# REPAIR
 
-""".format(
-    dialect="PostgreSQL",
-    DB_INSTRUCTION_PROMPT=DB_INSTRUCTION_PROMPT,
-)
+This query of your plan failed.
+
+Purpose: {purpose}
+Datasource: {datasource}
+Query:
+{query}
+
+Error:
+{error}
+
+Return the corrected query. Fix the cause of the error, e.g. the table or column
+name or the spelling of a value, and keep the purpose of the query.
+"""
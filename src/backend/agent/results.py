@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import orjson
+import pandas as pd
+import pyarrow as pa
+
+from backend.database import DEFAULT_DATASOURCE
+from backend.utils.arrow_utils import to_pandas
+from backend.utils.shared_cache import SharedCache, shared_cache
+
+# Number of rows of a query result that is shown to the LLM
+RESULT_PREVIEW_ROWS = 20
+
+_TYPE_NAMES = {
+    "i": "int",
+    "u": "int",
+    "f": "float",
+    "b": "bool",
+    "M": "datetime",
+    "m": "timedelta",
+}
+
+
+@dataclass
+class StoredResult:
+    query: str
+    table: pa.Table
+    datasource: str = DEFAULT_DATASOURCE
+    created_at: float = field(default_factory=time.time)
+
+
+class ResultRegistry:
+    """Per-run store of query results, referenced by result ID.
+
+    Results are kept in this process as immutable Arrow tables, so the
+    visualization step can slice and read them without copying. Keeping them
+    here instead of in the graph state keeps the state small.
+    Only the `max_runs` most recent runs are kept, each for at most `ttl`
+    seconds.
+
+    The export endpoint re-runs the query of a result, so only the query and
+    its datasource go to the shared cache, for whichever worker handles the
+    download.
+    """
+
+    namespace = "results"
+
+    def __init__(self, cache: SharedCache, max_runs: int = 64, ttl: float = 3600):
+        self.cache = cache
+        self.max_runs = max_runs
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._runs: OrderedDict[str, dict[str, StoredResult]] = OrderedDict()
+
+    def put(
+        self,
+        run_id: str,
+        result_id: str,
+        query: str,
+        table: pa.Table,
+        datasource: str = DEFAULT_DATASOURCE,
+    ):
+        """Store the result of `query` on `datasource` under (`run_id`, `result_id`)."""
+        with self._lock:
+            self._runs.setdefault(run_id, {})[result_id] = StoredResult(
+                query, table, datasource
+            )
+            self._runs.move_to_end(run_id)
+            self._evict()
+        self.cache.set_bytes(
+            self.namespace,
+            f"{run_id}/{result_id}",
+            orjson.dumps({"datasource": datasource, "query": query}),
+            self.ttl,
+        )
+
+    def get(self, run_id: str, result_id: str | None) -> StoredResult | None:
+        """Get a result stored in this process, or None if it is unknown or
+        expired."""
+        if result_id is None:
+            return None
+        with self._lock:
+            self._evict()
+            return self._runs.get(run_id, {}).get(result_id)
+
+    def get_query(self, run_id: str, result_id: str) -> tuple[str, str] | None:
+        """Get the (datasource, query) of a result stored by any worker."""
+        stored = self.get(run_id, result_id)
+        if stored is not None:
+            return stored.datasource, stored.query
+        data = self.cache.get_bytes(self.namespace, f"{run_id}/{result_id}")
+        if data is None:
+            return None
+        reference = orjson.loads(data)
+        return reference["datasource"], reference["query"]
+
+    def list_ids(self, run_id: str) -> list[str]:
+        """List the result IDs stored for a run in this process, oldest first."""
+        with self._lock:
+            return list(self._runs.get(run_id, {}))
+
+    def get_table(self, run_id: str, result_id: str | None) -> pa.Table | None:
+        """Get the Arrow table of a stored result."""
+        result = self.get(run_id, result_id)
+        return result.table if result is not None else None
+
+    def get_frame(self, run_id: str, result_id: str | None) -> pd.DataFrame | None:
+        """Get a stored result as an Arrow-backed DataFrame (zero-copy)."""
+        table = self.get_table(run_id, result_id)
+        return to_pandas(table) if table is not None else None
+
+    def _evict(self) -> None:
+        while len(self._runs) > self.max_runs:
+            self._runs.popitem(last=False)
+        expire_before = time.time() - self.ttl
+        for run_id in [
+            run_id
+            for run_id, results in self._runs.items()
+            if max(r.created_at for r in results.values()) < expire_before
+        ]:
+            del self._runs[run_id]
+
+
+def _column_type(series: pd.Series) -> str:
+    if isinstance(series.dtype, pd.ArrowDtype):
+        arrow_type = series.dtype.pyarrow_dtype
+        if pa.types.is_date(arrow_type):
+            return "date"
+        if pa.types.is_timestamp(arrow_type):
+            return "datetime"
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            return "text"
+    type_name = _TYPE_NAMES.get(series.dtype.kind)
+    if type_name is not None:
+        return type_name
+    # Object columns: infer from the values (e.g. Postgres dates come back as
+    # Python date objects)
+    inferred = pd.api.types.infer_dtype(series.head(RESULT_PREVIEW_ROWS))
+    return {"string": "text", "empty": "text", "decimal": "float"}.get(
+        inferred, inferred
+    )
+
+
+def format_result(df: pd.DataFrame, max_rows: int = RESULT_PREVIEW_ROWS) -> str:
+    """Render a query result compactly for the LLM.
+
+    The output has a typed header, the first `max_rows` rows as CSV and, when
+    rows are left out, min/max/mean/sum of the numeric columns over all rows.
+    """
+    n_rows, n_cols = df.shape
+    shown = min(n_rows, max_rows)
+    lines = [
+        f"{n_rows} rows x {n_cols} columns"
+        + (f" (first {shown} shown)" if shown < n_rows else ""),
+        "columns: " + ", ".join(f"{col}:{_column_type(df[col])}" for col in df.columns),
+    ]
+    if n_rows == 0:
+        return "\n".join(lines)
+
+    head = df.head(max_rows)
+    float_cols = head.select_dtypes("float").columns
+    if len(float_cols):
+        head = head.round({col: 4 for col in float_cols})
+    lines.append(head.to_csv(index=False).rstrip("\n"))
+
+    numeric = df.select_dtypes("number")
+    if shown < n_rows and not numeric.empty:
+        stats = numeric.agg(["min", "max", "mean", "sum"]).round(4)
+        lines.append("stats (min,max,mean,sum over all rows):")
+        lines.extend(
+            f"{col}: " + ",".join(f"{v:.10g}" for v in stats[col])
+            for col in stats.columns
+        )
+    return "\n".join(lines)
+
+
+# Create a global registry
+result_registry = ResultRegistry(shared_cache)
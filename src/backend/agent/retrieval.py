@@ -0,0 +1,621 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import inspect
+
+from backend.agent.catalog import (
+    RETRIEVAL_ENABLED,
+    column_values,
+    schema_digest,
+    table_versions,
+)
+from backend.database import datasources, get_engine
+from backend.utils.metrics import metrics
+
+try:
+    # Optional: local sentence embeddings to rank tables by meaning
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[^\W_]+")
+_CAMEL_CASE = re.compile(r"([a-z0-9])([A-Z])")
+_STOPWORDS = frozenset(
+    "a an and are by did do does for from has have how in is it me of on or per"
+    " show the to was were what which who with".split()
+)
+
+# Constant of the reciprocal rank fusion of the BM25 and embedding rankings
+_RRF_K = 60
+
+
+def tokenize(text: str) -> list[str]:
+    """Split identifiers and text into lowercase words with plurals folded.
+
+    `OrderDetails`, `order_details` and "order details" all become
+    `["order", "detail"]`.
+    """
+    tokens = []
+    for word in _WORD.findall(_CAMEL_CASE.sub(r"\1 \2", text).lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class BM25Index:
+    """In-memory BM25 index whose documents can be added and removed one by one."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        # doc id -> (term frequencies, length, payload)
+        self._docs: dict[str, tuple[Counter, int, Any]] = {}
+        # term -> {doc id: term frequency}
+        self._postings: dict[str, dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, text: str, payload: Any = None) -> None:
+        """Index `text` under `doc_id`, replacing a previous document."""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self.remove(doc_id)
+            length = sum(terms.values())
+            self._docs[doc_id] = (terms, length, payload)
+            self._total_length += length
+            for term, frequency in terms.items():
+                self._postings[term][doc_id] = frequency
+
+    def remove(self, doc_id: str) -> None:
+        """Remove a document if it is indexed."""
+        with self._lock:
+            doc = self._docs.pop(doc_id, None)
+            if doc is None:
+                return
+            terms, length, _ = doc
+            self._total_length -= length
+            for term in terms:
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+
+    def remove_prefix(self, prefix: str) -> None:
+        """Remove all documents whose id starts with `prefix`."""
+        with self._lock:
+            for doc_id in [d for d in self._docs if d.startswith(prefix)]:
+                self.remove(doc_id)
+
+    def search(
+        self, query: str, k: int = 10, prefix: str = "", min_coverage: float = 0
+    ) -> list[tuple[float, str, Any]]:
+        """Return the best `k` documents as (score, doc id, payload) tuples.
+
+        Only documents whose id starts with `prefix` are considered, and only
+        those containing at least `min_coverage` of their distinct terms in
+        the query.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._docs)
+            if not count:
+                return []
+            average_length = self._total_length / count or 1
+            scores: dict[str, float] = defaultdict(float)
+            matched: Counter = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc_id, frequency in postings.items():
+                    if not doc_id.startswith(prefix):
+                        continue
+                    length = self._docs[doc_id][1]
+                    scores[doc_id] += (
+                        idf
+                        * frequency
+                        * (self.k1 + 1)
+                        / (
+                            frequency
+                            + self.k1 * (1 - self.b + self.b * length / average_length)
+                        )
+                    )
+                    matched[doc_id] += 1
+            results = [
+                (score, doc_id, self._docs[doc_id][2])
+                for doc_id, score in scores.items()
+                if matched[doc_id] >= min_coverage * len(self._docs[doc_id][0])
+            ]
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:k]
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams of the lowercase words of `text`, padded like Postgres' pg_trgm."""
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _initials(text: str) -> str:
+    words = _WORD.findall(text.lower())
+    return "".join(word[0] for word in words) if len(words) > 1 else ""
+
+
+class TrigramIndex:
+    """In-memory fuzzy index of short strings by trigram similarity.
+
+    Similarity is the Jaccard index of the trigram sets, like pg_trgm's
+    `similarity()`. Strings equal up to case and punctuation score 1, and an
+    abbreviation matches the words it stands for ("UK" and "United Kingdom")
+    with `acronym_score`.
+    """
+
+    def __init__(self, acronym_score: float = 0.5):
+        self.acronym_score = acronym_score
+        self._lock = threading.RLock()
+        # doc id -> (trigrams, normalized text, initials, payload)
+        self._docs: dict[str, tuple[set[str], str, str, Any]] = {}
+        self._postings: dict[str, set[str]] = defaultdict(set)
+        # Normalized text and initials -> doc ids
+        self._normalized: dict[str, set[str]] = defaultdict(set)
+        self._initials: dict[str, set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, text: str, payload: Any = None) -> None:
+        """Index `text` under `doc_id`, replacing a previous document."""
+        grams = trigrams(text)
+        normalized = _normalize(text)
+        initials = _initials(text)
+        with self._lock:
+            self.remove(doc_id)
+            self._docs[doc_id] = (grams, normalized, initials, payload)
+            for gram in grams:
+                self._postings[gram].add(doc_id)
+            self._normalized[normalized].add(doc_id)
+            if initials:
+                self._initials[initials].add(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        """Remove a document if it is indexed."""
+        with self._lock:
+            doc = self._docs.pop(doc_id, None)
+            if doc is None:
+                return
+            grams, normalized, initials, _ = doc
+            for lookup, keys in (
+                (self._postings, grams),
+                (self._normalized, [normalized]),
+                (self._initials, [initials] if initials else []),
+            ):
+                for key in keys:
+                    lookup[key].discard(doc_id)
+                    if not lookup[key]:
+                        del lookup[key]
+
+    def remove_prefix(self, prefix: str) -> None:
+        """Remove all documents whose id starts with `prefix`."""
+        with self._lock:
+            for doc_id in [d for d in self._docs if d.startswith(prefix)]:
+                self.remove(doc_id)
+
+    def search(
+        self,
+        text: str,
+        k: int = 5,
+        prefix: str = "",
+        threshold: float = 0.3,
+        accept: Callable[[Any], bool] | None = None,
+    ) -> list[tuple[float, str, Any]]:
+        """Return the `k` most similar documents as (score, doc id, payload) tuples.
+
+        Only documents whose id starts with `prefix`, whose payload passes
+        `accept` and whose similarity is at least `threshold` are returned.
+        """
+        grams = trigrams(text)
+        normalized = _normalize(text)
+        with self._lock:
+            scores: dict[str, float] = {}
+            shared: Counter = Counter()
+            for gram in grams:
+                shared.update(self._postings.get(gram, ()))
+            for doc_id, count in shared.items():
+                size = len(self._docs[doc_id][0])
+                scores[doc_id] = count / (len(grams) + size - count)
+            acronyms = self._initials.get(normalized, set()) | self._normalized.get(
+                _initials(text), set()
+            )
+            for doc_id in acronyms:
+                scores[doc_id] = max(scores.get(doc_id, 0), self.acronym_score)
+            for doc_id in self._normalized.get(normalized, ()):
+                scores[doc_id] = 1.0
+            results = [
+                (score, doc_id, self._docs[doc_id][3])
+                for doc_id, score in scores.items()
+                if score >= threshold
+                and doc_id.startswith(prefix)
+                and (accept is None or accept(self._docs[doc_id][3]))
+            ]
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:k]
+
+
+# Literals compared to a column: `[table.]column = 'value'` (also <> and !=)
+# and `[table.]column [NOT] IN ('value', ...)`
+_COMPARISON = re.compile(
+    r"(?:\b(\w+)\.)?\b(\w+)\s*(?:=|<>|!=)\s*('(?:[^']|'')*')", re.IGNORECASE
+)
+_IN_LIST = re.compile(
+    r"(?:\b(\w+)\.)?\b(\w+)\s+(?:NOT\s+)?IN\s*\(\s*('(?:[^']|'')*'"
+    r"(?:\s*,\s*'(?:[^']|'')*')*)\s*\)",
+    re.IGNORECASE,
+)
+_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+
+
+def _compared_literals(query: str) -> list[tuple[str | None, str, str]]:
+    """(table or alias, column, value) of the string literals compared to columns."""
+    literals = []
+    for pattern in (_COMPARISON, _IN_LIST):
+        for qualifier, column, values in pattern.findall(query):
+            for value in _LITERAL.findall(values):
+                literals.append((qualifier or None, column, value.replace("''", "'")))
+    return literals
+
+
+@dataclass
+class RetrievalResult:
+    # (datasource, table) pairs, most relevant first
+    tables: list[tuple[str, str]] = field(default_factory=list)
+    # (datasource, table, column, value) tuples, best match first
+    values: list[tuple[str, str, str, str]] = field(default_factory=list)
+
+
+class SchemaIndex:
+    """Retrieval index over the tables and low-cardinality values of all datasources.
+
+    Each table is a document made of its name, column names and comments;
+    each distinct value of a low-cardinality text column (see
+    `catalog.column_values`) is a document of its own. Tables are ranked by
+    BM25, boosted by the values they contain that match the question, and,
+    when `sentence-transformers` is installed and `embedding_model` is set,
+    fused with a ranking by embedding similarity. The values are also kept in
+    a trigram index to look up misspelled or abbreviated literals. Refreshes
+    only re-index the tables whose version changed.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = 300,
+        embedding_model: str = "",
+        enabled: bool = True,
+    ):
+        self.refresh_interval = refresh_interval
+        self.embedding_model = embedding_model
+        # Whether the values are indexed for lookups and literal checks
+        self.enabled = enabled
+        self.tables = BM25Index()
+        self.values = BM25Index()
+        self.value_lookup = TrigramIndex()
+        # "datasource/table" -> {column: set of values}
+        self._column_values: dict[str, dict[str, set[str]]] = {}
+        self._encoder = None
+        self._embeddings: dict[str, Any] = {}
+        self._versions: dict[str, dict[str, str]] = {}
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_env(cls) -> "SchemaIndex":
+        """Create an index configured by `RETRIEVAL_*` environment variables."""
+        return cls(
+            refresh_interval=float(os.getenv("RETRIEVAL_REFRESH_INTERVAL", "300")),
+            embedding_model=os.getenv("RETRIEVAL_EMBEDDING_MODEL", ""),
+            enabled=RETRIEVAL_ENABLED,
+        )
+
+    def _get_encoder(self):
+        if self._encoder is None and self.embedding_model:
+            if SentenceTransformer is None:
+                logger.warning(
+                    "RETRIEVAL_EMBEDDING_MODEL requires sentence-transformers,"
+                    " ranking tables with BM25 only"
+                )
+                self.embedding_model = ""
+            else:
+                self._encoder = SentenceTransformer(self.embedding_model)
+        return self._encoder
+
+    def _index_table(self, datasource: str, table: str, version: str) -> None:
+        inspector = inspect(get_engine(datasource))
+        columns = inspector.get_columns(table)
+        try:
+            comment = inspector.get_table_comment(table).get("text") or ""
+        except NotImplementedError:
+            comment = ""
+        # The table name counts double, it says the most about the table
+        document = " ".join(
+            [
+                table,
+                table,
+                comment,
+                *(column["name"] for column in columns),
+                *(column.get("comment") or "" for column in columns),
+            ]
+        )
+        doc_id = f"{datasource}/{table}"
+        self.tables.add(doc_id, document, (datasource, table))
+        encoder = self._get_encoder()
+        if encoder is not None:
+            self._embeddings[doc_id] = encoder.encode(
+                document, normalize_embeddings=True
+            )
+
+        self.values.remove_prefix(f"{doc_id}/")
+        self.value_lookup.remove_prefix(f"{doc_id}/")
+        values_by_column = column_values(datasource, table, version)
+        for column, values in values_by_column.items():
+            for value in values:
+                payload = (datasource, table, column, value)
+                self.values.add(f"{doc_id}/{column}/{value}", value, payload)
+                self.value_lookup.add(f"{doc_id}/{column}/{value}", value, payload)
+        self._column_values[doc_id] = {
+            column: set(values) for column, values in values_by_column.items()
+        }
+
+    def refresh(self, datasource: str) -> int:
+        """Re-index the tables of a datasource that changed since the last refresh.
+
+        Returns the number of tables indexed.
+        """
+        with self._refresh_lock:
+            start = time.perf_counter()
+            versions = table_versions(datasource)
+            indexed = self._versions.get(datasource, {})
+            for table in set(indexed) - set(versions):
+                self.tables.remove(f"{datasource}/{table}")
+                self.values.remove_prefix(f"{datasource}/{table}/")
+                self.value_lookup.remove_prefix(f"{datasource}/{table}/")
+                self._embeddings.pop(f"{datasource}/{table}", None)
+                self._column_values.pop(f"{datasource}/{table}", None)
+            changed = [t for t, v in versions.items() if indexed.get(t) != v]
+            for table in changed:
+                self._index_table(datasource, table, versions[table])
+            self._versions[datasource] = versions
+        if changed:
+            elapsed = time.perf_counter() - start
+            metrics.observe("retrieval_refresh_seconds", elapsed, datasource=datasource)
+            logger.info(
+                f"Indexed {len(changed)} tables of {datasource} in {elapsed:.2f}s"
+            )
+        return len(changed)
+
+    def _ensure_indexed(self, datasource: str | None) -> None:
+        names = [datasource] if datasource else datasources.names()
+        for name in names:
+            datasources.get(name)
+            if name not in self._versions:
+                self.refresh(name)
+
+    def search(
+        self, question: str, datasource: str | None = None, k: int = 5
+    ) -> RetrievalResult:
+        """Find the `k` tables and values most relevant to `question`.
+
+        Searches one datasource, or all of them when `datasource` is None.
+        Datasources that were never indexed are indexed first.
+        """
+        self._ensure_indexed(datasource)
+        start = time.perf_counter()
+        prefix = f"{datasource}/" if datasource else ""
+        # A value must be (mostly) spelled out in the question to match
+        value_hits = self.values.search(question, k, prefix, min_coverage=0.5)
+        scores: dict[str, float] = defaultdict(float)
+        for score, doc_id, _ in self.tables.search(question, len(self.tables), prefix):
+            scores[doc_id] = score
+        for score, _, (name, table, _, _) in value_hits:
+            scores[f"{name}/{table}"] += score / 2
+        ranking = sorted(scores, key=scores.get, reverse=True)
+
+        encoder = self._get_encoder()
+        if encoder is not None and self._embeddings:
+            query = encoder.encode(question, normalize_embeddings=True)
+            candidates = [d for d in self._embeddings if d.startswith(prefix)]
+            by_similarity = sorted(
+                candidates,
+                key=lambda doc_id: float(self._embeddings[doc_id] @ query),
+                reverse=True,
+            )
+            fused: dict[str, float] = defaultdict(float)
+            for ranked in (ranking, by_similarity):
+                for rank, doc_id in enumerate(ranked):
+                    fused[doc_id] += 1 / (_RRF_K + rank)
+            ranking = sorted(fused, key=fused.get, reverse=True)
+
+        result = RetrievalResult(
+            tables=[tuple(doc_id.split("/", 1)) for doc_id in ranking[:k]],
+            values=[payload for _, _, payload in value_hits],
+        )
+        metrics.observe("retrieval_search_seconds", time.perf_counter() - start)
+        return result
+
+    def lookup(
+        self,
+        value: str,
+        datasource: str | None = None,
+        column: str | None = None,
+        k: int = 5,
+    ) -> list[tuple[float, tuple[str, str, str, str]]]:
+        """Find the indexed values most similar to `value`.
+
+        `column` is a column name or `table.column` to restrict the lookup to.
+        Returns (similarity, (datasource, table, column, value)) pairs.
+        """
+        if not self.enabled:
+            raise RuntimeError(
+                "Value lookup is disabled, query the column with ILIKE instead"
+            )
+        self._ensure_indexed(datasource)
+        table, _, name = (column or "").rpartition(".")
+
+        def accept(payload: tuple[str, str, str, str]) -> bool:
+            return (not name or payload[2] == name) and (
+                not table or payload[1] == table
+            )
+
+        prefix = f"{datasource}/" if datasource else ""
+        start = time.perf_counter()
+        matches = self.value_lookup.search(value, k, prefix, accept=accept)
+        metrics.observe("value_lookup_seconds", time.perf_counter() - start)
+        return [(score, payload) for score, _, payload in matches]
+
+    def check_literals(self, datasource: str, query: str) -> list[str]:
+        """Warn about string literals in `query` that are not values of their column.
+
+        Only columns whose values are indexed are checked; each warning
+        suggests the most similar values. Nothing is checked when the index
+        is disabled.
+        """
+        if not self.enabled:
+            return []
+        self._ensure_indexed(datasource)
+        # The refresh thread replaces entries while the literals are checked
+        indexed = list(self._column_values.items())
+        warnings = []
+        for qualifier, column, value in _compared_literals(query):
+            # Indexed columns with this name: (table, column) -> values
+            columns = {}
+            for key, by_column in indexed:
+                if key.startswith(f"{datasource}/") and column in by_column:
+                    columns[(key.split("/", 1)[1], column)] = by_column[column]
+            if qualifier and any(table == qualifier for table, _ in columns):
+                # Otherwise the qualifier is an alias and any table may match
+                columns = {
+                    key: values
+                    for key, values in columns.items()
+                    if key[0] == qualifier
+                }
+            if not columns or any(value in values for values in columns.values()):
+                continue
+            matches = self.value_lookup.search(
+                value,
+                prefix=f"{datasource}/",
+                accept=lambda payload: (payload[1], payload[2]) in columns,
+            )
+            names = ", ".join(f"{table}.{column}" for table, column in columns)
+            warning = f"Warning: '{value}' is not a value of {names}."
+            if matches:
+                suggestions = dict.fromkeys(payload[3] for _, _, payload in matches)
+                warning += " Did you mean " + " or ".join(
+                    f"'{suggestion}'" for suggestion in suggestions
+                )
+                warning += "?"
+            else:
+                warning += " Use lookup_values to find the right value."
+            warnings.append(warning)
+        return warnings
+
+    def _refresh_all(self, names: list[str]) -> None:
+        for name in names:
+            try:
+                self.refresh(name)
+            except Exception as e:
+                metrics.increment("retrieval_failures", datasource=name)
+                logger.error(f"Indexing datasource {name} failed: {e}")
+
+    def _run(self) -> None:
+        self._refresh_all(datasources.names())
+        while not self._stop.wait(self.refresh_interval):
+            # Datasources without an open engine are refreshed on their next
+            # search, so the refresh does not keep idle engines alive
+            self._refresh_all(
+                [name for name in datasources.active_names() if name in self._versions]
+            )
+
+    def start(self) -> None:
+        """Index all datasources now and check for changes every `refresh_interval` seconds.
+
+        Runs in a daemon thread; with a `refresh_interval` of 0 the index is
+        only built at startup.
+        """
+        if self._thread is not None:
+            return
+        if self.refresh_interval <= 0:
+            self._stop.set()
+        self._thread = threading.Thread(
+            target=self._run, name="schema-index", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic refresh."""
+        self._stop.set()
+
+
+def format_retrieval(result: RetrievalResult) -> str:
+    """Describe the retrieved tables with their digest lines and the matched values."""
+    digests: dict[str, dict[str, str]] = {}
+    lines = ["Relevant tables:"]
+    for datasource, table in result.tables:
+        if datasource not in digests:
+            digests[datasource] = {
+                line.split(" ", 1)[0]: line
+                for line in schema_digest(datasource).splitlines()
+            }
+        lines.append(f"- {datasource}: {digests[datasource].get(table, table)}")
+    if len(lines) == 1:
+        lines.append("- none found, use sql_db_list_tables")
+    if result.values:
+        lines.append("Matching values:")
+        for datasource, table, column, value in result.values:
+            quoted = value.replace("'", "''")
+            lines.append(f"- {datasource}: {table}.{column} = '{quoted}'")
+    return "\n".join(lines)
+
+
+def format_lookup(value: str, matches: list[tuple[float, tuple]]) -> str:
+    """Describe the values found by `SchemaIndex.lookup`."""
+    if not matches:
+        return (
+            f"No value similar to '{value}' found. The column may have too many"
+            " distinct values to be indexed; query it with ILIKE instead."
+        )
+    lines = [f"Values similar to '{value}':"]
+    for score, (datasource, table, column, match) in matches:
+        quoted = match.replace("'", "''")
+        lines.append(f"- {datasource}: {table}.{column} = '{quoted}' ({score:.2f})")
+    return "\n".join(lines)
+
+
+# Create a global index
+schema_index = SchemaIndex.from_env()
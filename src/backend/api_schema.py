@@ -1,19 +1,108 @@
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import BaseModel, Field
 
 
+class ToolCall(BaseModel):
+    id: str | None = Field(default=None)
+    name: str
+    args: dict[str, Any] = Field(default_factory=dict)
+
+
+class Message(BaseModel):
+    type: str
+    content: str | list[Any] = Field(default="")
+    tool_calls: list[ToolCall] | None = Field(default=None)
+    tool_call_id: str | None = Field(default=None)
+
+    @classmethod
+    def from_langchain(cls, message: Any) -> "Message":
+        """Convert a LangChain message (or message dict) to the API schema."""
+        if isinstance(message, dict):
+            return cls.model_validate(message)
+        return cls(
+            type=message.type,
+            content=message.content,
+            tool_calls=getattr(message, "tool_calls", None) or None,
+            tool_call_id=getattr(message, "tool_call_id", None),
+        )
+
+
 class ChatRequest(BaseModel):
     messages: list[Any]
     result: str | None = Field(default=None)
     follow_up_question: str | None = Field(default=None)
+    # Only return the messages added by this run instead of the whole history
+    delta: bool = Field(default=False)
+    # Agent graph to run ("react" or "plan"); defaults to AGENT_MODE
+    mode: Literal["react", "plan"] | None = Field(default=None)
+
+
+class BudgetUsage(BaseModel):
+    # What the run spent and the limits, by budget: llm_calls, tokens,
+    # seconds and sql_seconds (0 means no limit)
+    used: dict[str, float] = Field(default_factory=dict)
+    limits: dict[str, float] = Field(default_factory=dict)
+    # Why the run was cut short, None if it finished
+    stop_reason: str | None = Field(default=None)
 
 
 class ChatResponse(BaseModel):
-    messages: list[Any]
+    messages: list[Message]
     result: str | None = Field(default=None)
     follow_up_question: str | None = Field(default=None)
     visualization_image: str | None = Field(default=None)
+    run_id: str | None = Field(default=None)
+    # Download links (relative to the backend URL) for the queries of this run
+    result_links: list[str] = Field(default_factory=list)
+    budget: BudgetUsage | None = Field(default=None)
+    # Trace of the run, see GET /debug/runs/{run_id}/timeline
+    trace_id: str | None = Field(default=None)
+
+
+class TimelineSpan(BaseModel):
+    name: str
+    span_id: str
+    parent_id: str | None = Field(default=None)
+    depth: int
+    # Milliseconds since the start of the run
+    start_ms: float
+    duration_ms: float
+    # Time not spent in child spans
+    self_ms: float
+    attributes: dict[str, Any] = Field(default_factory=dict)
+    error: str | None = Field(default=None)
+
+
+class TimelineResponse(BaseModel):
+    run_id: str
+    trace_id: str
+    duration_ms: float
+    # Self time by span category (node, llm, tool, sql, format, render)
+    self_time_ms: dict[str, float] = Field(default_factory=dict)
+    spans: list[TimelineSpan] = Field(default_factory=list)
+
+
+class RunReportResponse(BaseModel):
+    runs: int
+    slow_query_seconds: float
+    # Query shapes (literals replaced by ?) by total execution time
+    slow_query_shapes: list[dict[str, Any]] = Field(default_factory=list)
+    # Latest queries over the slow-query threshold
+    slow_queries: list[dict[str, Any]] = Field(default_factory=list)
+    repeated_questions: list[dict[str, Any]] = Field(default_factory=list)
+
+
+class IndexAdviceResponse(BaseModel):
+    datasource: str
+    dialect: str
+    # Candidates costed as HypoPG hypothetical indexes
+    hypothetical: bool
+    applied: bool = Field(default=False)
+    # Indexes by the total time of the query shapes that use them
+    recommendations: list[dict[str, Any]] = Field(default_factory=list)
+    # Per query shape: candidates, used indexes, estimated and measured improvement
+    shapes: list[dict[str, Any]] = Field(default_factory=list)
 
 
 class HealthResponse(BaseModel):
@@ -22,3 +111,9 @@ class HealthResponse(BaseModel):
 
 class ErrorResponse(BaseModel):
     DETAIL: str = "Something went wrong"
+
+
+class MetricsResponse(BaseModel):
+    counters: dict[str, float] = Field(default_factory=dict)
+    gauges: dict[str, float] = Field(default_factory=dict)
+    summaries: dict[str, dict[str, float]] = Field(default_factory=dict)
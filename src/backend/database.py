@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import Engine, create_engine, event
+
+from backend.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+if os.getenv("ENVIRONMENT") == "docker":
+    DATABASE_HOST = "db"
+else:
+    DATABASE_HOST = "0.0.0.0"
+
+DEFAULT_DATASOURCE = "northwind"
+
+
+@dataclass(frozen=True)
+class DataSource:
+    name: str
+    url: str
+    # One line describing the data, shown to the agent
+    description: str
+
+
+class DataSourceRegistry:
+    """Registry of the databases the agent can query.
+
+    Each datasource gets its own pooled engine, created on first use, and a
+    smaller read-only one for catalog probes. Engines that have not been
+    used for `idle_timeout` seconds are disposed, so registering more
+    databases does not keep more connections open.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = 600,
+        pool_size: int = 5,
+        max_overflow: int = 5,
+        read_only_pool_size: int = 2,
+        read_only_timeout: float = 10,
+    ):
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.read_only_pool_size = read_only_pool_size
+        self.read_only_timeout = read_only_timeout
+        self._lock = threading.Lock()
+        self._sources: dict[str, DataSource] = {}
+        # Keyed by datasource name and whether the engine is read-only
+        self._engines: dict[tuple[str, bool], Engine] = {}
+        self._last_used: dict[tuple[str, bool], float] = {}
+
+    @classmethod
+    def from_env(cls) -> "DataSourceRegistry":
+        """Create a registry configured by `DATASOURCE_*` environment variables."""
+        return cls(
+            idle_timeout=float(os.getenv("DATASOURCE_IDLE_TIMEOUT", "600")),
+            pool_size=int(os.getenv("DATASOURCE_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DATASOURCE_MAX_OVERFLOW", "5")),
+            read_only_pool_size=int(os.getenv("DATASOURCE_READ_ONLY_POOL_SIZE", "2")),
+            read_only_timeout=float(os.getenv("DATASOURCE_READ_ONLY_TIMEOUT", "10")),
+        )
+
+    def register(self, source: DataSource) -> DataSource:
+        """Register a datasource under its name."""
+        with self._lock:
+            self._sources[source.name] = source
+        return source
+
+    def names(self) -> list[str]:
+        """List the names of the registered datasources."""
+        return list(self._sources)
+
+    def active_names(self) -> list[str]:
+        """List the names of the datasources with an open engine."""
+        with self._lock:
+            return list(dict.fromkeys(name for name, _ in self._engines))
+
+    def get(self, name: str) -> DataSource:
+        """Get a datasource by name. Raises ValueError for unknown names."""
+        source = self._sources.get(name)
+        if source is None:
+            raise ValueError(
+                f"Unknown datasource '{name}'."
+                f" Available datasources: {', '.join(self._sources)}"
+            )
+        return source
+
+    def get_engine(
+        self, name: str = DEFAULT_DATASOURCE, read_only: bool = False
+    ) -> Engine:
+        """Return the engine of a datasource, creating it on first use.
+
+        The `read_only` engine has its own pool of `read_only_pool_size`
+        connections whose sessions cannot write, and cancels statements after
+        `read_only_timeout` seconds.
+        """
+        source = self.get(name)
+        key = (name, read_only)
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = (
+                    self._create_read_only_engine(source)
+                    if read_only
+                    else create_engine(
+                        source.url,
+                        pool_size=self.pool_size,
+                        max_overflow=self.max_overflow,
+                        pool_pre_ping=True,
+                    )
+                )
+                self._engines[key] = engine
+                kind = "read-only engine" if read_only else "engine"
+                logger.info(f"Created {kind} for datasource {name}")
+            self._last_used[key] = now
+            metrics.set_gauge("datasource_engines", len(self._engines))
+            return engine
+
+    def _create_read_only_engine(self, source: DataSource) -> Engine:
+        if source.url.startswith("postgresql"):
+            # Set by the server when the session starts, no extra round trip
+            timeout = int(self.read_only_timeout * 1000)
+            options = (
+                f"-c default_transaction_read_only=on -c statement_timeout={timeout}"
+            )
+            return create_engine(
+                source.url,
+                pool_size=self.read_only_pool_size,
+                max_overflow=0,
+                pool_pre_ping=True,
+                connect_args={"options": options},
+            )
+        engine = create_engine(
+            source.url, pool_size=self.read_only_pool_size, max_overflow=0
+        )
+        if engine.dialect.name == "sqlite":
+
+            @event.listens_for(engine, "connect")
+            def _query_only(dbapi_connection, connection_record):
+                dbapi_connection.execute("PRAGMA query_only = ON")
+
+        return engine
+
+    def _evict_idle(self, now: float) -> None:
+        for key, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_timeout:
+                # Connections still checked out are closed when returned
+                self._engines.pop(key).dispose()
+                del self._last_used[key]
+                logger.info(f"Disposed idle engine of datasource {key[0]}")
+
+    def dispose(self) -> None:
+        """Dispose all engines."""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+            self._last_used.clear()
+
+
+# Create a global registry with the databases loaded by docker-compose
+datasources = DataSourceRegistry.from_env()
+datasources.register(
+    DataSource(
+        name="northwind",
+        url=f"postgresql://user:password@{DATABASE_HOST}:5432/northwind",
+        description="Trading company: customers, orders, products, suppliers,"
+        " employees and shipping",
+    )
+)
+datasources.register(
+    DataSource(
+        name="chinook",
+        url=f"postgresql://user:password@{DATABASE_HOST}:5432/chinook",
+        description="Digital music store: artists, albums, tracks, playlists,"
+        " customers and invoices",
+    )
+)
+
+
+def get_engine(datasource: str = DEFAULT_DATASOURCE) -> Engine:
+    """Return the shared SQLAlchemy engine of a datasource."""
+    return datasources.get_engine(datasource)
@@ -14,3 +14,13 @@ class DetailedHTTPException(HTTPException):
 class ServiceUnavailableException(DetailedHTTPException):
     STATUS_CODE = status.HTTP_503_SERVICE_UNAVAILABLE
     DETAIL = "Service unavailable"
+
+
+class TooManyRequestsException(DetailedHTTPException):
+    STATUS_CODE = status.HTTP_429_TOO_MANY_REQUESTS
+    DETAIL = "Too many requests"
+
+
+class NotFoundException(DetailedHTTPException):
+    STATUS_CODE = status.HTTP_404_NOT_FOUND
+    DETAIL = "Not found"
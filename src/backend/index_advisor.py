@@ -0,0 +1,539 @@
+"""Recommend indexes for the queries the agent actually runs.
+
+The workload is read from the run log: the query shapes run by
+`sql_db_query` on a datasource, by total time. The columns each query
+filters and joins on become candidate indexes, and EXPLAIN tells which ones
+the planner would use:
+
+    uv run python -m backend.index_advisor --datasource northwind --limit 20
+    uv run python -m backend.index_advisor --apply
+
+On Postgres with the HypoPG extension the candidates are created as
+hypothetical indexes, so the estimated improvement costs nothing. `--apply`
+creates the useful indexes and measures every query before and after; on
+other databases or without HypoPG that is the only way to check them.
+"""
+
+import argparse
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+
+import orjson
+from sqlalchemy import Connection, Engine, inspect
+
+from backend.database import DEFAULT_DATASOURCE, get_engine
+from backend.utils.run_log import run_log
+
+try:
+    # Optional: SQL parser to find the columns a query filters and joins on
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.qualify import qualify
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:
+    sqlglot = None
+
+logger = logging.getLogger(__name__)
+
+# Most columns in one candidate index
+_MAX_INDEX_COLUMNS = 3
+# Longest identifier Postgres keeps
+_MAX_NAME_LENGTH = 63
+_SQLITE_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\S+)")
+
+
+@dataclass(frozen=True)
+class IndexCandidate:
+    table: str
+    columns: tuple[str, ...]
+
+    @property
+    def name(self) -> str:
+        return f"ix_{self.table}_{'_'.join(self.columns)}"[:_MAX_NAME_LENGTH]
+
+    def target(self, engine: Engine) -> str:
+        """`table (columns)`, identifiers quoted for the dialect."""
+        quote = engine.dialect.identifier_preparer.quote
+        columns = ", ".join(quote(column) for column in self.columns)
+        return f"{quote(self.table)} ({columns})"
+
+    def statement(self, engine: Engine, concurrently: bool = False) -> str:
+        quote = engine.dialect.identifier_preparer.quote
+        how = " CONCURRENTLY" if concurrently else ""
+        return (
+            f"CREATE INDEX{how} IF NOT EXISTS {quote(self.name)}"
+            f" ON {self.target(engine)}"
+        )
+
+
+@dataclass
+class QueryAdvice:
+    """The candidate indexes of one query shape and how they change its plan."""
+
+    shape: str
+    sql: str
+    count: int
+    total_seconds: float
+    candidates: list[IndexCandidate] = field(default_factory=list)
+    # Candidates the planner used
+    indexes: list[IndexCandidate] = field(default_factory=list)
+    cost_before: float | None = None
+    cost_after: float | None = None
+    ms_before: float | None = None
+    ms_after: float | None = None
+    error: str | None = None
+
+    @staticmethod
+    def _improvement(before: float | None, after: float | None) -> float | None:
+        if not before or after is None:
+            return None
+        return round(1 - after / before, 3)
+
+    @property
+    def estimated_improvement(self) -> float | None:
+        return self._improvement(self.cost_before, self.cost_after)
+
+    @property
+    def measured_improvement(self) -> float | None:
+        return self._improvement(self.ms_before, self.ms_after)
+
+    def to_dict(self) -> dict:
+        return {
+            "shape": self.shape,
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "candidates": [candidate.name for candidate in self.candidates],
+            "indexes": [index.name for index in self.indexes],
+            "cost_before": self.cost_before,
+            "cost_after": self.cost_after,
+            "estimated_improvement": self.estimated_improvement,
+            "ms_before": self.ms_before,
+            "ms_after": self.ms_after,
+            "measured_improvement": self.measured_improvement,
+            "error": self.error,
+        }
+
+
+def _operands(comparison: "exp.Expression") -> list:
+    if isinstance(comparison, exp.Binary):
+        return [comparison.this, comparison.expression]
+    return [comparison.this]
+
+
+def _predicate_columns(select: "exp.Select", tables: dict[str, str]) -> dict:
+    """Columns of each table compared in the WHERE and JOIN ... ON of `select`.
+
+    Returns `{table: (filter equality columns, filter range columns, join
+    columns)}` in query order; a join column is compared to another column.
+    Comparisons inside subqueries belong to their own scope.
+    """
+    predicates = [select.args.get("where")] + [
+        join.args.get("on") for join in select.args.get("joins") or []
+    ]
+    columns: dict[str, tuple[list[str], list[str], list[str]]] = {}
+    for predicate in filter(None, predicates):
+        for comparison in predicate.find_all(
+            exp.EQ, exp.In, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between
+        ):
+            if comparison.find_ancestor(exp.Select) is not select:
+                continue
+            operands = _operands(comparison)
+            if len(operands) == 2 and all(isinstance(o, exp.Column) for o in operands):
+                role = 2
+            else:
+                role = 0 if isinstance(comparison, (exp.EQ, exp.In)) else 1
+            for operand in operands:
+                if not isinstance(operand, exp.Column) or operand.table not in tables:
+                    continue
+                roles = columns.setdefault(tables[operand.table], ([], [], []))
+                if operand.name not in roles[role]:
+                    roles[role].append(operand.name)
+    return columns
+
+
+def candidate_indexes(
+    sql: str, schema: dict[str, dict[str, str]], dialect: str
+) -> list[IndexCandidate]:
+    """Indexes that could serve the filters and joins of `sql`.
+
+    Per table: one index on its equality filter columns followed by its
+    first range filter column, plus single-column indexes on each filter and
+    join column, so the planner can pick. Columns are resolved to tables
+    with `schema` (`{table: {column: type}}`), so unqualified and aliased
+    columns count too.
+    """
+    tree = qualify(
+        sqlglot.parse_one(sql, read=dialect),
+        schema=schema,
+        dialect=dialect,
+        validate_qualify_columns=False,
+    )
+    candidates = []
+    for scope in traverse_scope(tree):
+        if not isinstance(scope.expression, exp.Select):
+            continue
+        tables = {
+            alias: source.name
+            for alias, source in scope.sources.items()
+            if isinstance(source, exp.Table) and source.name in schema
+        }
+        for table, (equal, ranged, joined) in _predicate_columns(
+            scope.expression, tables
+        ).items():
+            composite = tuple([*equal, *ranged[:1]][:_MAX_INDEX_COLUMNS])
+            singles = [(column,) for column in dict.fromkeys(equal + ranged + joined)]
+            for columns in [composite, *singles]:
+                candidate = IndexCandidate(table, columns)
+                if columns and candidate not in candidates:
+                    candidates.append(candidate)
+    return candidates
+
+
+def _plan_indexes(plan: dict) -> set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= _plan_indexes(child)
+    return names
+
+
+class IndexAdvisor:
+    """Find the indexes that would speed up a workload on one database.
+
+    Candidates that are a prefix of an existing index (the primary key
+    included) are skipped. With HypoPG, a candidate is recommended when the
+    planner uses it for a query shape and the plan gets at least
+    `min_improvement` cheaper. Without it every candidate is a
+    recommendation until `advise(apply=True)` shows which ones are used.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        min_improvement: float = 0.1,
+        repeat: int = 3,
+        timeout: float = 30,
+    ):
+        self.engine = engine
+        self.min_improvement = min_improvement
+        self.repeat = repeat
+        self.timeout = timeout
+        self.dialect = "postgres" if engine.dialect.name == "postgresql" else "sqlite"
+
+    def _schema(self) -> tuple[dict, set]:
+        inspector = inspect(self.engine)
+        schema, existing = {}, set()
+        for table in inspector.get_table_names():
+            schema[table] = {
+                column["name"]: "text" for column in inspector.get_columns(table)
+            }
+            indexed = [inspector.get_pk_constraint(table)["constrained_columns"]]
+            indexed += [index["column_names"] for index in inspector.get_indexes(table)]
+            for columns in indexed:
+                for i in range(1, len(columns) + 1):
+                    existing.add((table, tuple(columns[:i])))
+        return schema, existing
+
+    def _has_hypopg(self, connection: Connection) -> bool:
+        if self.dialect != "postgres":
+            return False
+        return bool(
+            connection.exec_driver_sql(
+                "SELECT 1 FROM pg_extension WHERE extname = 'hypopg'"
+            ).scalar()
+        )
+
+    def _cost(self, connection: Connection, sql: str) -> tuple[float, set[str]]:
+        """Total cost of the plan of `sql` and the indexes it uses (Postgres)."""
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+        if isinstance(plan, str):
+            plan = orjson.loads(plan)
+        plan = plan[0]["Plan"]
+        return plan["Total Cost"], _plan_indexes(plan)
+
+    def _used_indexes(self, connection: Connection, sql: str) -> set[str]:
+        if self.dialect == "postgres":
+            return self._cost(connection, sql)[1]
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        return {
+            match.group(1) for row in rows for match in _SQLITE_INDEX.finditer(row[-1])
+        }
+
+    def _measure(self, connection: Connection, sql: str) -> float:
+        """Best of `repeat` runs of `sql`, in milliseconds, rows fetched."""
+        if self.dialect == "postgres":
+            connection.exec_driver_sql(
+                f"SET LOCAL statement_timeout = {int(self.timeout * 1000)}"
+            )
+        timings = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            connection.exec_driver_sql(sql).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        return round(min(timings), 3)
+
+    def _estimate(self, connection: Connection, advice: QueryAdvice) -> None:
+        """Cost `advice.sql` with its candidates as hypothetical indexes."""
+        advice.cost_before, _ = self._cost(connection, advice.sql)
+        hypothetical = {}
+        try:
+            for candidate in advice.candidates:
+                name = connection.exec_driver_sql(
+                    "SELECT indexname FROM hypopg_create_index(%(statement)s)",
+                    {"statement": f"CREATE INDEX ON {candidate.target(self.engine)}"},
+                ).scalar()
+                hypothetical[name] = candidate
+            advice.cost_after, used = self._cost(connection, advice.sql)
+        finally:
+            # Hypothetical indexes live in the session, not the transaction
+            connection.rollback()
+            connection.exec_driver_sql("SELECT hypopg_reset()")
+        if (advice.estimated_improvement or 0) >= self.min_improvement:
+            advice.indexes = [
+                hypothetical[name] for name in used if name in hypothetical
+            ]
+
+    def _create(self, indexes: list[IndexCandidate]) -> None:
+        quote = self.engine.dialect.identifier_preparer.quote
+        concurrently = self.dialect == "postgres"
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        with self.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            for index in indexes:
+                connection.exec_driver_sql(index.statement(self.engine, concurrently))
+                logger.info(f"Created index {index.name}")
+            for table in sorted({index.table for index in indexes}):
+                connection.exec_driver_sql(f"ANALYZE {quote(table)}")
+
+    def _drop(self, indexes: list[IndexCandidate]) -> None:
+        quote = self.engine.dialect.identifier_preparer.quote
+        with self.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            for index in indexes:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {quote(index.name)}")
+                logger.info(f"Dropped unused index {index.name}")
+
+    @staticmethod
+    def _fail(connection: Connection, advice: QueryAdvice, error: Exception) -> None:
+        """Record the error of a shape; its indexes no longer count as used."""
+        connection.rollback()
+        advice.indexes = []
+        advice.error = str(error).split("\n")[0]
+
+    def _measure_after(
+        self,
+        connection: Connection,
+        advice: QueryAdvice,
+        indexes: list[IndexCandidate],
+    ) -> None:
+        advice.ms_after = self._measure(connection, advice.sql)
+        names = self._used_indexes(connection, advice.sql)
+        advice.indexes = [index for index in indexes if index.name in names]
+        if self.dialect == "postgres":
+            advice.cost_after, _ = self._cost(connection, advice.sql)
+
+    def _apply(self, shapes: list[QueryAdvice], indexes: list[IndexCandidate]) -> None:
+        """Create `indexes`, measure every shape before and after, and drop
+        the ones no query used.
+
+        A shape whose query fails, e.g. on the statement timeout, gets the
+        error and does not keep any index; the unused indexes are dropped
+        whatever happens.
+        """
+        with self.engine.connect() as connection:
+            for advice in shapes:
+                try:
+                    advice.ms_before = self._measure(connection, advice.sql)
+                except Exception as e:
+                    self._fail(connection, advice, e)
+            connection.rollback()
+        used = set()
+        try:
+            self._create(indexes)
+            with self.engine.connect() as connection:
+                for advice in shapes:
+                    if advice.error:
+                        continue
+                    try:
+                        self._measure_after(connection, advice, indexes)
+                    except Exception as e:
+                        self._fail(connection, advice, e)
+                    used.update(advice.indexes)
+                connection.rollback()
+        finally:
+            self._drop([index for index in indexes if index not in used])
+
+    def _recommendations(self, shapes: list[QueryAdvice], created: bool) -> list[dict]:
+        recommendations: dict[IndexCandidate, dict] = {}
+        for advice in shapes:
+            for index in advice.indexes:
+                entry = recommendations.setdefault(
+                    index,
+                    {
+                        "table": index.table,
+                        "columns": list(index.columns),
+                        "name": index.name,
+                        "statement": index.statement(
+                            self.engine, self.dialect == "postgres"
+                        ),
+                        "created": created,
+                        "shapes": 0,
+                        "queries": 0,
+                        "total_seconds": 0.0,
+                    },
+                )
+                entry["shapes"] += 1
+                entry["queries"] += advice.count
+                entry["total_seconds"] = round(
+                    entry["total_seconds"] + advice.total_seconds, 3
+                )
+        return sorted(
+            recommendations.values(),
+            key=lambda entry: entry["total_seconds"],
+            reverse=True,
+        )
+
+    def _add_candidates(self, shapes: list[QueryAdvice]) -> None:
+        schema, existing = self._schema()
+        for advice in shapes:
+            try:
+                advice.candidates = [
+                    candidate
+                    for candidate in candidate_indexes(advice.sql, schema, self.dialect)
+                    if (candidate.table, candidate.columns) not in existing
+                ]
+            except sqlglot.errors.SqlglotError as e:
+                advice.error = f"Could not parse the query: {e}"
+
+    def _evaluate(self, shapes: list[QueryAdvice]) -> bool:
+        """Pick the indexes of each shape; True if they were costed with HypoPG."""
+        with self.engine.connect() as connection:
+            hypothetical = self._has_hypopg(connection)
+            for advice in shapes:
+                if not advice.candidates:
+                    continue
+                try:
+                    if hypothetical:
+                        self._estimate(connection, advice)
+                        continue
+                    advice.indexes = advice.candidates
+                    if self.dialect == "postgres":
+                        advice.cost_before, _ = self._cost(connection, advice.sql)
+                except Exception as e:
+                    connection.rollback()
+                    advice.indexes = []
+                    advice.error = str(e).split("\n")[0]
+            connection.rollback()
+        return hypothetical
+
+    def advise(self, workload: list[dict], apply: bool = False) -> dict:
+        """Recommend indexes for `workload` (see `RunLog.workload`).
+
+        With `apply`, the recommended indexes (every candidate when plans
+        cannot be costed) are created and the unused ones dropped again.
+        """
+        if sqlglot is None:
+            raise RuntimeError(
+                "The index advisor needs sqlglot: install the duckdb extra"
+            )
+        shapes = [
+            QueryAdvice(
+                query["shape"],
+                query["sql"],
+                query["count"],
+                query["total_seconds"] or 0.0,
+            )
+            for query in workload
+        ]
+        self._add_candidates(shapes)
+        hypothetical = self._evaluate(shapes)
+        indexes = list(dict.fromkeys(index for a in shapes for index in a.indexes))
+        if apply and indexes:
+            self._apply([advice for advice in shapes if not advice.error], indexes)
+        return {
+            "dialect": self.dialect,
+            "hypothetical": hypothetical,
+            "applied": apply,
+            "recommendations": self._recommendations(shapes, apply),
+            "shapes": [advice.to_dict() for advice in shapes],
+        }
+
+
+def advise(
+    datasource: str = DEFAULT_DATASOURCE,
+    limit: int = 20,
+    hours: float | None = None,
+    apply: bool = False,
+    min_improvement: float = 0.1,
+) -> dict:
+    """Recommend indexes for the query shapes of `datasource` in the run log."""
+    workload = run_log.workload(datasource, limit, hours)
+    advisor = IndexAdvisor(get_engine(datasource), min_improvement=min_improvement)
+    return {"datasource": datasource, **advisor.advise(workload, apply)}
+
+
+def _percent(value: float | None) -> str:
+    return "-" if value is None else f"{value:.0%}"
+
+
+def _print_advice(advice: dict):
+    how = (
+        "hypothetical indexes" if advice["hypothetical"] else "no hypothetical indexes"
+    )
+    print(f"{advice['datasource']} ({advice['dialect']}, {how})")
+    print("\nRecommended indexes:")
+    for index in advice["recommendations"]:
+        created = "  (created)" if index["created"] else ""
+        print(
+            f"  {index['shapes']:3d} shapes {index['queries']:5d} queries"
+            f"  {index['total_seconds']:8.2f}s  {index['statement']}{created}"
+        )
+    print("\nQuery shapes:")
+    for shape in advice["shapes"]:
+        print(
+            f"  {shape['count']:5d}x {shape['total_seconds']:8.2f}s"
+            f"  estimated {_percent(shape['estimated_improvement']):>5}"
+            f"  measured {_percent(shape['measured_improvement']):>5}"
+            f"  {', '.join(shape['indexes']) or '-'}  {shape['shape'][:100]}"
+        )
+        if shape["error"]:
+            print(f"        {shape['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--datasource", default=DEFAULT_DATASOURCE)
+    parser.add_argument(
+        "--limit", type=int, default=20, help="Query shapes to advise on"
+    )
+    parser.add_argument(
+        "--hours", type=float, default=None, help="Only the last hours of the run log"
+    )
+    parser.add_argument(
+        "--min-improvement",
+        type=float,
+        default=0.1,
+        help="Smallest estimated plan cost reduction to recommend an index",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Create the recommended indexes and measure the queries before and after",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the advice as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    advice = advise(
+        args.datasource, args.limit, args.hours, args.apply, args.min_improvement
+    )
+    if args.json:
+        print(orjson.dumps(advice, option=orjson.OPT_INDENT_2).decode())
+    else:
+        _print_advice(advice)
+
+
+if __name__ == "__main__":
+    main()
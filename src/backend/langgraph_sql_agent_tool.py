@@ -240,9 +240,10 @@ graph.add_edge("tools", "call_model")
 graph.add_edge("create_visual", "suggest_follow_up_question")
 graph.add_edge("suggest_follow_up_question", END)
 # graph.add_edge("result_summarizer", END)
-graph_complete = graph.compile()
 
 if __name__ == "__main__":
+    # Compile only when run as a script, importing this module stays cheap
+    graph_complete = graph.compile()
     # question = "Which five products brought in the most total sales revenue in the last quarter, and what product category does each belong to?"
     # question = "What is the average value of an order for each customer segment over the 1997?"
     # question = "In 1997, what are the top 10 cities by order shipping?"
@@ -0,0 +1,152 @@
+import io
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _decompress(body: bytes, encoding: str, max_size: int) -> bytes | None:
+    """Decompress `body`. Returns None if the result would exceed `max_size`."""
+    if encoding == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body))
+        data = reader.read(max_size + 1)
+    else:
+        wbits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+        data = zlib.decompressobj(wbits).decompress(body, max_size + 1)
+    return data if len(data) <= max_size else None
+
+
+class CompressionMiddleware:
+    """Decompress request bodies and gzip-compress responses.
+
+    Requests sent with `Content-Encoding: gzip`, `deflate` or `zstd` (when the
+    `zstandard` package is installed) are decompressed before they reach the
+    routes, up to `max_request_size` bytes. Responses of at least
+    `minimum_size` bytes are gzip-compressed for clients that accept it. Every
+    chunk of a streaming response is flushed, so NDJSON progress events are
+    not held back by the compressor.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        compresslevel: int = 6,
+        max_request_size: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.max_request_size = max_request_size
+        self.request_encodings = {"gzip", "deflate"}
+        if zstandard is not None:
+            self.request_encodings.add("zstd")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").lower()
+        if encoding != "identity":
+            if encoding not in self.request_encodings:
+                response = PlainTextResponse(
+                    f"Unsupported Content-Encoding: {encoding}", status_code=415
+                )
+                await response(scope, receive, send)
+                return
+            scope, decompressed_receive = await self._decompress_request(
+                scope, receive, encoding
+            )
+            if decompressed_receive is None:
+                response = PlainTextResponse("Request body too large", status_code=413)
+                await response(scope, receive, send)
+                return
+            receive = decompressed_receive
+
+        if "gzip" in headers.get("accept-encoding", ""):
+            send = self._gzip_send(send)
+        await self.app(scope, receive, send)
+
+    async def _decompress_request(
+        self, scope: Scope, receive: Receive, encoding: str
+    ) -> tuple[Scope, Receive | None]:
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = _decompress(b"".join(chunks), encoding, self.max_request_size)
+        if body is None:
+            return scope, None
+
+        headers = MutableHeaders(scope={**scope, "headers": list(scope["headers"])})
+        del headers["content-encoding"]
+        headers["content-length"] = str(len(body))
+        scope = {**scope, "headers": headers.raw}
+
+        body_sent = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal body_sent
+            if body_sent:
+                # Let the app wait for the client to disconnect as usual
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return scope, receive_decompressed
+
+    def _gzip_send(self, send: Send) -> Send:
+        start_message: Message | None = None
+        compressor = None
+
+        async def gzip_send(message: Message) -> None:
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                # Hold back the headers until the first body chunk is known
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if "content-encoding" not in headers and (
+                    more_body or len(body) >= self.minimum_size
+                ):
+                    compressor = zlib.compressobj(
+                        self.compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+                    )
+                    headers["Content-Encoding"] = "gzip"
+                    headers.add_vary_header("Accept-Encoding")
+                    del headers["Content-Length"]
+                    if not more_body:
+                        body = compressor.compress(body) + compressor.flush()
+                        headers["Content-Length"] = str(len(body))
+                        await send(start_message)
+                        await send({**message, "body": body})
+                        start_message = None
+                        return
+                await send(start_message)
+                start_message = None
+
+            if compressor is None:
+                await send(message)
+                return
+            flush_mode = zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH
+            body = compressor.compress(body) + compressor.flush(flush_mode)
+            await send({**message, "body": body})
+
+        return gzip_send
@@ -0,0 +1,255 @@
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from sqlalchemy import Connection, Engine, inspect, text
+
+from backend.database import DEFAULT_DATASOURCE
+from backend.utils.metrics import metrics
+from backend.utils.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Key of the Postgres advisory lock that serializes refreshes across workers
+_REFRESH_LOCK_KEY = 7_201_935
+
+_REVENUE = "od.unit_price * od.quantity * (1 - od.discount)"
+_MONTH = "date_trunc('month', o.order_date)::date"
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """A pre-aggregated summary of the order lines at a fixed grain."""
+
+    name: str
+    description: str
+    # Columns that identify a row; a unique index is created on them
+    grain: tuple[str, ...]
+    query: str
+
+
+def _sales_rollup(name: str, description: str, dimensions: dict[str, str]) -> Rollup:
+    """Revenue, units and order count of the order lines grouped by `dimensions`.
+
+    `dimensions` maps output column names to SQL expressions over `orders o`,
+    `order_details od`, `products p`, `categories c`, `customers cu` and
+    `employees e`.
+    """
+    select = ",\n    ".join(
+        f"{expr} AS {column}" for column, expr in dimensions.items()
+    )
+    query = f"""
+SELECT
+    {select},
+    SUM({_REVENUE})::numeric(14, 2) AS revenue,
+    SUM(od.quantity) AS units,
+    COUNT(DISTINCT o.order_id) AS orders
+FROM orders o
+JOIN order_details od ON od.order_id = o.order_id
+JOIN products p ON p.product_id = od.product_id
+LEFT JOIN categories c ON c.category_id = p.category_id
+LEFT JOIN customers cu ON cu.customer_id = o.customer_id
+LEFT JOIN employees e ON e.employee_id = o.employee_id
+WHERE o.order_date IS NOT NULL
+GROUP BY {", ".join(str(i + 1) for i in range(len(dimensions)))}
+"""
+    return Rollup(name, description, tuple(dimensions), query)
+
+
+ROLLUPS = [
+    _sales_rollup(
+        "rollup_sales_by_month",
+        "revenue, units and orders per month",
+        {"month": _MONTH},
+    ),
+    _sales_rollup(
+        "rollup_sales_by_product_month",
+        "revenue, units and orders per product and month",
+        {
+            "month": _MONTH,
+            "product_id": "p.product_id",
+            "product_name": "p.product_name",
+            "category_name": "c.category_name",
+        },
+    ),
+    _sales_rollup(
+        "rollup_sales_by_category_month",
+        "revenue, units and orders per product category and month",
+        {"month": _MONTH, "category_name": "c.category_name"},
+    ),
+    _sales_rollup(
+        "rollup_sales_by_country_month",
+        "revenue, units and orders per customer country and month",
+        {"month": _MONTH, "country": "cu.country"},
+    ),
+    _sales_rollup(
+        "rollup_sales_by_employee_month",
+        "revenue, units and orders per employee and month",
+        {
+            "month": _MONTH,
+            "employee_id": "e.employee_id",
+            "employee_name": "e.first_name || ' ' || e.last_name",
+        },
+    ),
+]
+
+
+def rollup_prompt(datasource: str, rollups: list[Rollup]) -> str:
+    """Describe `rollups` of `datasource` for the agent's instructions."""
+    lines = [
+        f"Pre-aggregated rollups of the {datasource} datasource (refreshed",
+        "periodically from its tables). Revenue is unit_price * quantity *",
+        "(1 - discount) of the order lines, month is the first day of the month",
+        "of orders.order_date. Prefer these over joining orders, order_details,",
+        "products and categories when they cover the question:",
+    ]
+    for rollup in rollups:
+        columns = ", ".join([*rollup.grain, "revenue", "units", "orders"])
+        lines.append(f"  - {rollup.name}({columns}): {rollup.description}")
+    return "\n".join(lines)
+
+
+class RollupManager:
+    """Create and refresh the rollups in the database of `datasource`.
+
+    The rollups are Postgres materialized views with a unique index on their
+    grain, refreshed concurrently so readers are never blocked. They are not
+    created on other databases.
+    """
+
+    def __init__(
+        self,
+        rollups: list[Rollup],
+        refresh_interval: float = 3600,
+        enabled: bool = True,
+        datasource: str = DEFAULT_DATASOURCE,
+    ):
+        self.rollups = rollups
+        self.refresh_interval = refresh_interval
+        self.enabled = enabled
+        self.datasource = datasource
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_env(cls) -> "RollupManager":
+        """Create a manager configured by `ROLLUP_*` environment variables."""
+        return cls(
+            ROLLUPS,
+            refresh_interval=float(os.getenv("ROLLUP_REFRESH_INTERVAL", "3600")),
+            enabled=os.getenv("ROLLUPS_ENABLED", "true").lower() == "true",
+        )
+
+    def existing(self, bind: Engine | Connection) -> list[str]:
+        """Names of the rollups present in the database."""
+        if bind.dialect.name != "postgresql":
+            return []
+        names = set(inspect(bind).get_materialized_view_names())
+        return [rollup.name for rollup in self.rollups if rollup.name in names]
+
+    def create(self, engine: Engine) -> list[str]:
+        """Create the rollups that do not exist yet (populated on creation).
+
+        Returns the names of the rollups that were created.
+        """
+        created = []
+        with engine.begin() as connection:
+            # Workers starting together wait for each other here
+            connection.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"), {"key": _REFRESH_LOCK_KEY}
+            )
+            existing = set(self.existing(connection))
+            for rollup in self.rollups:
+                if rollup.name in existing:
+                    continue
+                connection.execute(
+                    text(f"CREATE MATERIALIZED VIEW {rollup.name} AS {rollup.query}")
+                )
+                connection.execute(
+                    text(
+                        f"CREATE UNIQUE INDEX {rollup.name}_grain_idx"
+                        f" ON {rollup.name} ({', '.join(rollup.grain)})"
+                    )
+                )
+                created.append(rollup.name)
+                logger.info(f"Created rollup {rollup.name}")
+        return created
+
+    def refresh(self, engine: Engine) -> None:
+        """Recompute all rollups, skipped if another worker is already doing it."""
+        with engine.begin() as connection:
+            locked = connection.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"),
+                {"key": _REFRESH_LOCK_KEY},
+            ).scalar()
+            if not locked:
+                logger.info("Rollup refresh already running in another worker")
+                return
+            for rollup in self.rollups:
+                start = time.perf_counter()
+                connection.execute(
+                    text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {rollup.name}")
+                )
+                metrics.observe(
+                    "rollup_refresh_seconds",
+                    time.perf_counter() - start,
+                    rollup=rollup.name,
+                )
+
+    def _create_or_refresh(self, engine: Engine) -> None:
+        created = self.create(engine)
+        if created:
+            # The cached table list does not know the new rollups yet
+            shared_cache.clear("schema")
+        # Rollups left over from a previous run may be stale
+        if len(created) < len(self.rollups):
+            self.refresh(engine)
+
+    def _run(self, get_engine: Callable[[str], Engine]) -> None:
+        # Until the rollups are created, every interval tries again
+        created = False
+        while True:
+            stage = "refresh" if created else "create"
+            try:
+                engine = get_engine(self.datasource)
+                if engine.dialect.name != "postgresql":
+                    logger.warning(
+                        f"Rollups need PostgreSQL, not created in {self.datasource}"
+                    )
+                    return
+                if created:
+                    self.refresh(engine)
+                else:
+                    self._create_or_refresh(engine)
+                    created = True
+            except Exception as e:
+                metrics.increment("rollup_failures", stage=stage)
+                logger.error(f"Rollup {stage} failed: {e}")
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def start(self, get_engine: Callable[[str], Engine]) -> None:
+        """Create or refresh the rollups now and then every `refresh_interval` seconds.
+
+        Runs in a daemon thread; with a `refresh_interval` of 0 the rollups are
+        only brought up to date at startup.
+        """
+        if self._thread is not None:
+            return
+        if self.refresh_interval <= 0:
+            self._stop.set()
+        self._thread = threading.Thread(
+            target=self._run, args=(get_engine,), name="rollups", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic refresh."""
+        self._stop.set()
+
+
+# Create a global manager
+rollup_manager = RollupManager.from_env()
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Query, status
+
+from backend import index_advisor
+from backend.api_schema import (
+    ErrorResponse,
+    IndexAdviceResponse,
+    RunReportResponse,
+    TimelineResponse,
+)
+from backend.database import DEFAULT_DATASOURCE
+from backend.exceptions import NotFoundException
+from backend.utils.run_log import run_log
+from backend.utils.tracing import tracer
+
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"],
+    responses={
+        status.HTTP_200_OK: {"description": "Success"},
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Unknown or expired run, or unknown datasource",
+            "model": ErrorResponse,
+        },
+    },
+)
+
+
+@router.get(
+    "/runs/{run_id}/timeline",
+    status_code=status.HTTP_200_OK,
+    description="Timeline of the spans of an agent run: graph nodes, LLM calls, tools, SQL and rendering.",
+)
+def get_timeline(run_id: str) -> TimelineResponse:
+    timeline = tracer.timeline(run_id)
+    if timeline is None:
+        raise NotFoundException()
+    return TimelineResponse(**timeline)
+
+
+@router.get(
+    "/runs/report",
+    status_code=status.HTTP_200_OK,
+    description="Slowest query shapes, latest slow queries and most repeated questions from the run log.",
+)
+def get_run_report(
+    limit: int = Query(10, ge=1, le=1000),
+    hours: float | None = Query(None, gt=0, description="Only the last hours"),
+) -> RunReportResponse:
+    return RunReportResponse(**run_log.report(limit, hours))
+
+
+@router.get(
+    "/index-advice",
+    status_code=status.HTTP_200_OK,
+    description="Indexes that would speed up the query shapes of the run log, checked with EXPLAIN (hypothetical indexes with HypoPG). Nothing is created.",
+)
+def get_index_advice(
+    datasource: str = DEFAULT_DATASOURCE,
+    limit: int = Query(20, ge=1, le=200),
+    hours: float | None = Query(None, gt=0, description="Only the last hours"),
+) -> IndexAdviceResponse:
+    try:
+        advice = index_advisor.advise(datasource, limit, hours)
+    except ValueError:
+        raise NotFoundException()
+    return IndexAdviceResponse(**advice)
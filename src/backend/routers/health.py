@@ -2,6 +2,7 @@ from fastapi import APIRouter, status
 
 from backend.api_schema import ErrorResponse, HealthResponse
 from backend.exceptions import ServiceUnavailableException
+from backend.warmup import is_ready
 
 router = APIRouter(
     prefix="/health",
@@ -24,9 +25,14 @@ router = APIRouter(
 def check_readiness():
     """Readiness check for Kubernetes.
 
+    The service reports ready once the background warmup has compiled the
+    agent graph.
+
     Raises:
         HTTPInternalServerError: _description_
     """
+    if not is_ready():
+        raise ServiceUnavailableException()
     try:
         response = HealthResponse()
     except Exception:
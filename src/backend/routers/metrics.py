@@ -0,0 +1,21 @@
+from fastapi import APIRouter, status
+
+from backend.api_schema import MetricsResponse
+from backend.utils.metrics import metrics
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    responses={
+        status.HTTP_200_OK: {"description": "Success", "model": MetricsResponse},
+    },
+)
+
+
+@router.get(
+    "",
+    status_code=status.HTTP_200_OK,
+    description="In-process metrics of the backend (admission control, LLM pacing, ...).",
+)
+def get_metrics() -> MetricsResponse:
+    return MetricsResponse(**metrics.snapshot())
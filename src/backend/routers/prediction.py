@@ -1,10 +1,26 @@
 import logging
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import ExitStack
 
+import orjson
 from fastapi import APIRouter, Request, Response, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
 
-from backend.agent.graph import compiled_graph
-from backend.agent.prompt import SYSTEM_PROMPT
-from backend.api_schema import ChatRequest, ChatResponse, ErrorResponse
+from backend.agent.prompt import build_system_prompt
+from backend.api_schema import (
+    BudgetUsage,
+    ChatRequest,
+    ChatResponse,
+    ErrorResponse,
+    Message,
+)
+from backend.utils.admission import admission_controller
+from backend.utils.metrics import metrics
+from backend.utils.run_log import run_log
+from backend.utils.tracing import bind_context, tracer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,39 +31,259 @@ router = APIRouter(
     responses={
         status.HTTP_200_OK: {"description": "Success", "model": ChatResponse},
         status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Unprocessable Entity"},
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many concurrent requests from this client",
+            "model": ErrorResponse,
+        },
         status.HTTP_500_INTERNAL_SERVER_ERROR: {
             "description": "Internal Server Error",
             "model": ErrorResponse,
         },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "Server is at capacity, retry later",
+            "model": ErrorResponse,
+        },
     },
 )
 
 
-@router.post(
-    "/ask_agent",
-    description="Chat with the data analyst agent",
-    status_code=status.HTTP_200_OK,
-)
-def ask_agent(request: Request, body: ChatRequest, response: Response):
+def get_client_id(request: Request) -> str:
+    """Identify the caller for fair-share admission control."""
+    client_id = request.headers.get("X-Client-ID")
+    if client_id:
+        return client_id
+    return request.client.host if request.client else "anonymous"
+
+
+def _agent(mode: str | None = None):
+    """Get the compiled agent graph of `mode` (AGENT_MODE by default).
+
+    Imported lazily, so importing the app does not pull in LangGraph and the
+    LLM client; the lifespan warmup normally compiles it before any request.
+    """
+    from backend.agent.graph import get_compiled_graph
+
+    return get_compiled_graph(mode)
+
+
+def _initial_state(body: ChatRequest, run_id: str) -> dict:
     # Check if the first message is a system message
     if body.messages[0]["type"] != "system":
-        body.messages = [{"type": "system", "content": SYSTEM_PROMPT}] + body.messages
-
-    result = compiled_graph.invoke(
-        {
-            "messages": body.messages,
-            "data": None,
-            "visual_created": False,
-            "follow_up_question": body.follow_up_question,
-            "visualization_type": None,
-            "visualization_image": None,
-        },
-        {"recursion_limit": 50},
+        with tracer.span("prompt.build"):
+            system_prompt = build_system_prompt()
+        body.messages = [{"type": "system", "content": system_prompt}] + body.messages
+
+    return {
+        "messages": body.messages,
+        "run_id": run_id,
+        "data_id": None,
+        "result": None,
+        "visual_created": False,
+        "follow_up_question": body.follow_up_question,
+        "visualization_type": None,
+        "visualization_image": None,
+        "llm_calls": 0,
+        "tokens": 0,
+        "sql_seconds": 0.0,
+        "started_at": time.time(),
+        "tool_signatures": [],
+        "stop_reason": None,
+        "plan": None,
+        "plan_step": 0,
+        "plan_repairs": 0,
+        "plan_error": None,
+    }
+
+
+def _record_budget(result: dict, mode: str) -> BudgetUsage:
+    """Report what the run spent to the metrics and return it for the response."""
+    from backend.agent.budget import budget_limits, budget_usage
+
+    used = budget_usage(result)
+    run_log.set_usage(used, result.get("stop_reason"))
+    metrics.observe("llm_calls_per_run", used["llm_calls"], mode=mode)
+    metrics.observe("tokens_per_run", used["tokens"], mode=mode)
+    metrics.observe("run_seconds", used["seconds"], mode=mode)
+    metrics.observe("sql_seconds_per_run", used["sql_seconds"], mode=mode)
+    return BudgetUsage(
+        used=used, limits=budget_limits(), stop_reason=result.get("stop_reason")
+    )
+
+
+def _trace_run(request: Request, run_id: str, body: ChatRequest):
+    """Trace the run, continuing the caller's trace from its `traceparent` header."""
+    return tracer.trace(
+        "chat",
+        run_id,
+        traceparent=request.headers.get("traceparent"),
+        client_id=get_client_id(request),
+        mode=body.mode,
+        request_id=request.headers.get("X-Request-ID"),
+    )
+
+
+def _latest_question(messages: list) -> str:
+    for message in reversed(messages):
+        if isinstance(message, dict) and message.get("type") in ("human", "user"):
+            return str(message.get("content", ""))
+    return ""
+
+
+def _log_run(request: Request, run_id: str, body: ChatRequest):
+    """Record the run in the run log; call inside `_trace_run` to link the trace."""
+    return run_log.run(
+        run_id,
+        _latest_question(body.messages),
+        trace_id=tracer.current_trace_id(),
+        client_id=get_client_id(request),
+        mode=body.mode,
     )
+
+
+def _build_response(
+    result: dict, run_id: str, budget: BudgetUsage, skip_messages: int = 0
+) -> dict:
+    """Build the ChatResponse as a plain dict, ready for orjson.
+
+    The first `skip_messages` messages (the ones the client sent) are left out
+    when the client asked for a delta response.
+    """
+    from backend.agent.results import result_registry
+
     response = ChatResponse(
-        messages=result["messages"],
+        messages=[
+            Message.from_langchain(message)
+            for message in result["messages"][skip_messages:]
+        ],
         result=result["messages"][-1].content,
         follow_up_question=result["follow_up_question"],
         visualization_image=result["visualization_image"],
+        run_id=run_id,
+        result_links=[
+            f"/results/{run_id}/{query_id}"
+            for query_id in result_registry.list_ids(run_id)
+        ],
+        budget=budget,
+        trace_id=tracer.current_trace_id(),
+    )
+    return response.model_dump(exclude_none=True)
+
+
+def _describe_update(node: str, update: dict) -> str:
+    """Describe the progress made by a graph node for the user."""
+    if node == "call_model":
+        message = update["messages"][-1]
+        if message.get("tool_calls"):
+            tool_names = ", ".join(call["name"] for call in message["tool_calls"])
+            return f"Calling {tool_names}"
+        return "Writing the answer"
+    if node == "tools":
+        return "Analyzing the tool results"
+    if node == "create_visual":
+        return "Creating the visualization"
+    if node == "suggest_follow_up_question":
+        return "Suggesting follow-up questions"
+    if node == "stop_run":
+        return f"Stopped early: {update['stop_reason'].replace('_', ' ')}"
+    if node in ("make_plan", "execute_plan", "repair_plan"):
+        return _describe_plan_update(node, update)
+    return node
+
+
+def _describe_plan_update(node: str, update: dict) -> str:
+    """Describe the progress of the plan-and-execute nodes."""
+    if node == "make_plan":
+        plan = update.get("plan")
+        if plan is None:
+            return "Planning failed, exploring the database instead"
+        return f"Planned {len(plan['steps'])} queries"
+    if node == "execute_plan":
+        if update.get("plan_error"):
+            return "A planned query failed"
+        return "Ran the planned queries"
+    return "Correcting the failed query"
+
+
+@router.post(
+    "/ask_agent",
+    description="Chat with the data analyst agent",
+    status_code=status.HTTP_200_OK,
+    response_model=ChatResponse,
+    response_class=ORJSONResponse,
+)
+def ask_agent(request: Request, body: ChatRequest, response: Response):
+    run_id = uuid.uuid4().hex
+    state = _initial_state(body, run_id)
+    agent = _agent(body.mode)
+    with _trace_run(request, run_id, body), _log_run(request, run_id, body):
+        with admission_controller.admit(get_client_id(request)):
+            result = agent.invoke(state, {"recursion_limit": 50})
+        budget = _record_budget(result, agent.name)
+        skip_messages = len(state["messages"]) if body.delta else 0
+        response = _build_response(result, run_id, budget, skip_messages)
+    return ORJSONResponse(response)
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """Streaming response that holds an admission slot until it ends.
+
+    The slot is released however the response ends, including a client
+    disconnecting before the body generator was started.
+    """
+
+    def __init__(self, content, admission: ExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.admission.close()
+
+
+@router.post(
+    "/ask_agent/stream",
+    description="Chat with the data analyst agent, streaming progress as NDJSON",
+    status_code=status.HTTP_200_OK,
+)
+def ask_agent_stream(request: Request, body: ChatRequest) -> StreamingResponse:
+    """Stream one JSON object per line while the agent runs.
+
+    Each graph step emits `{"event": "step", "node": ..., "detail": ...}`; the
+    last line is `{"event": "result", "response": <ChatResponse>}`.
+    """
+    run_id = uuid.uuid4().hex
+    # Admit before the response starts, so rejections are still a 429/503
+    admission = ExitStack()
+    admission.enter_context(admission_controller.admit(get_client_id(request)))
+
+    def events() -> Iterator[bytes]:
+        with _trace_run(request, run_id, body), _log_run(request, run_id, body):
+            state = _initial_state(body, run_id)
+            agent = _agent(body.mode)
+            result = None
+            for mode, chunk in agent.stream(
+                state,
+                {"recursion_limit": 50},
+                stream_mode=["updates", "values"],
+            ):
+                if mode == "values":
+                    result = chunk
+                    continue
+                for node, update in chunk.items():
+                    event = {
+                        "event": "step",
+                        "node": node,
+                        "detail": _describe_update(node, update),
+                    }
+                    yield orjson.dumps(event) + b"\n"
+            budget = _record_budget(result, agent.name)
+            skip_messages = len(state["messages"]) if body.delta else 0
+            response = _build_response(result, run_id, budget, skip_messages)
+            yield orjson.dumps({"event": "result", "response": response}) + b"\n"
+
+    # One context for the whole run, although each chunk is produced in a thread
+    return _AdmittedStreamingResponse(
+        bind_context(events()), admission, media_type="application/x-ndjson"
     )
-    return response
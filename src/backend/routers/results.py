@@ -0,0 +1,61 @@
+from typing import Literal
+
+from fastapi import APIRouter, Query, status
+from fastapi.responses import StreamingResponse
+
+from backend.api_schema import ErrorResponse
+from backend.database import get_engine
+from backend.exceptions import NotFoundException
+from backend.utils.metrics import metrics
+
+router = APIRouter(
+    prefix="/results",
+    tags=["results"],
+    responses={
+        status.HTTP_200_OK: {"description": "Success"},
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Unknown or expired result",
+            "model": ErrorResponse,
+        },
+    },
+)
+
+_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+@router.get(
+    "/{run_id}/{query_id}",
+    status_code=status.HTTP_200_OK,
+    description="Download all rows of a query run by the agent as CSV or Parquet.",
+)
+def export_result(
+    run_id: str,
+    query_id: str,
+    file_format: Literal["csv", "parquet"] = Query("csv", alias="format"),
+) -> StreamingResponse:
+    """Re-execute the SQL behind a `sql_db_query` call and stream the result.
+
+    The rows are read from a server-side cursor in chunks and written to the
+    response with chunked encoding, so large exports are never held in memory.
+    """
+    # Imported here to keep pyarrow out of the application import
+    from backend.agent.results import result_registry
+    from backend.utils.export import stream_query_csv, stream_query_parquet
+
+    reference = result_registry.get_query(run_id, query_id)
+    if reference is None:
+        raise NotFoundException()
+    datasource, query = reference
+
+    stream = stream_query_csv if file_format == "csv" else stream_query_parquet
+    metrics.increment("result_exports", format=file_format)
+    return StreamingResponse(
+        stream(get_engine(datasource), query),
+        media_type=_MEDIA_TYPES[file_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{query_id}.{file_format}"'
+        },
+    )
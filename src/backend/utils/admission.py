@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from backend.exceptions import ServiceUnavailableException, TooManyRequestsException
+from backend.utils.metrics import metrics
+from backend.utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Ticket:
+    client_id: str
+    granted: bool = False
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded wait queue and per-client fair share.
+
+    At most `max_concurrency` requests run at once. Further requests wait in a
+    queue of at most `max_queue` entries; when a slot frees up it goes to the
+    waiting client with the fewest requests in flight, so one chatty client
+    cannot starve the others. Requests are rejected immediately when:
+
+    - the client already has `max_per_client` requests running or queued (429),
+    - the wait queue is full (503),
+    and after `queue_timeout` seconds in the queue (503).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        max_per_client: int,
+        queue_timeout: float,
+        retry_after: int = 1,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._in_flight: dict[str, int] = defaultdict(int)
+        self._waiting: list[_Ticket] = []
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Create a controller configured by `ADMISSION_*` environment variables."""
+        return cls(
+            max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "16")),
+            max_per_client=int(os.getenv("ADMISSION_MAX_PER_CLIENT", "2")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30")),
+        )
+
+    @contextmanager
+    def admit(self, client_id: str) -> Iterator[None]:
+        """Hold an execution slot for `client_id` for the duration of the block."""
+        start = time.perf_counter()
+        with tracer.span("admission.wait"), self._cond:
+            queued = sum(1 for t in self._waiting if t.client_id == client_id)
+            if self._in_flight[client_id] + queued >= self.max_per_client:
+                self._reject("client_limit")
+            if self._active < self.max_concurrency and not self._waiting:
+                self._grant(client_id)
+            elif len(self._waiting) >= self.max_queue:
+                self._reject("queue_full")
+            else:
+                ticket = _Ticket(client_id)
+                self._waiting.append(ticket)
+                self._update_gauges()
+                if not self._cond.wait_for(
+                    lambda: ticket.granted, timeout=self.queue_timeout
+                ):
+                    self._waiting.remove(ticket)
+                    self._reject("queue_timeout")
+        metrics.observe("admission_wait_seconds", time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._in_flight[client_id] -= 1
+                if self._in_flight[client_id] == 0:
+                    del self._in_flight[client_id]
+                self._grant_waiting()
+
+    def _grant(self, client_id: str) -> None:
+        self._active += 1
+        self._in_flight[client_id] += 1
+        self._update_gauges()
+
+    def _grant_waiting(self) -> None:
+        # Hand free slots to the waiting clients with the fewest requests in
+        # flight, oldest ticket first on ties.
+        while self._waiting and self._active < self.max_concurrency:
+            ticket = min(self._waiting, key=lambda t: self._in_flight[t.client_id])
+            self._waiting.remove(ticket)
+            ticket.granted = True
+            self._grant(ticket.client_id)
+        self._update_gauges()
+        self._cond.notify_all()
+
+    def _reject(self, reason: str) -> None:
+        self._update_gauges()
+        metrics.increment("admission_rejected", reason=reason)
+        logger.warning(f"Request rejected by admission control: {reason}")
+        headers = {"Retry-After": str(self.retry_after)}
+        if reason == "client_limit":
+            raise TooManyRequestsException(headers=headers)
+        raise ServiceUnavailableException(headers=headers)
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("admission_active", self._active)
+        metrics.set_gauge("admission_queue_depth", len(self._waiting))
+
+
+# Create a global admission controller for the chat endpoint
+admission_controller = AdmissionController.from_env()
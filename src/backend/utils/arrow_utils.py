@@ -0,0 +1,148 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import Engine
+
+from backend.utils.tracing import tracer
+
+try:
+    # Optional: ADBC streams Postgres' binary COPY format straight into Arrow
+    import adbc_driver_postgresql.dbapi as adbc_postgresql
+except ImportError:
+    adbc_postgresql = None
+
+# Postgres type name attached by the ADBC driver to each result field
+_ADBC_TYPE_NAME_KEY = b"ADBC:postgresql:typname"
+
+# Arrow type per Postgres type OID
+POSTGRES_ARROW_TYPES = {
+    16: pa.bool_(),  # bool
+    20: pa.int64(),  # int8
+    21: pa.int16(),  # int2
+    23: pa.int32(),  # int4
+    700: pa.float32(),  # float4
+    701: pa.float64(),  # float8
+    1700: pa.float64(),  # numeric
+    1082: pa.date32(),  # date
+    1114: pa.timestamp("us"),  # timestamp
+    25: pa.string(),  # text
+    1042: pa.string(),  # bpchar
+    1043: pa.string(),  # varchar
+}
+
+
+def unique_names(names: list[str]) -> list[str]:
+    """Suffix repeated column names, e.g. order_id, order_id -> order_id, order_id_2."""
+    seen = set(names)
+    result = []
+    counts = {}
+    for name in names:
+        if name in counts:
+            counts[name] += 1
+            while f"{name}_{counts[name]}" in seen:
+                counts[name] += 1
+            renamed = f"{name}_{counts[name]}"
+            seen.add(renamed)
+            result.append(renamed)
+        else:
+            counts[name] = 1
+            result.append(name)
+    return result
+
+
+def normalize_table(table: pa.Table) -> pa.Table:
+    """Cast Postgres `numeric` columns to float64 so they stay numeric downstream.
+
+    Repeated column names, e.g. from `SELECT o.order_id, od.order_id`, get a
+    suffix (see `unique_names`).
+    """
+    table = table.rename_columns(unique_names(table.column_names))
+    for i, arrow_field in enumerate(table.schema):
+        metadata = arrow_field.metadata or {}
+        if pa.types.is_decimal(arrow_field.type) or (
+            metadata.get(_ADBC_TYPE_NAME_KEY) == b"numeric"
+        ):
+            table = table.set_column(
+                i, arrow_field.name, pc.cast(table.column(i), pa.float64())
+            )
+    return table
+
+
+def _guard_statements(read_only: bool, timeout: float | None, scope: str) -> list[str]:
+    """Postgres statements that make the session or transaction (`scope`) safe."""
+    statements = []
+    if read_only:
+        if scope == "SESSION":
+            statements.append("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        else:
+            statements.append("SET TRANSACTION READ ONLY")
+    if timeout:
+        statements.append(f"SET {scope} statement_timeout = {int(timeout * 1000)}")
+    return statements
+
+
+def _fetch_with_adbc(
+    engine: Engine, query: str, read_only: bool, timeout: float | None
+) -> pa.Table:
+    uri = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    with adbc_postgresql.connect(uri) as conn, conn.cursor() as cursor:
+        # A fresh connection, so session settings do not leak
+        for statement in _guard_statements(read_only, timeout, "SESSION"):
+            cursor.execute(statement)
+        cursor.execute(query)
+        return cursor.fetch_arrow_table()
+
+
+def fetch_arrow_table(
+    engine: Engine, query: str, read_only: bool = False, timeout: float | None = None
+) -> pa.Table:
+    """Run `query` and return the result as an Arrow table.
+
+    Uses ADBC (COPY in binary format, decoded to Arrow in C) when the
+    `adbc-driver-postgresql` package is installed, and falls back to the
+    SQLAlchemy engine with pyarrow-backed dtypes otherwise. On Postgres the
+    query can be run in a `read_only` transaction and cancelled after
+    `timeout` seconds.
+    """
+    # SQLAlchemy statements get their own sql.execute spans; this one also
+    # covers connecting, fetching and the conversion to Arrow
+    with tracer.span("sql.fetch", db_system=engine.dialect.name) as span:
+        if adbc_postgresql is not None:
+            table = _fetch_with_adbc(engine, query, read_only, timeout)
+            if span is not None:
+                span.set(driver="adbc", db_statement=query)
+        else:
+            with engine.connect() as connection:
+                if engine.dialect.name == "postgresql":
+                    # Pooled connection: the settings end with the transaction
+                    for statement in _guard_statements(read_only, timeout, "LOCAL"):
+                        connection.exec_driver_sql(statement)
+                df = pd.read_sql(query, connection, dtype_backend="pyarrow")
+            # Arrow rejects a DataFrame with repeated column names
+            df.columns = unique_names([str(column) for column in df.columns])
+            # Drop the pandas metadata so the table converts like an ADBC result
+            table = pa.Table.from_pandas(
+                df, preserve_index=False
+            ).replace_schema_metadata()
+        table = normalize_table(table)
+        if span is not None:
+            span.set(rows=table.num_rows)
+    return table
+
+
+def table_to_ipc(table: pa.Table) -> bytes:
+    """Serialize a table in the Arrow IPC stream format."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def table_from_ipc(data: bytes) -> pa.Table:
+    """Read a table written by `table_to_ipc`; the columns reference `data`."""
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """View an Arrow table as a DataFrame backed by the same Arrow buffers."""
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
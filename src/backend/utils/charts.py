@@ -0,0 +1,223 @@
+import base64
+import io
+import os
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from backend.utils.tracing import tracer
+
+# Most categories shown in a bar or pie chart; a pie groups the rest as "Other"
+CHART_TOP_N = int(os.getenv("CHART_TOP_N", "15"))
+# Most points drawn in a line or scatter chart
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+
+# Integer columns that are dimensions rather than measures
+_TIME_PART = re.compile(r"(^|_)(year|quarter|month|week|day|hour)s?$")
+_ID = re.compile(r"(^|_)id$")
+# Most measures drawn in one chart
+_MAX_MEASURES = 3
+
+
+def _is_temporal(arrow_field: pa.Field) -> bool:
+    return pa.types.is_temporal(arrow_field.type) or bool(
+        _TIME_PART.search(arrow_field.name)
+    )
+
+
+def _is_dimension(arrow_field: pa.Field) -> bool:
+    if pa.types.is_integer(arrow_field.type):
+        return bool(_TIME_PART.search(arrow_field.name) or _ID.search(arrow_field.name))
+    return not (
+        pa.types.is_floating(arrow_field.type) or pa.types.is_decimal(arrow_field.type)
+    )
+
+
+def _x_preference(arrow_field: pa.Field, visualization_type: str) -> int:
+    """Rank of a dimension as the x axis, lower is better."""
+    if visualization_type == "line":
+        if _is_temporal(arrow_field):
+            return 0
+        return 2 if _ID.search(arrow_field.name) else 1
+    if pa.types.is_string(arrow_field.type) or pa.types.is_large_string(
+        arrow_field.type
+    ):
+        return 0
+    return 1 if _is_temporal(arrow_field) else 2
+
+
+def choose_columns(
+    schema: pa.Schema, visualization_type: str
+) -> tuple[list[str], list[str]] | None:
+    """Pick the x columns and the measures to draw, or None if there are none.
+
+    Measures are the float columns and the integer columns that are not IDs
+    or time parts (year, month, ...); everything else is a dimension. The x
+    axis is one dimension, or all time parts together (year and month).
+    """
+    dimensions = [f for f in schema if _is_dimension(f)]
+    measures = [f.name for f in schema if not _is_dimension(f)]
+    if visualization_type == "scatter":
+        if len(measures) < 2:
+            return None
+        return measures[:1], measures[1:2]
+    if not measures or not dimensions:
+        return None
+    x = min(dimensions, key=lambda f: _x_preference(f, visualization_type))
+    xs = [x.name]
+    if _TIME_PART.search(x.name):
+        xs = [f.name for f in dimensions if _TIME_PART.search(f.name)]
+    return xs, measures[:_MAX_MEASURES]
+
+
+def _labels(table: pa.Table, xs: list[str]) -> list:
+    if len(xs) == 1:
+        return table[xs[0]].to_pylist()
+    # Time parts joined, zero-padded so they read in order: 1997-07
+    columns = [table[x].to_pylist() for x in xs]
+    return ["-".join(str(part).zfill(2) for part in row) for row in zip(*columns)]
+
+
+def distinct_x(
+    table: pa.Table, xs: list[str], visualization_type: str
+) -> list[str] | None:
+    """The x columns that tell the rows apart, or None if no columns do.
+
+    Repeated x values cannot be summed, measures like averages, ratios and
+    prices are not additive. The other dimensions are added to the x axis
+    instead, e.g. country and city when a country has several cities.
+    """
+    if visualization_type == "scatter":
+        return xs
+
+    def distinct(columns: list[str]) -> bool:
+        groups = table.select(columns).group_by(columns).aggregate([])
+        return groups.num_rows == table.num_rows
+
+    if distinct(xs):
+        return xs
+    finer = xs + [f.name for f in table.schema if _is_dimension(f) and f.name not in xs]
+    if len(finer) > len(xs) and distinct(finer):
+        return finer
+    return None
+
+
+def prepare_series(
+    table: pa.Table, visualization_type: str, xs: list[str], measures: list[str]
+) -> tuple[list, dict[str, list]]:
+    """Order and trim the rows to draw, one row per x value (see `distinct_x`).
+
+    Bar and pie charts keep the top `CHART_TOP_N` categories by the first
+    measure, all vectorized in Arrow; only the rows that are drawn become
+    Python lists. Missing measures are NaN in bar and line charts, and
+    their rows are dropped from pie and scatter charts.
+    """
+    table = table.select([*xs, *measures])
+    for x in xs:
+        table = table.filter(pc.is_valid(table[x]))
+    if visualization_type in ("pie", "scatter"):
+        # A slice or point needs a value
+        for m in measures:
+            table = table.filter(pc.is_valid(table[m]))
+    else:
+        # A missing value leaves a gap in the line or no bar, sorted last
+        for m in measures:
+            column = pc.cast(table[m], pa.float64()).fill_null(float("nan"))
+            table = table.set_column(table.column_names.index(m), m, column)
+    if visualization_type == "scatter":
+        table = table.slice(0, CHART_MAX_POINTS)
+        return _labels(table, xs), {m: table[m].to_pylist() for m in measures}
+
+    if visualization_type == "line" or _is_temporal(table.schema.field(xs[0])):
+        limit = CHART_MAX_POINTS if visualization_type == "line" else 4 * CHART_TOP_N
+        table = table.sort_by([(x, "ascending") for x in xs])
+        table = table.slice(max(table.num_rows - limit, 0))
+        return _labels(table, xs), {m: table[m].to_pylist() for m in measures}
+
+    table = table.sort_by([(measures[0], "descending")])
+    if visualization_type == "pie" and table.num_rows > CHART_TOP_N:
+        top = table.slice(0, CHART_TOP_N - 1)
+        rest = table.slice(CHART_TOP_N - 1)
+        return [*_labels(top, xs), "Other"], {
+            m: [*top[m].to_pylist(), pc.sum(rest[m]).as_py()] for m in measures
+        }
+    table = table.slice(0, CHART_TOP_N)
+    return _labels(table, xs), {m: table[m].to_pylist() for m in measures}
+
+
+def _draw(ax, visualization_type: str, x: str, labels: list, series: dict) -> None:
+    import numpy as np
+
+    if visualization_type == "pie":
+        measure, values = next(iter(series.items()))
+        ax.pie(values, labels=[str(label) for label in labels], autopct="%1.0f%%")
+        ax.set_title(f"{measure} by {x}")
+        return
+    if visualization_type == "scatter":
+        measure, values = next(iter(series.items()))
+        ax.scatter(labels, values, alpha=0.7)
+        ax.set_xlabel(x)
+        ax.set_ylabel(measure)
+        ax.set_title(f"{measure} vs {x}")
+        return
+    if visualization_type == "line":
+        for measure, values in series.items():
+            ax.plot(labels, values, marker="o" if len(labels) <= 40 else None)
+        ax.tick_params(axis="x", labelrotation=45)
+    else:
+        names = [str(label) for label in labels]
+        positions = np.arange(len(names))
+        width = 0.8 / len(series)
+        horizontal = max(len(name) for name in names) > 12
+        for i, values in enumerate(series.values()):
+            offset = positions + (i - (len(series) - 1) / 2) * width
+            if horizontal:
+                ax.barh(offset, values, height=width)
+            else:
+                ax.bar(offset, values, width=width)
+        if horizontal:
+            ax.set_yticks(positions, names)
+            # Largest first, from the top
+            ax.invert_yaxis()
+        else:
+            ax.set_xticks(positions, names, rotation=45, ha="right")
+    ax.set_title(f"{', '.join(series)} by {x}")
+    if len(series) > 1:
+        ax.legend(list(series))
+
+
+def build_chart(table: pa.Table, visualization_type: str) -> str | None:
+    """Draw a `visualization_type` chart of a query result as a base64 PNG.
+
+    The columns are chosen from their types (see `choose_columns`). Returns
+    None when the result has nothing to chart, e.g. a single value, text only
+    or rows that no columns tell apart.
+    """
+    if table.num_rows < 2:
+        return None
+    columns = choose_columns(table.schema, visualization_type)
+    if columns is None:
+        return None
+    xs, measures = columns
+    xs = distinct_x(table, xs, visualization_type)
+    if xs is None:
+        return None
+    labels, series = prepare_series(table, visualization_type, xs, measures)
+    if not labels:
+        return None
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(9, 5.5))
+    try:
+        _draw(ax, visualization_type, " and ".join(xs), labels, series)
+        buffer = io.BytesIO()
+        with tracer.span("render.png"):
+            fig.savefig(buffer, format="png", bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
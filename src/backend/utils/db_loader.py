@@ -0,0 +1,483 @@
+"""Bulk load the Northwind and Chinook dumps (or snapshots of them) into Postgres.
+
+Replaying a dump with psql runs every INSERT as its own statement and
+maintains the indexes and foreign keys row by row. The loader parses the
+dump instead:
+
+1. drops the tables of the dump and creates them without their
+   constraints
+2. loads each table with COPY, several tables in parallel, from the rows
+   of the dump or from `<table>.csv` / `<table>.parquet` of a snapshot
+3. with `--scale N`, copies the fact tables (orders, invoices and their
+   lines) N - 1 more times on the server, with shifted keys
+4. adds the primary keys and indexes, several tables in parallel, then
+   the foreign keys, and ANALYZEs the tables
+
+Usage:
+    python -m backend.utils.db_loader northwind --scale 100
+    python -m backend.utils.db_loader chinook --snapshot snapshots/chinook
+    python -m backend.utils.db_loader northwind --write-snapshot snapshots/northwind
+"""
+
+import argparse
+import csv
+import io
+import logging
+import re
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import psycopg2
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from psycopg2 import sql
+
+from backend.database import datasources
+from backend.utils.db_utils import ConnectionProvider, libpq_dsn
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parents[3] / "data"
+
+# Dump of each dataset, loaded into the datasource of the same name
+DUMPS = {
+    "northwind": DATA_DIR / "northwind.sql",
+    "chinook": DATA_DIR / "Chinook_PostgreSql.sql",
+}
+
+# Fact tables copied by `--scale`, with the key columns shifted per copy.
+# A column shifts by the same amount in every table, so the lines of a
+# copied order still point at the copied order.
+SCALED_TABLES = {
+    "orders": ["order_id"],
+    "order_details": ["order_id"],
+    "invoice": ["invoice_id"],
+    "invoice_line": ["invoice_line_id", "invoice_id"],
+}
+
+# String literals, comments, psql meta-commands and statement ends
+_TOKENS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/|^\\[^\n]*|;", re.S | re.M)
+_CREATE_TABLE = re.compile(
+    r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)\s*\((.*)\)\s*$", re.I | re.S
+)
+_INSERT = re.compile(
+    r"INSERT\s+INTO\s+([\w.\"]+)\s*(?:\(([^)]*)\))?\s*VALUES\s", re.I | re.S
+)
+# A string literal, optionally N'' (national), a bare value (number,
+# NULL, true) or a row delimiter
+_VALUES = re.compile(r"(N?)'((?:[^']|'')*)'|([^\s,()']+)|([(),])", re.I)
+_TABLE_CONSTRAINT = re.compile(
+    r"(CONSTRAINT|PRIMARY\s+KEY|UNIQUE|FOREIGN\s+KEY|CHECK|EXCLUDE)\b", re.I
+)
+_ADD_CONSTRAINT = re.compile(
+    r"ALTER\s+TABLE\s.*\sADD\s+(CONSTRAINT|PRIMARY|UNIQUE|FOREIGN|CHECK)\b",
+    re.I | re.S,
+)
+_CREATE_FIRST = re.compile(
+    r"CREATE\s+(TYPE|DOMAIN|EXTENSION|SCHEMA|SEQUENCE|FUNCTION)\b", re.I
+)
+_SKIPPED = re.compile(r"(DROP|SET|CREATE\s+DATABASE)\b", re.I)
+
+
+def _name(identifier: str) -> str:
+    """The table or column name of a possibly quoted SQL identifier."""
+    if identifier.startswith('"'):
+        return identifier.strip('"')
+    return identifier.lower()
+
+
+def split_statements(script: str) -> list[str]:
+    """Split a SQL script into statements, without comments and psql commands."""
+    statements = []
+    parts = []
+    position = 0
+    for match in _TOKENS.finditer(script):
+        parts.append(script[position : match.start()])
+        token = match.group()
+        if token == ";":
+            statements.append("".join(parts).strip())
+            parts = []
+        elif token.startswith("'"):
+            parts.append(token)
+        position = match.end()
+    parts.append(script[position:])
+    statements.append("".join(parts).strip())
+    return [statement for statement in statements if statement]
+
+
+def _split_top_level(body: str) -> list[str]:
+    """Split the body of a CREATE TABLE at the commas outside parentheses."""
+    items = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(body):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(body[start:index].strip())
+            start = index + 1
+    items.append(body[start:].strip())
+    return [item for item in items if item]
+
+
+def parse_values(text: str) -> list[tuple]:
+    """The rows of the VALUES list of an INSERT, as text or None for NULL.
+
+    The values stay as they are written in the dump; Postgres parses them
+    when they are copied into their typed columns.
+    """
+    rows = []
+    row = None
+    for national, string, bare, delimiter in _VALUES.findall(text):
+        if delimiter == "(":
+            row = []
+        elif delimiter == ")":
+            rows.append(tuple(row))
+            row = None
+        elif delimiter == ",":
+            continue
+        elif row is None:
+            raise ValueError(f"Value outside of a row: {string or bare}")
+        elif bare:
+            row.append(None if bare.upper() == "NULL" else bare)
+        elif national:
+            # N'' literals are char(n), which drops trailing spaces
+            row.append(string.replace("''", "'").rstrip(" "))
+        else:
+            row.append(string.replace("''", "'"))
+    return rows
+
+
+@dataclass
+class TableData:
+    # None when the INSERTs list no columns: all of them, in table order
+    columns: list[str] | None
+    rows: list[tuple] = field(default_factory=list)
+
+
+@dataclass
+class Dump:
+    """The statements and rows of a SQL dump, split into loading phases."""
+
+    # Types, sequences and the like the tables need
+    before: list[str] = field(default_factory=list)
+    # CREATE TABLE statements without their table constraints, by table
+    tables: dict[str, str] = field(default_factory=dict)
+    data: dict[str, TableData] = field(default_factory=dict)
+    # Primary keys, unique constraints and indexes
+    constraints: list[str] = field(default_factory=list)
+    foreign_keys: list[str] = field(default_factory=list)
+    # Views, comments and anything else
+    after: list[str] = field(default_factory=list)
+
+    def _add_table(self, match: re.Match):
+        table = _name(match.group(1))
+        columns = []
+        for item in _split_top_level(match.group(2)):
+            if _TABLE_CONSTRAINT.match(item):
+                self._add_constraint(f"ALTER TABLE {match.group(1)} ADD {item}")
+            else:
+                columns.append(item)
+        body = ",\n    ".join(columns)
+        self.tables[table] = f"CREATE TABLE {match.group(1)} (\n    {body}\n)"
+
+    def _add_constraint(self, statement: str):
+        if re.search(r"FOREIGN\s+KEY", statement, re.I):
+            self.foreign_keys.append(statement)
+        else:
+            self.constraints.append(statement)
+
+    def _add_rows(self, match: re.Match, statement: str):
+        table = _name(match.group(1))
+        columns = match.group(2) and [
+            _name(column.strip()) for column in match.group(2).split(",")
+        ]
+        data = self.data.setdefault(table, TableData(columns))
+        if data.columns != columns:
+            raise ValueError(f"INSERTs into {table} list different columns")
+        data.rows.extend(parse_values(statement[match.end() :]))
+
+    def add(self, statement: str):
+        """Sort a statement of the dump into its loading phase."""
+        if match := _CREATE_TABLE.match(statement):
+            self._add_table(match)
+        elif match := _INSERT.match(statement):
+            self._add_rows(match, statement)
+        elif _ADD_CONSTRAINT.match(statement):
+            self._add_constraint(statement)
+        elif re.match(r"CREATE\s+(UNIQUE\s+)?INDEX\b", statement, re.I):
+            self.constraints.append(statement)
+        elif _CREATE_FIRST.match(statement):
+            self.before.append(statement)
+        elif not _SKIPPED.match(statement):
+            self.after.append(statement)
+
+
+def parse_dump(path: Path) -> Dump:
+    """Parse a plain SQL dump (CREATE TABLE, INSERT, ALTER TABLE ADD ...).
+
+    Dropping and creating the database, switching to it and SET statements
+    are skipped: the loader connects to the target database and drops the
+    tables of the dump itself.
+    """
+    dump = Dump()
+    for statement in split_statements(path.read_text(encoding="utf-8")):
+        dump.add(statement)
+    return dump
+
+
+class DatasetLoader:
+    """Load a parsed dump into a database with COPY, constraints last.
+
+    Tables are loaded, scaled, indexed and analyzed on up to `workers`
+    pooled connections at once; foreign keys are added one after another
+    as each one locks two tables.
+    """
+
+    def __init__(self, provider: ConnectionProvider, workers: int = 4):
+        self.provider = provider
+        self.workers = workers
+        self.timings: dict[str, float] = {}
+
+    def _phase(self, name: str, work: Callable[[], object]):
+        start = time.perf_counter()
+        result = work()
+        self.timings[name] = time.perf_counter() - start
+        logger.info(f"{name} took {self.timings[name]:.2f}s")
+        return result
+
+    def _parallel(self, function: Callable, items: Iterable) -> list:
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, items))
+
+    def _run(self, statements: list[str]):
+        if not statements:
+            return
+        with self.provider.connection() as conn, conn.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def _create_tables(self, dump: Dump, scale: int):
+        drop = sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(
+            sql.SQL(", ").join(map(sql.Identifier, dump.tables))
+        )
+        with self.provider.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(drop)
+            for statement in [*dump.before, *dump.tables.values()]:
+                cursor.execute(statement)
+        if scale > 1:
+            self._widen_keys(dump)
+
+    def _widen_keys(self, dump: Dump):
+        """Make the smallint keys of the scaled tables integers, so the
+        shifted keys fit."""
+        rows = self.provider.query(
+            "SELECT table_name, column_name FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND data_type = 'smallint'"
+            " AND table_name = ANY(%s)",
+            ([table for table in SCALED_TABLES if table in dump.tables],),
+        )
+        statements = [
+            sql.SQL("ALTER TABLE {} ALTER COLUMN {} TYPE integer").format(
+                sql.Identifier(table), sql.Identifier(column)
+            )
+            for table, column in rows
+            if column in SCALED_TABLES[table]
+        ]
+        self._run(statements)
+
+    def _load_table(self, table: str, dump: Dump, snapshot: Path | None) -> int:
+        if snapshot and (path := snapshot / f"{table}.parquet").exists():
+            # Arrow writes NULL as an empty field and quotes every string
+            data = pq.read_table(path)
+            buffer = io.BytesIO()
+            pa_csv.write_csv(data, buffer)
+            buffer.seek(0)
+            return self.provider.copy_csv(table, buffer, data.column_names, header=True)
+        if snapshot and (path := snapshot / f"{table}.csv").exists():
+            with path.open(encoding="utf-8", newline="") as file:
+                columns = next(csv.reader(file))
+                file.seek(0)
+                return self.provider.copy_csv(table, file, columns, header=True)
+        data = dump.data.get(table)
+        if data is None:
+            return 0
+        return self.provider.copy_rows(table, data.columns, data.rows)
+
+    def _strides(self, tables: list[str]) -> dict[str, int]:
+        """How far each key column shifts per copy: past its largest value
+        in any of the scaled tables."""
+        strides = {}
+        for table in tables:
+            columns = SCALED_TABLES[table]
+            maxima = sql.SQL(", ").join(
+                sql.SQL("COALESCE(MAX({}), 0) + 1").format(sql.Identifier(column))
+                for column in columns
+            )
+            (row,) = self.provider.query(
+                sql.SQL("SELECT {} FROM {}").format(maxima, sql.Identifier(table))
+            )
+            for column, stride in zip(columns, row):
+                strides[column] = max(strides.get(column, 0), stride)
+        return strides
+
+    def _scale_table(self, table: str, scale: int, strides: dict[str, int]):
+        columns = [
+            name
+            for (name,) in self.provider.query(
+                "SELECT column_name FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = %s"
+                " ORDER BY ordinal_position",
+                (table,),
+            )
+        ]
+        values = [
+            sql.SQL("t.{} + copies.n * {}").format(
+                sql.Identifier(column), sql.Literal(strides[column])
+            )
+            if column in SCALED_TABLES[table]
+            else sql.SQL("t.{}").format(sql.Identifier(column))
+            for column in columns
+        ]
+        self.provider.query(
+            sql.SQL(
+                "INSERT INTO {table} ({columns}) SELECT {values}"
+                " FROM {table} AS t, generate_series(1, {copies}) AS copies(n)"
+            ).format(
+                table=sql.Identifier(table),
+                columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+                values=sql.SQL(", ").join(values),
+                copies=sql.Literal(scale - 1),
+            )
+        )
+
+    def _scale(self, dump: Dump, scale: int):
+        tables = [table for table in SCALED_TABLES if table in dump.tables]
+        strides = self._strides(tables)
+        self._parallel(lambda table: self._scale_table(table, scale, strides), tables)
+
+    def load(
+        self, dump: Dump, snapshot: Path | None = None, scale: int = 1
+    ) -> dict[str, int]:
+        """Create and load the tables of `dump`, returning the rows loaded
+        per table (before scaling)."""
+        tables = list(dump.tables)
+        self._phase("create tables", lambda: self._create_tables(dump, scale))
+        counts = self._phase(
+            "copy",
+            lambda: self._parallel(
+                lambda table: self._load_table(table, dump, snapshot), tables
+            ),
+        )
+        if scale > 1:
+            self._phase(f"scale x{scale}", lambda: self._scale(dump, scale))
+        self._phase("constraints and indexes", lambda: self._add_constraints(dump))
+        self._phase("foreign keys", lambda: self._run(dump.foreign_keys))
+        self._phase("other statements", lambda: self._run(dump.after))
+        self._phase(
+            "analyze",
+            lambda: self._parallel(
+                lambda table: self.provider.query(
+                    sql.SQL("ANALYZE {}").format(sql.Identifier(table))
+                ),
+                tables,
+            ),
+        )
+        return dict(zip(tables, counts))
+
+    def _add_constraints(self, dump: Dump):
+        # One table's constraints in a row, several tables at once
+        by_table: dict[str, list[str]] = {}
+        for statement in dump.constraints:
+            table = re.search(r"(?:TABLE\s+(?:ONLY\s+)?|\sON\s+)([\w.\"]+)", statement)
+            by_table.setdefault(table.group(1) if table else "", []).append(statement)
+        self._parallel(self._run, by_table.values())
+
+    def write_snapshot(self, tables: list[str], directory: Path):
+        """Write each table to `<directory>/<table>.csv` with COPY."""
+        directory.mkdir(parents=True, exist_ok=True)
+
+        def export(table: str):
+            statement = sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER true)")
+            with self.provider.connection() as conn, conn.cursor() as cursor:
+                with (directory / f"{table}.csv").open("wb") as file:
+                    cursor.copy_expert(
+                        statement.format(sql.Identifier(table)).as_string(conn), file
+                    )
+
+        self._parallel(export, tables)
+
+
+def create_database(dsn: str):
+    """Create the database of `dsn` if it does not exist yet."""
+    name = psycopg2.extensions.parse_dsn(dsn)["dbname"]
+    conn = psycopg2.connect(dsn, dbname="postgres")
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name))
+                )
+                logger.info(f"Created database {name}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("dataset", choices=list(DUMPS))
+    parser.add_argument(
+        "--dsn", help="Database to load into (default: the datasource's database)"
+    )
+    parser.add_argument("--dump", type=Path, help="SQL dump with the schema and rows")
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        help="Directory of <table>.csv or <table>.parquet files to load instead"
+        " of the rows of the dump",
+    )
+    parser.add_argument(
+        "--write-snapshot", type=Path, help="Write the loaded tables as CSV here"
+    )
+    parser.add_argument(
+        "--scale", type=int, default=1, help="Copies of the fact tables to load"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Tables loaded at the same time"
+    )
+    parser.add_argument(
+        "--create-database", action="store_true", help="Create the database if missing"
+    )
+    args = parser.parse_args()
+    if args.scale < 1:
+        parser.error("--scale must be at least 1")
+    logging.basicConfig(level=logging.INFO)
+
+    dsn = args.dsn or libpq_dsn(datasources.get(args.dataset).url)
+    if args.create_database:
+        create_database(dsn)
+    start = time.perf_counter()
+    dump = parse_dump(args.dump or DUMPS[args.dataset])
+    logger.info(f"Parsed the dump in {time.perf_counter() - start:.2f}s")
+    provider = ConnectionProvider(dsn, max_size=args.workers)
+    try:
+        loader = DatasetLoader(provider, args.workers)
+        counts = loader.load(dump, args.snapshot, args.scale)
+        if args.write_snapshot:
+            loader.write_snapshot(list(dump.tables), args.write_snapshot)
+    finally:
+        provider.close()
+    for table, count in counts.items():
+        print(f"  {table:<24} {count:8d} rows")
+    print(f"Loaded {args.dataset} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
+import csv
+import io
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from typing import IO, Any
+
+import numpy as np
 import psycopg2
-from psycopg2 import OperationalError
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from psycopg2 import OperationalError, sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from sqlalchemy.engine import make_url
 
-# from sqlalchemy import create_engine
-# import pandas as pd
-# from typing import Optional
+from backend.database import datasources
+from backend.utils.arrow_utils import POSTGRES_ARROW_TYPES, unique_names
 
-# NOTE: Install psycopg2 if not already installed: pip install psycopg2
+try:
+    # Optional: psycopg 3, for pipeline mode
+    import psycopg
+except ImportError:
+    psycopg = None
 
 
 def get_db_connection(
@@ -37,6 +53,8 @@ def run_query(
     """
     Run a SQL query on the PostgreSQL database. Returns the result as a list of tuples.
     If the query is not a SELECT, returns an empty list.
+    The connection is closed afterwards; use `ConnectionProvider.query` to
+    reuse pooled connections instead.
     """
     try:
         with conn.cursor() as cur:
@@ -55,40 +73,6 @@ def run_query(
         conn.close()
 
 
-# def get_sqlalchemy_engine(
-#     user: str,
-#     password: str,
-#     dbname: str,
-#     host: str,
-#     port: int,
-# ):
-#     """
-#     Create and return a SQLAlchemy engine for the PostgreSQL database.
-#     """
-#     engine_url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
-#     return create_engine(engine_url)
-
-
-# def run_query_sqlalchemy(
-#     engine,
-#     query: str,
-#     params: Optional[dict] = None,
-# ) -> pd.DataFrame:
-#     """
-#     Run a SQL query using SQLAlchemy and return the result as a pandas DataFrame.
-#     Example usage:
-#         engine = get_sqlalchemy_engine(...)
-#         df = run_query_sqlalchemy(
-#             engine,
-#             query="SELECT * FROM us_states WHERE id = %(id)s",
-#             params={"id": 1},
-#         )
-#     """
-#     with engine.connect() as connection:
-#         df = pd.read_sql_query(query, connection, params=params)
-#     return df
-
-
 def get_table_names(conn):
     """
     Get a list of table names in the PostgreSQL database.
@@ -97,6 +81,211 @@ def get_table_names(conn):
     return run_query(conn, query)
 
 
+def libpq_dsn(url: str) -> str:
+    """A libpq connection string from a SQLAlchemy URL (driver name dropped)."""
+    return (
+        make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+    )
+
+
+class ConnectionProvider:
+    """Pooled psycopg2 connections to one Postgres database.
+
+    Connections are reused across calls instead of being opened per query,
+    and a transaction is committed when the block using it succeeds and
+    rolled back otherwise. Besides plain queries it offers bulk loads
+    (`execute_values`, COPY), several statements in one round trip
+    (pipeline mode, with psycopg 3 installed) and fetching columns into
+    typed NumPy arrays.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 5):
+        self.dsn = dsn
+        self._pool = ThreadedConnectionPool(min_size, max_size, dsn)
+        # Idle psycopg 3 connections for pipelines, at most `max_size` in use
+        self._pipeline_idle = []
+        self._pipeline_slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_datasource(cls, name: str, **kwargs) -> "ConnectionProvider":
+        """Create a provider for a datasource of the registry."""
+        return cls(libpq_dsn(datasources.get(name).url), **kwargs)
+
+    @contextmanager
+    def connection(self) -> Iterator:
+        """A pooled connection, committed on success and rolled back on error."""
+        conn = self._pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            # A broken connection is closed instead of returned to the pool
+            self._pool.putconn(conn, close=bool(conn.closed))
+
+    def query(self, query: str, params: tuple | dict = ()) -> list[tuple]:
+        """Run a statement and return its rows, an empty list if it has none."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall() if cursor.description else []
+
+    def execute_values(
+        self, query: str, rows: Iterable[tuple], page_size: int = 1000
+    ) -> None:
+        """Insert many rows with one multi-row statement per `page_size` rows.
+
+        `query` has a single `%s` for the rows, e.g.
+        `INSERT INTO shippers (shipper_id, company_name) VALUES %s`.
+        """
+        with self.connection() as conn, conn.cursor() as cursor:
+            execute_values(cursor, query, rows, page_size=page_size)
+
+    def copy_csv(
+        self,
+        table: str,
+        file: IO,
+        columns: list[str] | None = None,
+        header: bool = False,
+    ) -> int:
+        """Bulk load CSV from a file object into `table` with COPY.
+
+        Unquoted empty fields are NULL; without `columns` the fields follow
+        the column order of the table. Returns the number of rows loaded.
+        """
+        target = sql.Identifier(table)
+        if columns:
+            target = sql.SQL("{} ({})").format(
+                target, sql.SQL(", ").join(map(sql.Identifier, columns))
+            )
+        options = "FORMAT csv, HEADER true" if header else "FORMAT csv"
+        statement = sql.SQL("COPY {} FROM STDIN WITH ({})").format(
+            target, sql.SQL(options)
+        )
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.copy_expert(statement.as_string(conn), file)
+            return cursor.rowcount
+
+    def copy_rows(
+        self, table: str, columns: list[str] | None, rows: Iterable[tuple]
+    ) -> int:
+        """Bulk load rows into `table` with COPY, the fastest way in.
+
+        Rows are sent as CSV from an in-memory buffer; None becomes NULL and
+        an empty string stays empty. Returns the number of rows loaded.
+        """
+        buffer = io.StringIO()
+        # Everything but None is quoted, so only None reads back as NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NOTNULL)
+        writer.writerows(rows)
+        buffer.seek(0)
+        return self.copy_csv(table, buffer, columns)
+
+    @contextmanager
+    def _pipeline_connection(self) -> Iterator:
+        """A pooled psycopg 3 connection, waiting while `max_size` are in use."""
+        with self._pipeline_slots:
+            with self._lock:
+                connection = self._pipeline_idle.pop() if self._pipeline_idle else None
+            if connection is None or connection.closed or connection.broken:
+                connection = psycopg.connect(self.dsn)
+            try:
+                yield connection
+            finally:
+                if connection.broken:
+                    connection.close()
+                elif not connection.closed:
+                    with self._lock:
+                        self._pipeline_idle.append(connection)
+
+    def pipeline(self, statements: list[tuple[str, tuple]]) -> list[list[tuple]]:
+        """Run `(query, params)` statements in one transaction, returning the
+        rows of each.
+
+        With psycopg 3 installed the statements are sent in pipeline mode:
+        all of them go out before any result is read, so they cost about one
+        round trip instead of one each. Without it they run one after
+        another on a pooled connection.
+        """
+        if psycopg is None:
+            results = []
+            with self.connection() as conn, conn.cursor() as cursor:
+                for query, params in statements:
+                    cursor.execute(query, params)
+                    results.append(cursor.fetchall() if cursor.description else [])
+            return results
+        with self._pipeline_connection() as connection, connection.transaction():
+            with connection.pipeline():
+                cursors = [connection.execute(q, params) for q, params in statements]
+            return [
+                cursor.fetchall() if cursor.description else [] for cursor in cursors
+            ]
+
+    def fetch_numpy(
+        self,
+        query: str,
+        params: tuple | dict = (),
+        dtypes: dict[str, Any] | None = None,
+    ) -> dict[str, np.ndarray]:
+        """Fetch the result of `query` as one NumPy array per column.
+
+        The rows come from `COPY (query) TO STDOUT` as CSV and are parsed by
+        Arrow, so no Python object is created per value. The column types
+        come from the Postgres types (integers, floats, numerics as float64,
+        booleans, dates and timestamps), other columns are object arrays of
+        strings; `dtypes` overrides them by column name. Repeated column names
+        get a suffix (see `unique_names`). Integer columns with
+        NULLs become float64 with NaN, dates and timestamps get NaT.
+        """
+        with self.connection() as conn, conn.cursor() as cursor:
+            query = cursor.mogrify(query, params or None).decode()
+            # Planned, not run: the column names and types of the result
+            cursor.execute(f"SELECT * FROM ({query}) AS result LIMIT 0")
+            description = cursor.description
+            buffer = io.BytesIO()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+        types = {
+            name: POSTGRES_ARROW_TYPES.get(column.type_code, pa.string())
+            for name, column in zip(
+                unique_names([column.name for column in description]), description
+            )
+        }
+        if buffer.tell() == 0:
+            # No rows: Arrow cannot read an empty CSV
+            table = pa.table({name: pa.array([], type) for name, type in types.items()})
+        else:
+            buffer.seek(0)
+            table = pa_csv.read_csv(
+                buffer,
+                read_options=pa_csv.ReadOptions(column_names=list(types)),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=types,
+                    true_values=["t"],
+                    false_values=["f"],
+                    # Unquoted empty fields are NULL, quoted ones empty strings
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+        dtypes = dtypes or {}
+        arrays = {}
+        for name, column in zip(types, table.columns):
+            array = column.to_numpy(zero_copy_only=False)
+            arrays[name] = array.astype(dtypes[name]) if name in dtypes else array
+        return arrays
+
+    def close(self) -> None:
+        """Close all pooled and pipeline connections."""
+        self._pool.closeall()
+        with self._lock:
+            for connection in self._pipeline_idle:
+                connection.close()
+            self._pipeline_idle.clear()
+
+
 if __name__ == "__main__":
     # Example usage (remove or comment out in production):
     conn = get_db_connection(
@@ -0,0 +1,245 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import pyarrow as pa
+from sqlalchemy import Engine, inspect, text
+
+from backend.utils.arrow_utils import fetch_arrow_table, normalize_table
+from backend.utils.metrics import metrics
+
+try:
+    # Optional: embedded columnar engine and a SQL transpiler for its dialect
+    import duckdb
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.annotate_types import annotate_types
+    from sqlglot.optimizer.qualify import qualify
+    from sqlglot.schema import MappingSchema
+except ImportError:
+    duckdb = None
+    sqlglot = None
+
+logger = logging.getLogger(__name__)
+
+# Rows inserted, updated or deleted since the statistics were reset. It
+# changes whenever the data changes, so an unchanged value means the snapshot
+# is still current.
+_CHANGE_COUNTER_QUERY = """
+SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+FROM pg_stat_user_tables
+"""
+
+
+def to_duckdb_sql(query: str, schema: dict[str, dict[str, str]] | None = None) -> str:
+    """Translate a PostgreSQL query to the DuckDB dialect.
+
+    Postgres truncates the division of two integers, DuckDB's `/` does not
+    (`7 / 2` is 3 on Postgres, 3.5 on DuckDB). The operand types are
+    annotated from the column types in `schema` ({table: {column: type}},
+    DuckDB type names), so divisions of integers keep their Postgres result.
+    """
+    expression = sqlglot.parse_one(query, read="postgres")
+    mapping = MappingSchema(schema or {}, dialect="duckdb")
+    aliases = {p.alias for p in expression.selects if isinstance(p, exp.Alias)}
+    try:
+        # Resolve the columns to their tables so their types are known
+        expression = qualify(
+            expression,
+            schema=mapping,
+            dialect="postgres",
+            quote_identifiers=False,
+            validate_qualify_columns=False,
+        )
+    except sqlglot.errors.SqlglotError:
+        # Unknown tables or ambiguous columns: only literals get typed
+        expression = sqlglot.parse_one(query, read="postgres")
+    # Drop the output aliases qualify added, so the result columns keep the
+    # names the query gives them
+    for projection in expression.selects:
+        if isinstance(projection, exp.Alias) and projection.alias not in aliases:
+            projection.replace(projection.this)
+    expression = annotate_types(expression, schema=mapping, dialect="postgres")
+    return expression.sql(dialect="duckdb")
+
+
+class DuckDBSnapshot:
+    """Read-only copy of the Postgres tables in an embedded DuckDB database.
+
+    Every refresh writes a new DuckDB file next to `path` and then atomically
+    points the `path` symlink to it, so readers (in any worker process) keep
+    using the previous file until they next open a connection. A refresh is
+    skipped when the Postgres change counter shows the data is unchanged.
+    Postgres stays the source of truth: queries that DuckDB cannot run are
+    left to the caller to send there.
+    """
+
+    def __init__(self, path: str | Path, refresh_interval: float = 60):
+        self.path = Path(path)
+        self.refresh_interval = refresh_interval
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_env(cls) -> "DuckDBSnapshot":
+        """Create a snapshot configured by `DUCKDB_*` environment variables."""
+        return cls(
+            path=os.getenv("DUCKDB_PATH", ".cache/backend/snapshot.duckdb"),
+            refresh_interval=float(os.getenv("DUCKDB_REFRESH_INTERVAL", "60")),
+        )
+
+    def _change_counter(self, engine: Engine) -> int | None:
+        if engine.dialect.name != "postgresql":
+            return None
+        with engine.connect() as connection:
+            return int(connection.execute(text(_CHANGE_COUNTER_QUERY)).scalar())
+
+    def _snapshot_counter(self) -> int | None:
+        if not self.path.exists():
+            return None
+        with duckdb.connect(str(self.path.resolve()), read_only=True) as connection:
+            row = connection.execute(
+                "SELECT change_counter FROM _snapshot_meta"
+            ).fetchone()
+        return row[0] if row else None
+
+    def refresh(self, engine: Engine, force: bool = False) -> bool:
+        """Copy all tables into a new snapshot if the data has changed.
+
+        Returns whether a new snapshot was written. Only one process refreshes
+        at a time; the others skip the refresh.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            counter = self._change_counter(engine)
+            if not force and counter is not None:
+                if counter == self._snapshot_counter():
+                    return False
+
+            start = time.perf_counter()
+            inspector = inspect(engine)
+            tables = inspector.get_table_names()
+            if engine.dialect.name == "postgresql":
+                tables += inspector.get_materialized_view_names()
+
+            target = self.path.with_name(f"{self.path.stem}-{time.time_ns()}.duckdb")
+            with duckdb.connect(str(target)) as connection:
+                for table in tables:
+                    data = fetch_arrow_table(engine, f'SELECT * FROM "{table}"')
+                    connection.register("_source", data)
+                    connection.execute(f'CREATE TABLE "{table}" AS FROM _source')
+                    connection.unregister("_source")
+                connection.execute(
+                    "CREATE TABLE _snapshot_meta AS"
+                    " SELECT ?::BIGINT AS change_counter, now() AS created_at",
+                    [counter],
+                )
+
+            # Swap the symlink atomically, then drop snapshots older than the
+            # previous one (open connections keep their file alive)
+            link = self.path.with_name(f"{self.path.name}.tmp")
+            link.unlink(missing_ok=True)
+            link.symlink_to(target.name)
+            previous = self.path.resolve() if self.path.exists() else None
+            os.replace(link, self.path)
+            for old in self.path.parent.glob(f"{self.path.stem}-*.duckdb"):
+                if old not in (target, previous):
+                    old.unlink(missing_ok=True)
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("duckdb_snapshot_seconds", elapsed)
+        logger.info(f"DuckDB snapshot of {len(tables)} tables took {elapsed:.2f}s")
+        return True
+
+    def _connection(self):
+        """Read-only connection to the current snapshot, one per thread."""
+        try:
+            current = self.path.resolve(strict=True)
+        except FileNotFoundError:
+            return None
+        if getattr(self._local, "file", None) != current:
+            if getattr(self._local, "connection", None) is not None:
+                self._local.connection.close()
+            self._local.connection = duckdb.connect(str(current), read_only=True)
+            self._local.file = current
+            self._local.schema = self._read_schema(self._local.connection)
+        return self._local.connection
+
+    @staticmethod
+    def _read_schema(connection) -> dict[str, dict[str, str]]:
+        """The column types of the snapshot's tables, for `to_duckdb_sql`."""
+        schema = {}
+        for table, column, data_type in connection.execute(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns"
+            " WHERE table_schema = 'main' ORDER BY table_name, ordinal_position"
+        ).fetchall():
+            schema.setdefault(table, {})[column] = data_type
+        return schema
+
+    def query(self, query: str) -> pa.Table | None:
+        """Run a PostgreSQL `query` on the snapshot.
+
+        Returns None when there is no snapshot yet or the query cannot be run
+        by DuckDB, so the caller can run it on Postgres instead.
+        """
+        connection = self._connection()
+        if connection is None:
+            return None
+        try:
+            table = connection.execute(
+                to_duckdb_sql(query, self._local.schema)
+            ).fetch_arrow_table()
+        except Exception as e:
+            metrics.increment("duckdb_queries", outcome="fallback")
+            logger.info(f"Query falls back to Postgres: {e}")
+            return None
+        metrics.increment("duckdb_queries", outcome="success")
+        return normalize_table(table)
+
+    def _run(self, get_engine: Callable[[], Engine]) -> None:
+        while True:
+            try:
+                self.refresh(get_engine())
+            except Exception as e:
+                metrics.increment("duckdb_snapshot_failures")
+                logger.error(f"Refreshing the DuckDB snapshot failed: {e}")
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def start(self, get_engine: Callable[[], Engine]) -> None:
+        """Take a snapshot now and check for changes every `refresh_interval` seconds."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(get_engine,), name="duckdb-snapshot", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic refresh."""
+        self._stop.set()
+
+
+def _create_snapshot() -> DuckDBSnapshot | None:
+    if os.getenv("QUERY_BACKEND", "postgres") != "duckdb":
+        return None
+    if duckdb is None:
+        logger.warning(
+            "QUERY_BACKEND=duckdb requires the duckdb extra, using Postgres instead"
+        )
+        return None
+    return DuckDBSnapshot.from_env()
+
+
+# Create the global snapshot (None unless QUERY_BACKEND=duckdb)
+duckdb_snapshot = _create_snapshot()
@@ -0,0 +1,139 @@
+import csv
+import io
+from collections.abc import Iterable, Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Engine, text
+
+from backend.utils.arrow_utils import POSTGRES_ARROW_TYPES, unique_names
+
+# Number of rows fetched from the server-side cursor per chunk
+EXPORT_CHUNK_ROWS = 10_000
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file object that buffers written bytes until drained.
+
+    Tracks the absolute position so the Parquet writer can compute offsets
+    while the bytes already written have been handed to the client.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _stream_rows(
+    engine: Engine, query: str, chunk_size: int
+) -> Iterator[tuple[list[str], list[pa.DataType | None], list]]:
+    """Yield (column names, column types, rows) chunks of `query` from a
+    server-side cursor.
+
+    The column types are the Arrow types of the Postgres column types, None
+    where the driver reports no known type. The query runs in a read-only
+    transaction, so an export can never modify the database.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True,
+            max_row_buffer=chunk_size,
+            postgresql_readonly=True,
+        ).execute(text(query))
+        columns = unique_names(list(result.keys()))
+        types = [
+            POSTGRES_ARROW_TYPES.get(column[1]) for column in result.cursor.description
+        ]
+        empty = True
+        for rows in result.partitions(chunk_size):
+            empty = False
+            yield columns, types, rows
+        if empty:
+            yield columns, types, []
+
+
+def stream_query_csv(
+    engine: Engine, query: str, chunk_size: int = EXPORT_CHUNK_ROWS
+) -> Iterator[bytes]:
+    """Stream the result of `query` as CSV, one chunk of rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, _, rows in _stream_rows(engine, query, chunk_size):
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _parquet_schema(
+    columns: list[str], types: list[pa.DataType | None], rows: list
+) -> pa.Schema:
+    """The schema of the whole export, fixed before the first row group.
+
+    Columns of a known Postgres type get its Arrow type. The others are
+    inferred from the first chunk, with decimals as float64 like
+    `normalize_table` and all-NULL columns as strings.
+    """
+    fields = []
+    for index, (name, arrow_type) in enumerate(zip(columns, types)):
+        if arrow_type is None:
+            arrow_type = pa.array([row[index] for row in rows]).type
+            if pa.types.is_decimal(arrow_type):
+                arrow_type = pa.float64()
+            elif pa.types.is_null(arrow_type):
+                arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _chunk_table(rows: list, schema: pa.Schema) -> pa.Table:
+    """The rows of a chunk as a table cast to the schema of the export."""
+    arrays = []
+    for index, arrow_field in enumerate(schema):
+        array = pa.array([row[index] for row in rows])
+        arrays.append(array.cast(arrow_field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet_chunks(
+    chunks: Iterable[tuple[list[str], list[pa.DataType | None], list]],
+) -> Iterator[bytes]:
+    """Write (column names, column types, rows) chunks as Parquet, one row
+    group per chunk, yielding the bytes written so far."""
+    sink = _StreamSink()
+    writer = None
+    for columns, types, rows in chunks:
+        if writer is None:
+            writer = pq.ParquetWriter(sink, _parquet_schema(columns, types, rows))
+        writer.write_table(_chunk_table(rows, writer.schema))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def stream_query_parquet(
+    engine: Engine, query: str, chunk_size: int = EXPORT_CHUNK_ROWS
+) -> Iterator[bytes]:
+    """Stream the result of `query` as Parquet, one row group per chunk."""
+    return write_parquet_chunks(_stream_rows(engine, query, chunk_size))
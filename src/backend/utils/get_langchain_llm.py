@@ -16,4 +16,6 @@ langchain_openai_client = AzureChatOpenAI(
     api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
     model="gpt-4.1",
+    # Retries on rate limits are paced by backend.utils.rate_limit instead
+    max_retries=0,
 )
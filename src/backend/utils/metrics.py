@@ -0,0 +1,54 @@
+import threading
+from collections import defaultdict
+
+
+def _metric_key(name: str, labels: dict[str, str]) -> str:
+    """Build a Prometheus-style key, e.g. `admission_rejected{reason="queue_full"}`."""
+    if not labels:
+        return name
+    label_str = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class MetricsRegistry:
+    """Thread-safe in-process registry of counters, gauges and summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, dict[str, float]] = {}
+
+    def increment(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increase a counter by `value`."""
+        with self._lock:
+            self._counters[_metric_key(name, labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge to the current `value`."""
+        with self._lock:
+            self._gauges[_metric_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record one observation (e.g. a duration) in a summary."""
+        key = _metric_key(name, labels)
+        with self._lock:
+            summary = self._summaries.setdefault(
+                key, {"count": 0.0, "sum": 0.0, "max": 0.0}
+            )
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> dict[str, dict]:
+        """Return a copy of all metrics."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {key: dict(val) for key, val in self._summaries.items()},
+            }
+
+
+# Create a global registry
+metrics = MetricsRegistry()
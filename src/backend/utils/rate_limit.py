@@ -0,0 +1,157 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+import openai
+
+from backend.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Backoff between retries of a failed LLM call: up to the base delay doubled
+# per attempt, capped, with full jitter so clients do not retry in lockstep
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate adapts to rate-limit responses.
+
+    Every call takes one token from the bucket, which refills at `rate` tokens
+    per second up to `burst`. When the upstream service answers with a rate
+    limit error the rate is cut by `decrease_factor` and the bucket is paused
+    for the advertised `Retry-After`; every successful call raises the rate by
+    `increase_step` again (additive increase, multiplicative decrease).
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        min_rate: float,
+        max_rate: float,
+        increase_step: float = 0.05,
+        decrease_factor: float = 0.5,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+
+    @classmethod
+    def from_env(cls) -> "AdaptiveRateLimiter":
+        """Create a limiter configured by `LLM_RATE_*` environment variables."""
+        rate = float(os.getenv("LLM_RATE_PER_SECOND", "2"))
+        return cls(
+            rate=rate,
+            burst=float(os.getenv("LLM_RATE_BURST", "4")),
+            min_rate=float(os.getenv("LLM_RATE_MIN_PER_SECOND", "0.1")),
+            max_rate=float(os.getenv("LLM_RATE_MAX_PER_SECOND", str(rate * 2))),
+        )
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - max(self._last_refill, self._blocked_until))
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def acquire(self) -> float:
+        """Block until a token is available. Returns the time spent waiting."""
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    waited = now - start
+                    metrics.observe("llm_rate_limit_wait_seconds", waited)
+                    return waited
+                if now < self._blocked_until:
+                    sleep_for = self._blocked_until - now
+                else:
+                    sleep_for = (1 - self._tokens) / self.rate
+            time.sleep(sleep_for)
+
+    def on_success(self) -> None:
+        """Additively increase the rate after a successful call."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+            metrics.set_gauge("llm_rate_per_second", self.rate)
+
+    def on_rate_limited(self, retry_after: float | None = None) -> None:
+        """Multiplicatively decrease the rate and pause for `retry_after` seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = 0.0
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            metrics.set_gauge("llm_rate_per_second", self.rate)
+        metrics.increment("llm_rate_limited")
+        logger.warning(
+            f"LLM rate limited, pacing at {self.rate:.2f} calls/s"
+            f" (retry after {retry_after}s)"
+        )
+
+
+def _retry_after_seconds(error: openai.APIError) -> float | None:
+    """Read the `Retry-After` header from an API error, if present."""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt: int, retry_after: float | None) -> float:
+    """Seconds to wait before retry number `attempt + 1`, `Retry-After` first."""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+def call_with_rate_limit(
+    limiter: AdaptiveRateLimiter,
+    function: Callable[..., Any],
+    *args: Any,
+    max_retries: int = 3,
+    **kwargs: Any,
+) -> Any:
+    """Call `function` paced by `limiter`, retrying on rate limit and transient errors.
+
+    Retries wait for the `Retry-After` of the error, or an exponential backoff
+    with jitter when the provider sends none.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            result = function(*args, **kwargs)
+        except openai.RateLimitError as e:
+            retry_after = _retry_after_seconds(e)
+            limiter.on_rate_limited(retry_after)
+            if attempt == max_retries:
+                raise
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            # Transient upstream errors do not slow down the other calls
+            retry_after = _retry_after_seconds(e)
+            if attempt == max_retries:
+                raise
+        else:
+            limiter.on_success()
+            return result
+        time.sleep(_backoff_seconds(attempt, retry_after))
+
+
+# Create a global limiter for outbound LLM calls
+llm_rate_limiter = AdaptiveRateLimiter.from_env()
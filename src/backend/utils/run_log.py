@@ -0,0 +1,437 @@
+"""Append-only log of agent runs, their tool calls and SQL queries.
+
+Reports the query shapes that take the most time and the questions asked
+most often, to see what to index, materialize and cache:
+
+    uv run python -m backend.utils.run_log --limit 10 --hours 168
+"""
+
+import argparse
+import contextvars
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from backend.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+# Queries slower than the threshold, on their own logger so they can be routed
+slow_query_logger = logging.getLogger("backend.slow_queries")
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        started_at REAL NOT NULL,
+        trace_id TEXT,
+        client_id TEXT,
+        mode TEXT,
+        question TEXT,
+        question_key TEXT,
+        seconds REAL,
+        llm_calls INTEGER,
+        tokens INTEGER,
+        sql_seconds REAL,
+        stop_reason TEXT,
+        error TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tool_calls (
+        run_id TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        tool TEXT NOT NULL,
+        args TEXT,
+        seconds REAL,
+        error TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS queries (
+        run_id TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        tool TEXT,
+        datasource TEXT,
+        sql TEXT NOT NULL,
+        shape TEXT NOT NULL,
+        seconds REAL,
+        row_count INTEGER,
+        cache_hit INTEGER NOT NULL DEFAULT 0,
+        slow INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at)",
+    "CREATE INDEX IF NOT EXISTS queries_started_at ON queries (started_at)",
+    "CREATE INDEX IF NOT EXISTS tool_calls_started_at ON tool_calls (started_at)",
+]
+
+# Seconds between deletions of the runs older than the retention period
+_PRUNE_INTERVAL = 3600
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def query_shape(sql: str) -> str:
+    """The shape of a query: literals replaced by `?`, whitespace and case folded.
+
+    Queries that differ only in the values they filter on share a shape.
+    """
+    shape = _STRING_LITERAL.sub("?", sql)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = " ".join(shape.lower().split()).rstrip(";").strip()
+    return _IN_LIST.sub("(?)", shape)
+
+
+def question_key(question: str) -> str:
+    """Fold case, whitespace and trailing punctuation, so repeats match."""
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+
+@dataclass
+class RunRecord:
+    run_id: str
+    question: str
+    fields: dict[str, Any] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.time)
+    tool_calls: list[tuple] = field(default_factory=list)
+    queries: list[tuple] = field(default_factory=list)
+    usage: dict[str, float] = field(default_factory=dict)
+    stop_reason: str | None = None
+
+
+_current_run: contextvars.ContextVar[RunRecord | None] = contextvars.ContextVar(
+    "current_run", default=None
+)
+
+
+class RunLog:
+    """Append-only SQLite log of agent runs.
+
+    Inside `run()`, the tool calls and SQL queries of the run (from any
+    thread started with a copy of the context) are collected and written in
+    one transaction when the run ends, together with its question and budget
+    usage. Queries slower than `slow_query_seconds` are also logged on the
+    `backend.slow_queries` logger and flagged in the log. Runs older than
+    `retention_days` are deleted, at most once an hour per process.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        slow_query_seconds: float = 1.0,
+        enabled: bool = True,
+        retention_days: float = 30,
+    ):
+        self.path = Path(path)
+        self.slow_query_seconds = slow_query_seconds
+        self.enabled = enabled
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "RunLog":
+        """Create a run log configured by `RUN_LOG_*` environment variables."""
+        return cls(
+            path=os.getenv("RUN_LOG_PATH", ".data/run_log.sqlite3"),
+            slow_query_seconds=float(os.getenv("SLOW_QUERY_SECONDS", "1.0")),
+            enabled=os.getenv("RUN_LOG_ENABLED", "true").lower() == "true",
+            retention_days=float(os.getenv("RUN_LOG_RETENTION_DAYS", "30")),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process, like the shared cache
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def run(self, run_id: str, question: str, **fields) -> Iterator[None]:
+        """Collect the tool calls and queries of the run `run_id` and log them at the end."""
+        if not self.enabled:
+            yield
+            return
+        record = RunRecord(run_id, question, fields)
+        token = _current_run.set(record)
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_run.reset(token)
+            try:
+                self._write(record, error)
+            except Exception as e:
+                logger.warning(f"Writing run {run_id} to the run log failed: {e}")
+
+    def set_usage(self, usage: dict[str, float], stop_reason: str | None = None):
+        """Record the budget usage of the current run."""
+        record = _current_run.get()
+        if record is not None:
+            record.usage = usage
+            record.stop_reason = stop_reason
+
+    def log_tool_call(
+        self, tool: str, args: dict, seconds: float, error: str | None = None
+    ):
+        """Record a tool call of the current run."""
+        record = _current_run.get()
+        if record is None:
+            return
+        record.tool_calls.append(
+            (time.time() - seconds, tool, orjson.dumps(args).decode(), seconds, error)
+        )
+
+    def log_query(
+        self,
+        tool: str,
+        datasource: str,
+        sql: str,
+        seconds: float,
+        row_count: int | None = None,
+        cache_hit: bool = False,
+        error: str | None = None,
+    ):
+        """Record a query of the current run and log it if it was slow."""
+        slow = not cache_hit and seconds >= self.slow_query_seconds
+        if slow:
+            metrics.increment("slow_queries", datasource=datasource)
+            slow_query_logger.warning(
+                f"Slow query on {datasource} ({seconds:.2f}s, {row_count} rows): "
+                + " ".join(sql.split())
+            )
+        record = _current_run.get()
+        if record is None:
+            return
+        record.queries.append(
+            (
+                time.time() - seconds,
+                tool,
+                datasource,
+                sql,
+                query_shape(sql),
+                seconds,
+                row_count,
+                cache_hit,
+                slow,
+                error,
+            )
+        )
+
+    def _write(self, record: RunRecord, error: str | None):
+        usage = record.usage
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.run_id,
+                    record.started_at,
+                    record.fields.get("trace_id"),
+                    record.fields.get("client_id"),
+                    record.fields.get("mode"),
+                    record.question,
+                    question_key(record.question),
+                    usage.get("seconds", time.time() - record.started_at),
+                    usage.get("llm_calls"),
+                    usage.get("tokens"),
+                    usage.get("sql_seconds"),
+                    record.stop_reason,
+                    error,
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO tool_calls VALUES (?, ?, ?, ?, ?, ?)",
+                [(record.run_id, *call) for call in record.tool_calls],
+            )
+            connection.executemany(
+                "INSERT INTO queries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(record.run_id, *query) for query in record.queries],
+            )
+        if self.retention_days > 0 and time.time() - self._pruned_at > _PRUNE_INTERVAL:
+            self._pruned_at = time.time()
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete the runs older than `retention_days`, returning how many."""
+        cutoff = time.time() - self.retention_days * 86400
+        connection = self._connection()
+        with connection:
+            for table in ("tool_calls", "queries"):
+                connection.execute(
+                    f"DELETE FROM {table} WHERE started_at < ?", (cutoff,)
+                )
+            deleted = connection.execute(
+                "DELETE FROM runs WHERE started_at < ?", (cutoff,)
+            ).rowcount
+        if deleted:
+            logger.info(f"Deleted {deleted} runs older than {self.retention_days} days")
+        return deleted
+
+    def _rows(self, sql: str, parameters: tuple) -> list[dict]:
+        cursor = self._connection().execute(sql, parameters)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def report(self, limit: int = 10, hours: float | None = None) -> dict:
+        """Aggregate the log of the last `hours` (all of it by default).
+
+        - `slow_query_shapes`: query shapes by the total time spent running
+          them, with their count, mean and max seconds, rows and cache hit rate
+        - `slow_queries`: the latest queries over the slow-query threshold
+        - `repeated_questions`: the questions asked most often
+        """
+        since = time.time() - hours * 3600 if hours else 0.0
+        shapes = self._rows(
+            """
+            SELECT shape, datasource,
+                COUNT(*) AS count,
+                SUM(cache_hit) AS cache_hits,
+                SUM(slow) AS slow_count,
+                SUM(error IS NOT NULL) AS errors,
+                ROUND(SUM(CASE WHEN cache_hit = 0 THEN seconds ELSE 0 END), 3) AS total_seconds,
+                ROUND(AVG(CASE WHEN cache_hit = 0 THEN seconds END), 3) AS mean_seconds,
+                ROUND(MAX(CASE WHEN cache_hit = 0 THEN seconds END), 3) AS max_seconds,
+                ROUND(AVG(row_count), 1) AS mean_rows,
+                MAX(sql) AS example
+            FROM queries
+            WHERE started_at >= ?
+            GROUP BY shape, datasource
+            ORDER BY total_seconds DESC
+            LIMIT ?
+            """,
+            (since, limit),
+        )
+        slow = self._rows(
+            """
+            SELECT run_id, started_at, datasource, sql, ROUND(seconds, 3) AS seconds,
+                row_count
+            FROM queries
+            WHERE slow = 1 AND started_at >= ?
+            ORDER BY started_at DESC
+            LIMIT ?
+            """,
+            (since, limit),
+        )
+        questions = self._rows(
+            """
+            SELECT MAX(question) AS question,
+                COUNT(*) AS count,
+                ROUND(AVG(seconds), 3) AS mean_seconds,
+                ROUND(AVG(tokens), 1) AS mean_tokens,
+                ROUND(AVG(llm_calls), 2) AS mean_llm_calls,
+                MAX(started_at) AS last_asked
+            FROM runs
+            WHERE started_at >= ? AND question_key != ''
+            GROUP BY question_key
+            ORDER BY count DESC, last_asked DESC
+            LIMIT ?
+            """,
+            (since, limit),
+        )
+        (runs,) = (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM runs WHERE started_at >= ?", (since,))
+            .fetchone()
+        )
+        return {
+            "runs": runs,
+            "slow_query_seconds": self.slow_query_seconds,
+            "slow_query_shapes": shapes,
+            "slow_queries": slow,
+            "repeated_questions": questions,
+        }
+
+    def workload(
+        self, datasource: str, limit: int = 20, hours: float | None = None
+    ) -> list[dict]:
+        """The SELECT query shapes the agent ran successfully on `datasource`.
+
+        Ordered by the total time spent running them (cache hits count
+        towards `count` but not towards `total_seconds`), each with one
+        example query.
+        """
+        since = time.time() - hours * 3600 if hours else 0.0
+        return self._rows(
+            """
+            SELECT shape,
+                COUNT(*) AS count,
+                ROUND(SUM(CASE WHEN cache_hit = 0 THEN seconds ELSE 0 END), 3) AS total_seconds,
+                MAX(sql) AS sql
+            FROM queries
+            WHERE started_at >= ? AND datasource = ? AND error IS NULL
+                AND (shape LIKE 'select%' OR shape LIKE 'with%')
+            GROUP BY shape
+            ORDER BY total_seconds DESC
+            LIMIT ?
+            """,
+            (since, datasource, limit),
+        )
+
+
+# Create a global run log
+run_log = RunLog.from_env()
+
+
+def _print_report(report: dict):
+    print(f"{report['runs']} runs")
+    print("\nQuery shapes by total time:")
+    for row in report["slow_query_shapes"]:
+        print(
+            f"  {row['total_seconds'] or 0:8.2f}s total  {row['count']:5d}x"
+            f"  mean {row['mean_seconds'] or 0:.3f}s  max {row['max_seconds'] or 0:.3f}s"
+            f"  cache hits {row['cache_hits']}  [{row['datasource']}] {row['shape'][:120]}"
+        )
+    print(f"\nSlow queries (over {report['slow_query_seconds']}s):")
+    for row in report["slow_queries"]:
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["started_at"]))
+        sql = " ".join(row["sql"].split())
+        print(f"  {started}  {row['seconds']:8.2f}s  [{row['datasource']}] {sql[:120]}")
+    print("\nMost repeated questions:")
+    for row in report["repeated_questions"]:
+        print(
+            f"  {row['count']:5d}x  mean {row['mean_seconds'] or 0:.1f}s"
+            f"  {row['mean_tokens'] or 0:.0f} tokens  {row['question'][:120]}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--limit", type=int, default=10, help="Rows per section")
+    parser.add_argument(
+        "--hours", type=float, default=None, help="Only the last hours of the log"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    report = run_log.report(args.limit, args.hours)
+    if args.json:
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
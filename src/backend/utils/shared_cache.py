@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from backend.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Run the size-based eviction after this many writes
+_EVICT_EVERY = 32
+# Seconds between updates of an entry's access time on reads
+_TOUCH_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+def cache_key(*parts: str) -> str:
+    """Hash `parts` into a fixed-length key."""
+    joined = "\x1f".join(part.strip() for part in parts)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+class SharedCache:
+    """Key-value cache in a local SQLite file, shared by all worker processes.
+
+    Values are pickled, or stored as is with `set_bytes`, per `namespace`
+    with an optional TTL. The database runs in WAL mode, so readers in other
+    workers are not blocked by a writer. When the stored values exceed
+    `max_bytes`, the least recently used entries are removed.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = 512 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SharedCache":
+        """Create a cache configured by `BACKEND_CACHE_*` environment variables."""
+        cache_dir = Path(os.getenv("BACKEND_CACHE_DIR", ".cache/backend"))
+        return cls(
+            path=cache_dir / "cache.sqlite3",
+            max_bytes=int(os.getenv("BACKEND_CACHE_MAX_MB", "512")) * 1024 * 1024,
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread (and per process, connections do not
+        # survive a fork)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_bytes(self, namespace: str, key: str) -> bytes | None:
+        """Get a value stored with `set_bytes`, or None if missing or expired."""
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT value, accessed_at FROM cache WHERE namespace = ? AND key = ?"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, now),
+        ).fetchone()
+        if row is None:
+            metrics.increment("cache_misses", namespace=namespace)
+            return None
+        value, accessed_at = row
+        # The access time only orders the size-based eviction, so reads
+        # refresh it at most every `_TOUCH_INTERVAL` seconds
+        if now - accessed_at > _TOUCH_INTERVAL:
+            connection.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+        metrics.increment("cache_hits", namespace=namespace)
+        return value
+
+    def set_bytes(
+        self, namespace: str, key: str, value: bytes, ttl: float | None = None
+    ) -> None:
+        """Store `value` as is, replacing any previous value for the key."""
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (namespace, key, value, len(value), now, now, now + ttl if ttl else None),
+        )
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % _EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def get(self, namespace: str, key: str) -> Any | None:
+        """Get a cached value, or None if it is missing or expired."""
+        blob = self.get_bytes(namespace, key)
+        return pickle.loads(blob) if blob is not None else None
+
+    def set(
+        self, namespace: str, key: str, value: Any, ttl: float | None = None
+    ) -> None:
+        """Store `value`, replacing any previous value for the key."""
+        self.set_bytes(
+            namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl
+        )
+
+    def get_or_set(
+        self,
+        namespace: str,
+        key: str,
+        factory: Callable[[], Any],
+        ttl: float | None = None,
+    ) -> Any:
+        """Get a cached value, computing and storing it with `factory` on a miss."""
+        value = self.get(namespace, key)
+        if value is None:
+            value = factory()
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def keys(self, namespace: str, prefix: str = "") -> list[str]:
+        """List the live keys of a namespace starting with `prefix`, oldest first."""
+        rows = self._connection().execute(
+            "SELECT key FROM cache WHERE namespace = ? AND substr(key, 1, ?) = ?"
+            " AND (expires_at IS NULL OR expires_at > ?) ORDER BY created_at",
+            (namespace, len(prefix), prefix, time.time()),
+        )
+        return [row[0] for row in rows]
+
+    def clear(self, namespace: str | None = None) -> None:
+        """Remove all entries, or only those of `namespace`."""
+        if namespace is None:
+            self._connection().execute("DELETE FROM cache")
+        else:
+            self._connection().execute(
+                "DELETE FROM cache WHERE namespace = ?", (namespace,)
+            )
+
+    def evict(self) -> None:
+        """Remove expired entries, then the least recently used over `max_bytes`."""
+        connection = self._connection()
+        connection.execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache"
+        ).fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for rowid, size in connection.execute(
+            "SELECT rowid, size FROM cache ORDER BY accessed_at"
+        ):
+            stale.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM cache WHERE rowid = ?", stale)
+        metrics.increment("cache_evictions", value=len(stale))
+        logger.info(f"Evicted {len(stale)} cache entries over the size limit")
+
+
+# Create a global cache shared by all workers on this host
+shared_cache = SharedCache.from_env()
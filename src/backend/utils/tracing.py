@@ -0,0 +1,427 @@
+import contextvars
+import functools
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+import orjson
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend.utils.shared_cache import SharedCache, shared_cache
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "data-analyst-backend"
+
+# W3C trace context header: version-trace_id-parent_id-flags
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+# Longer attribute values (SQL statements, plotting code) are cut
+_MAX_ATTRIBUTE_LENGTH = 2000
+
+
+def _new_id(num_bytes: int) -> str:
+    return secrets.token_hex(num_bytes)
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+    """The trace ID and parent span ID of a `traceparent` header, if it is valid."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if match is None or set(match.group(1)) == {"0"}:
+        return None
+    return match.group(1), match.group(2)
+
+
+def _clean(value: Any) -> Any:
+    if isinstance(value, bool | int | float) or value is None:
+        return value
+    value = str(value)
+    if len(value) > _MAX_ATTRIBUTE_LENGTH:
+        return value[:_MAX_ATTRIBUTE_LENGTH] + "..."
+    return value
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    def set(self, **attributes: Any):
+        """Set attributes, e.g. the row count once a query has run."""
+        self.attributes.update(
+            {k: _clean(v) for k, v in attributes.items() if v is not None}
+        )
+
+    def end(self, error: BaseException | None = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:_MAX_ATTRIBUTE_LENGTH]
+
+    def to_otlp(self) -> dict:
+        """The span in the OTLP/JSON encoding of OpenTelemetry."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            # STATUS_CODE_ERROR or STATUS_CODE_OK
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+@dataclass
+class _Trace:
+    run_id: str
+    trace_id: str
+    spans: list[Span] = field(default_factory=list)
+
+
+_current_trace: contextvars.ContextVar[_Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Tracer:
+    """Records the spans of agent runs: graph nodes, LLM calls, tools, SQL
+    statements and chart rendering.
+
+    A run is traced inside `trace()`; spans opened with `span()` anywhere in
+    the same context (threads started with a copy of it included) become its
+    children. When the run ends its spans are kept in the shared cache for
+    `ttl` seconds, so any worker can serve the timeline, and exported as
+    OTLP/JSON to `export_file` (one trace per line) and to the OTLP/HTTP
+    `otlp_endpoint` of a collector. Outside of a trace, spans cost nothing.
+    """
+
+    namespace = "traces"
+
+    def __init__(
+        self,
+        cache: SharedCache,
+        enabled: bool = True,
+        ttl: float = 3600,
+        export_file: str | None = None,
+        otlp_endpoint: str | None = None,
+        max_spans: int = 5000,
+    ):
+        self.cache = cache
+        self.enabled = enabled
+        self.ttl = ttl
+        self.export_file = export_file
+        self.otlp_endpoint = otlp_endpoint
+        self.max_spans = max_spans
+        self._export_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, cache: SharedCache) -> "Tracer":
+        """Create a tracer configured by `TRACING_*`/`TRACE_*` environment variables."""
+        return cls(
+            cache,
+            enabled=os.getenv("TRACING_ENABLED", "true").lower() == "true",
+            ttl=float(os.getenv("TRACE_TTL", "3600")),
+            export_file=os.getenv("TRACE_EXPORT_FILE") or None,
+            otlp_endpoint=os.getenv("TRACE_OTLP_ENDPOINT") or None,
+        )
+
+    @contextmanager
+    def trace(
+        self, name: str, run_id: str, traceparent: str | None = None, **attributes
+    ) -> Iterator[Span | None]:
+        """Trace the run `run_id` with a root span called `name`.
+
+        A valid W3C `traceparent` (sent by the frontend) continues the
+        caller's trace, so its spans and ours share one trace ID.
+        """
+        if not self.enabled:
+            yield None
+            return
+        trace_id, parent_id = parse_traceparent(traceparent) or (_new_id(16), None)
+        trace = _Trace(run_id, trace_id)
+        root = Span(name, trace_id, _new_id(8), parent_id)
+        root.set(run_id=run_id, **attributes)
+        trace.spans.append(root)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.end(e)
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            root.end()
+            self._finish(trace)
+
+    def start_span(self, name: str, **attributes) -> Span | None:
+        """Start a span in the current trace without making it the current span.
+
+        For leaf spans ended elsewhere; returns None outside of a trace.
+        """
+        trace = _current_trace.get()
+        if trace is None or len(trace.spans) >= self.max_spans:
+            return None
+        parent = _current_span.get()
+        span = Span(
+            name, trace.trace_id, _new_id(8), parent.span_id if parent else None
+        )
+        span.set(**attributes)
+        trace.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span | None]:
+        """Record a span around the block, as a child of the current span."""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def traced(self, name: str) -> Callable[[Callable], Callable]:
+        """Decorate a function to record a span `name` around every call."""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def current_trace_id(self) -> str | None:
+        trace = _current_trace.get()
+        return trace.trace_id if trace else None
+
+    def _finish(self, trace: _Trace):
+        try:
+            self.cache.set(self.namespace, trace.run_id, trace, self.ttl)
+        except Exception as e:
+            logger.warning(f"Storing the trace of run {trace.run_id} failed: {e}")
+        if self.export_file or self.otlp_endpoint:
+            payload = orjson.dumps(_to_otlp(trace.spans))
+            if self.export_file:
+                self._export_to_file(payload)
+            if self.otlp_endpoint:
+                # Off the request path; a missing collector only logs a warning
+                threading.Thread(
+                    target=self._export_to_collector,
+                    args=(payload,),
+                    name="trace-export",
+                    daemon=True,
+                ).start()
+
+    def _export_to_file(self, payload: bytes):
+        try:
+            with self._export_lock, open(self.export_file, "ab") as file:
+                file.write(payload + b"\n")
+        except OSError as e:
+            logger.warning(f"Writing the trace to {self.export_file} failed: {e}")
+
+    def _export_to_collector(self, payload: bytes):
+        request = urllib.request.Request(
+            self.otlp_endpoint,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        except Exception as e:
+            logger.warning(f"Exporting the trace to {self.otlp_endpoint} failed: {e}")
+
+    def timeline(self, run_id: str) -> dict | None:
+        """The spans of a finished run as a flame-style timeline, or None if
+        the run is unknown or expired.
+
+        Spans are ordered by start time with their depth and start offset, so
+        nesting reads top-down. `self_ms` is the time a span spent outside of
+        its children; summed per category (the span name up to the first dot:
+        node, llm, tool, sql, render, ...) it shows where the time went.
+        """
+        trace = self.cache.get(self.namespace, run_id)
+        if trace is None:
+            return None
+        return _build_timeline(trace)
+
+    def instrument_sqlalchemy(self):
+        """Record a `sql.execute` span for every statement of every engine."""
+        if not event.contains(Engine, "before_cursor_execute", _before_execute):
+            event.listen(Engine, "before_cursor_execute", _before_execute)
+            event.listen(Engine, "after_cursor_execute", _after_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+
+
+def _to_otlp(spans: list[Span]) -> dict:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "backend"},
+                        "spans": [span.to_otlp() for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _build_timeline(trace: _Trace) -> dict:
+    root = trace.spans[0]
+    end_ns = root.end_ns or time.time_ns()
+    children: dict[str | None, list[Span]] = {}
+    for span in trace.spans[1:]:
+        children.setdefault(span.parent_id, []).append(span)
+
+    def duration(span: Span) -> int:
+        # Spans of threads still running when the run ended end with it
+        return (span.end_ns or end_ns) - span.start_ns
+
+    entries = []
+    self_time: dict[str, float] = {}
+
+    def visit(span: Span, depth: int):
+        nested = sorted(children.get(span.span_id, []), key=lambda s: s.start_ns)
+        # Children of one span may overlap (concurrent candidates)
+        busy = 0
+        covered_until = span.start_ns
+        for child in nested:
+            child_end = child.start_ns + duration(child)
+            start = max(child.start_ns, covered_until)
+            if child_end > start:
+                busy += child_end - start
+                covered_until = child_end
+        self_ms = max(duration(span) - busy, 0) / 1e6
+        category = span.name.split(".", 1)[0]
+        self_time[category] = self_time.get(category, 0.0) + self_ms
+        entries.append(
+            {
+                "name": span.name,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "depth": depth,
+                "start_ms": round((span.start_ns - root.start_ns) / 1e6, 3),
+                "duration_ms": round(duration(span) / 1e6, 3),
+                "self_ms": round(self_ms, 3),
+                "attributes": span.attributes,
+                "error": span.error,
+            }
+        )
+        for child in nested:
+            visit(child, depth + 1)
+
+    visit(root, 0)
+    return {
+        "run_id": trace.run_id,
+        "trace_id": trace.trace_id,
+        "duration_ms": round((end_ns - root.start_ns) / 1e6, 3),
+        "self_time_ms": {
+            category: round(ms, 3)
+            for category, ms in sorted(self_time.items(), key=lambda item: -item[1])
+        },
+        "spans": entries,
+    }
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    span = tracer.start_span(
+        "sql.execute", db_system=conn.dialect.name, db_statement=statement
+    )
+    if span is not None:
+        conn.info.setdefault("trace_spans", []).append(span)
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        span = spans.pop()
+        span.set(rows=cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get("trace_spans") if connection is not None else None
+    if spans:
+        spans.pop().end(exception_context.original_exception)
+
+
+def bind_context(iterator: Iterator) -> Iterator:
+    """Resume `iterator` in one context every time.
+
+    A streaming response advances its generator from different threads,
+    each with a fresh copy of the context, which would lose the current
+    trace between two chunks.
+    """
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            context.run(close)
+
+
+# Create a global tracer
+tracer = Tracer.from_env(shared_cache)
@@ -0,0 +1,69 @@
+import logging
+import threading
+import time
+
+from backend.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry of a failed warmup, doubled up to the maximum
+WARMUP_RETRY_DELAY = 1.0
+WARMUP_MAX_RETRY_DELAY = 60.0
+
+_ready = threading.Event()
+_warmup_thread: threading.Thread | None = None
+
+
+def warmup() -> bool:
+    """Import the agent stack and compile the graph ahead of the first request.
+
+    The heavy imports (LangGraph, LangChain/OpenAI, pandas, pyarrow) are kept
+    out of the import of `backend.app`, so the server starts listening quickly
+    and pays for them here, in the background, instead. Returns whether it
+    succeeded.
+    """
+    start = time.perf_counter()
+    try:
+        import backend.agent.results  # noqa: F401
+        import backend.utils.export  # noqa: F401
+        from backend.agent.catalog import datasources_prompt
+        from backend.agent.graph import get_compiled_graph
+
+        get_compiled_graph()
+        # Fill the schema catalog used in the system prompt
+        datasources_prompt()
+    except Exception as e:
+        logger.error(f"Warmup failed: {e}")
+        metrics.increment("warmup_failures")
+        return False
+    elapsed = time.perf_counter() - start
+    metrics.observe("warmup_seconds", elapsed)
+    logger.info(f"Warmup finished in {elapsed:.2f}s")
+    _ready.set()
+    return True
+
+
+def _warmup_until_ready() -> None:
+    # A failed warmup, e.g. with the database not up yet, is retried with
+    # backoff, otherwise the process would never report ready
+    delay = WARMUP_RETRY_DELAY
+    while not warmup():
+        logger.info(f"Retrying the warmup in {delay:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, WARMUP_MAX_RETRY_DELAY)
+
+
+def start_warmup() -> threading.Thread:
+    """Run `warmup` in a daemon thread (once per process) until it succeeds."""
+    global _warmup_thread
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(
+            target=_warmup_until_ready, name="warmup", daemon=True
+        )
+        _warmup_thread.start()
+    return _warmup_thread
+
+
+def is_ready() -> bool:
+    """Whether the warmup has finished and requests are served at full speed."""
+    return _ready.is_set()
@@ -1,10 +1,190 @@
+import base64
+import gzip
+import json
+import os
+import secrets
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import dash
+import diskcache
+import flask
 import requests
-from dash import Input, Output, State, dcc, html
+from dash import Input, Output, Patch, State, dcc, html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8002")
+# URL of the backend as seen from the browser, used for download links
+BACKEND_PUBLIC_URL = os.getenv("BACKEND_PUBLIC_URL", BACKEND_URL)
+# Compression of request bodies sent to the backend: gzip, zstd or none
+BACKEND_REQUEST_COMPRESSION = os.getenv("BACKEND_REQUEST_COMPRESSION", "gzip")
+# Pooled connections to the backend, and threads sending agent runs over them
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "10"))
 
 # Google Fonts import for modern look
 FONT_URL = "https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap"
 
+# On-disk caches shared by all web server processes
+CACHE_DIR = os.getenv("FRONTEND_CACHE_DIR", ".cache/frontend")
+# Progress and outcome of the agent runs, polled by the browser
+job_cache = diskcache.Cache(os.path.join(CACHE_DIR, "jobs"))
+# Seconds the outcome of an agent run is kept for the browser to pick up
+JOB_TTL = 3600
+# Milliseconds between polls of a running agent run
+POLL_INTERVAL_MS = 500
+# Visualizations are served from here instead of being kept in dcc.Store, so
+# browser memory and callback payloads stay small
+image_cache = diskcache.Cache(
+    os.path.join(CACHE_DIR, "images"), size_limit=256 * 1024 * 1024
+)
+
+STATUS_VISIBLE_STYLE = {
+    "maxWidth": "800px",
+    "margin": "8px auto",
+    "color": "#64748b",
+    "fontStyle": "italic",
+    "fontFamily": "Inter, sans-serif",
+}
+STATUS_HIDDEN_STYLE = {**STATUS_VISIBLE_STYLE, "display": "none"}
+
+# Keys of the backend messages that are sent back with the next request
+VALID_MESSAGE_KEYS = [
+    "type",
+    "content",
+    "tool_calls",
+    "tool_call_id",
+]
+
+
+def create_backend_session() -> requests.Session:
+    """Create a keep-alive session with a connection pool for the backend.
+    Failed connections and requests rejected by the backend's admission
+    control (429/503) are retried with exponential backoff and jitter.
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=3,
+        status_forcelist=[429, 503],
+        allowed_methods=None,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=BACKEND_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+backend_session = create_backend_session()
+# Agent runs are sent from these long-lived threads of the web server
+# process, so consecutive chat turns reuse the pooled connections
+backend_executor = ThreadPoolExecutor(
+    max_workers=BACKEND_POOL_SIZE,
+    thread_name_prefix="backend",
+)
+
+
+def post_to_backend(
+    path: str, payload: dict, client_id: str, **kwargs
+) -> requests.Response:
+    """POST `payload` as compressed JSON over the pooled backend session.
+
+    Every request starts a new W3C trace; the backend records the agent run
+    under its trace ID.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "X-Client-ID": client_id,
+        "traceparent": f"00-{secrets.token_hex(16)}-{secrets.token_hex(8)}-01",
+    }
+    if BACKEND_REQUEST_COMPRESSION == "zstd" and zstandard is not None:
+        body = zstandard.ZstdCompressor().compress(body)
+        headers["Content-Encoding"] = "zstd"
+    elif BACKEND_REQUEST_COMPRESSION in ("gzip", "zstd"):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return backend_session.post(
+        f"{BACKEND_URL}{path}", data=body, headers=headers, **kwargs
+    )
+
+
+def _empty_chat():
+    return html.Div(
+        "No messages yet. Start the conversation!",
+        style={
+            "color": "#888",
+            "fontStyle": "italic",
+            "textAlign": "center",
+            "marginTop": "120px",
+            "fontSize": "1.1rem",
+        },
+    )
+
+
+def render_message(msg_type: str, content: str):
+    """Render one chat bubble with a pattern-matching ID."""
+    is_user = msg_type == "user"
+    align = "right" if is_user else "left"
+    color = "#2563eb" if is_user else "#f1f5f9"
+    text_color = "#fff" if is_user else "#222"
+    bubble_style = {
+        "background": color,
+        "color": text_color,
+        "padding": "12px 18px",
+        "borderRadius": "16px",
+        "maxWidth": "70%",
+        "display": "inline-block",
+        "boxShadow": "0 2px 8px rgba(0,0,0,0.04)",
+        "fontSize": "1rem",
+        "fontFamily": "Inter, sans-serif",
+        "margin": "2px 0",
+    }
+    wrapper_style = {
+        "textAlign": align,
+        "margin": "12px 0",
+        "display": "flex",
+        "justifyContent": "flex-end" if is_user else "flex-start",
+    }
+    return html.Div(
+        dcc.Markdown(content, dangerously_allow_html=True, style=bubble_style),
+        id={"type": "chat-message", "index": uuid.uuid4().hex},
+        style=wrapper_style,
+    )
+
+
+def store_image(encoded_image: str) -> str:
+    """Put a base64 PNG into the image cache and return its URL."""
+    image_id = uuid.uuid4().hex
+    image_cache.set(image_id, base64.b64decode(encoded_image))
+    return f"/images/{image_id}.png"
+
+
+def _strip_messages(messages: list[dict]) -> list[dict]:
+    """Drop system messages and unused keys from the backend messages."""
+    stripped = []
+    for msg in messages:
+        if msg["type"] == "system":
+            continue
+        stripped.append({key: msg[key] for key in VALID_MESSAGE_KEYS if key in msg})
+    return stripped
+
+
 # Initialize the Dash app
 app = dash.Dash(__name__)
 
@@ -23,9 +203,15 @@ app.layout = html.Div(
                 "color": "#222",
             },
         ),
-        dcc.Store(id="chat-history", data=[]),
         dcc.Store(id="all-messages", data=[]),
+        dcc.Store(id="pending-message"),
+        dcc.Store(id="chat-started", data=False),
+        dcc.Store(id="job-id"),
+        dcc.Interval(id="job-poll", interval=POLL_INTERVAL_MS, disabled=True),
+        # Identifies this browser tab for the backend's fair-share admission
+        dcc.Store(id="client-id", storage_type="session"),
         html.Div(
+            _empty_chat(),
             id="chat-window",
             style={
                 "height": "420px",
@@ -41,6 +227,10 @@ app.layout = html.Div(
                 "fontFamily": "Inter, sans-serif",
             },
         ),
+        html.Div(
+            id="agent-status",
+            style=STATUS_HIDDEN_STYLE,
+        ),
         html.Div(
             [
                 dcc.Input(
@@ -100,157 +290,161 @@ app.layout = html.Div(
 )
 
 
+@app.server.route("/images/<image_id>.png")
+def serve_image(image_id: str):
+    image = image_cache.get(image_id)
+    if image is None:
+        flask.abort(404)
+    return flask.Response(image, mimetype="image/png")
+
+
 @app.callback(
-    Output("chat-history", "data"),
+    Output("chat-window", "children"),
     Output("user-input", "value"),
-    Output("all-messages", "data"),  # Add output for all_messages
+    Output("pending-message", "data"),
+    Output("chat-started", "data"),
+    Output("client-id", "data"),
     Input("send-btn", "n_clicks"),
     Input("user-input", "n_submit"),  # Trigger on Enter key
     State("user-input", "value"),
-    State("chat-history", "data"),
-    State("all-messages", "data"),  # Add state for all_messages
+    State("chat-started", "data"),
+    State("client-id", "data"),
     prevent_initial_call=True,
 )
-def update_chat(n_clicks, n_submit, user_msg, history, all_messages):  # noqa: C901
-    """Updates the user-input element and chat history when the user sends a message.
-    This function is triggered when the user clicks the "Send" button.
-    It appends the user's message to the chat history and clears the user-input textbox.
-    Persists all_messages from backend in dcc.Store.
+def submit_message(n_clicks, n_submit, user_msg, chat_started, client_id):
+    """Shows the user's message right away and hands it to `ask_backend`.
+    Only the new bubble is sent to the browser, existing ones are kept as is.
     """
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return dash.no_update, "", dash.no_update
     if not user_msg or user_msg.strip() == "":
-        return dash.no_update, "", dash.no_update
-    history = history or []
-    history.append({"type": "user", "content": user_msg})
+        return dash.no_update, "", dash.no_update, dash.no_update, dash.no_update
+    bubble = render_message("user", user_msg)
+    if chat_started:
+        children = Patch()
+        children.append(bubble)
+    else:
+        # Replace the empty-chat placeholder
+        children = [bubble]
+    return children, "", user_msg, True, client_id or uuid.uuid4().hex
+
+
+def _stream_agent(job_id: str, payload: dict, client_id: str) -> dict:
+    """Stream the agent run, recording each step, and return its response."""
+    with post_to_backend(
+        "/chat/ask_agent/stream",
+        payload,
+        client_id or "anonymous",
+        stream=True,
+        timeout=60,
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(response.status_code)
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["event"] == "step":
+                job_cache.set(
+                    job_id, {"progress": f"{event['detail']}..."}, expire=JOB_TTL
+                )
+            elif event["event"] == "result":
+                return event["response"]
+    raise RuntimeError("No response from backend")
+
 
-    all_messages.append({"type": "user", "content": user_msg})
+def run_agent(job_id: str, all_messages: list[dict], client_id: str):
+    """Send the conversation to the backend and record the agent's progress.
+
+    Runs on `backend_executor`. The progress of each agent step and then the
+    answer bubbles are written to `job_cache` under `job_id`.
+    """
+    bubbles = []
     try:
         payload = {
             "messages": all_messages,
             "result": "string",
             "visual_created": False,
             "follow_up_question": "string",
+            # Only receive the new messages, the history is kept here
+            "delta": True,
         }
-        response = requests.post(
-            "http://127.0.0.1:8002/chat/ask_agent",
-            json=payload,
-            timeout=60,
-        )
-        valid_response_keys = [
-            "type",
-            "content",
-            "tool_calls",
-            "tool_call_id",
-        ]
-        if response.status_code == 200:
-            last_message = response.json().get("result", "(No response from backend)")
-            all_messages = response.json()["messages"]
-            encoded_image = response.json().get("visualization_image", None)
-            html_img_tag = f'<img src="data:image/png;base64,{encoded_image}" />'
-            follow_up_question = response.json().get("follow_up_question", None)
-            new_messages = []
-            for msg in all_messages:
-                if msg["type"] == "system":
-                    continue
-                new_msg = {}
-                for valid_key in valid_response_keys:
-                    if valid_key in msg:
-                        new_msg[valid_key] = msg[valid_key]
-
-                new_messages.append(new_msg)
-
-            all_messages = new_messages
-
-            history.append({"type": "ai", "content": last_message})
-            if encoded_image:
-                history.append(
-                    {
-                        "type": "ai",
-                        "content": html_img_tag,
-                        "visualization_image": encoded_image,
-                    }
-                )
-            if follow_up_question:
-                history.append(
-                    {
-                        "type": "ai",
-                        "content": f"<b>Follow-up questions:</b><br/>{follow_up_question}",
-                        "follow_up_question": follow_up_question,
-                    }
-                )
-                all_messages.append(
-                    {
-                        "type": "ai",
-                        "content": html_img_tag,
-                        "visualization_image": encoded_image,
-                    }
-                )
-        else:
-            last_message = f"(Backend error: {response.status_code})"
-            all_messages = dash.no_update
-            history.append({"type": "ai", "content": last_message})
-    except Exception as e:
-        last_message = f"(Backend error: {str(e)})"
-        all_messages = dash.no_update
-        history.append({"type": "ai", "content": last_message})
+        result = _stream_agent(job_id, payload, client_id)
 
-    return history, "", all_messages
+        last_message = result.get("result") or "(No response from backend)"
+        all_messages = all_messages + _strip_messages(result["messages"])
+        result_links = result.get("result_links", [])
+        if result_links:
+            # Link the full result of the latest query
+            last_message += (
+                f"\n\n[Download all rows (CSV)]({BACKEND_PUBLIC_URL}{result_links[-1]})"
+                f" · [Parquet]({BACKEND_PUBLIC_URL}{result_links[-1]}?format=parquet)"
+            )
+        bubbles.append(last_message)
+        if result.get("visualization_image"):
+            image_url = store_image(result["visualization_image"])
+            bubbles.append(f'<img src="{image_url}" />')
+        if result.get("follow_up_question"):
+            bubbles.append(
+                f"<b>Follow-up questions:</b><br/>{result['follow_up_question']}"
+            )
+    except Exception as e:
+        all_messages = None
+        bubbles.append(f"(Backend error: {str(e)})")
+    job_cache.set(
+        job_id, {"bubbles": bubbles, "messages": all_messages}, expire=JOB_TTL
+    )
 
 
 @app.callback(
-    Output("chat-window", "children"),
-    # "chat-history" is the ID of the dcc.Store component that holds the chat history
-    # "data" is the property that holds the chat messages
-    Input("chat-history", "data"),
+    Output("job-id", "data"),
+    Output("job-poll", "disabled"),
+    Output("send-btn", "disabled"),
+    Output("user-input", "disabled"),
+    Output("agent-status", "children"),
+    Output("agent-status", "style"),
+    Input("pending-message", "data"),
+    State("all-messages", "data"),
+    State("client-id", "data"),
+    prevent_initial_call=True,
 )
-def render_chat(history):
-    if not history:
-        return html.Div(
-            "No messages yet. Start the conversation!",
-            style={
-                "color": "#888",
-                "fontStyle": "italic",
-                "textAlign": "center",
-                "marginTop": "120px",
-                "fontSize": "1.1rem",
-            },
-        )
-    messages = []
-    for msg in history:
-        is_user = msg["type"] == "user"
-        align = "right" if is_user else "left"
-        color = "#2563eb" if is_user else "#f1f5f9"
-        text_color = "#fff" if is_user else "#222"
-        bubble_style = {
-            "background": color,
-            "color": text_color,
-            "padding": "12px 18px",
-            "borderRadius": "16px",
-            "maxWidth": "70%",
-            "display": "inline-block",
-            "boxShadow": "0 2px 8px rgba(0,0,0,0.04)",
-            "fontSize": "1rem",
-            "fontFamily": "Inter, sans-serif",
-            "margin": "2px 0",
-        }
-        wrapper_style = {
-            "textAlign": align,
-            "margin": "12px 0",
-            "display": "flex",
-            "justifyContent": "flex-end" if is_user else "flex-start",
-        }
-        messages.append(
-            html.Div(
-                dcc.Markdown(
-                    msg["content"], dangerously_allow_html=True, style=bubble_style
-                ),
-                style=wrapper_style,
-            )
-        )
+def ask_backend(user_msg, all_messages, client_id):
+    """Starts the agent run for the user's message and polls its progress.
+    The backend call runs on a thread of this process, so the server is not
+    blocked while the agent works and the pooled session is reused.
+    """
+    all_messages = (all_messages or []) + [{"type": "user", "content": user_msg}]
+    job_id = uuid.uuid4().hex
+    job_cache.set(job_id, {"progress": "Thinking..."}, expire=JOB_TTL)
+    backend_executor.submit(run_agent, job_id, all_messages, client_id)
+    return job_id, False, True, True, "Thinking...", STATUS_VISIBLE_STYLE
+
 
-    return messages
+@app.callback(
+    Output("chat-window", "children", allow_duplicate=True),
+    Output("all-messages", "data"),
+    Output("agent-status", "children", allow_duplicate=True),
+    Output("agent-status", "style", allow_duplicate=True),
+    Output("job-poll", "disabled", allow_duplicate=True),
+    Output("send-btn", "disabled", allow_duplicate=True),
+    Output("user-input", "disabled", allow_duplicate=True),
+    Input("job-poll", "n_intervals"),
+    State("job-id", "data"),
+    prevent_initial_call=True,
+)
+def poll_backend(n_intervals, job_id):
+    """Shows the progress of the agent run, then appends its answer bubbles.
+    Persists all_messages from backend in dcc.Store.
+    """
+    job = job_cache.get(job_id)
+    if job is None:
+        # The outcome expired or the server restarted during the run
+        job = {"bubbles": ["(Backend error: the answer was lost)"], "messages": None}
+    if "progress" in job:
+        return (dash.no_update,) * 2 + (job["progress"],) + (dash.no_update,) * 4
+    job_cache.delete(job_id)
+    children = Patch()
+    children.extend([render_message("ai", bubble) for bubble in job["bubbles"]])
+    messages = job["messages"] if job["messages"] is not None else dash.no_update
+    return children, messages, "", STATUS_HIDDEN_STYLE, True, False, False
 
 
 if __name__ == "__main__":
@@ -0,0 +1,19 @@
+import pytest
+
+from backend.agent.catalog import _approximate
+
+
+@pytest.mark.parametrize(
+    ("count", "expected"),
+    [
+        (999, "999"),
+        (2155, "2.2k"),
+        (9999, "10k"),
+        (123_456, "123k"),
+        (1_234_567, "1.2M"),
+        (123_456_789, "123M"),
+        (5_400_000_000, "5.4G"),
+    ],
+)
+def test_approximate_never_uses_scientific_notation(count, expected):
+    assert _approximate(count) == expected
@@ -0,0 +1,42 @@
+import pyarrow as pa
+
+from backend.utils.charts import build_chart, distinct_x, prepare_series
+
+
+def test_repeated_x_uses_finer_dimensions():
+    table = pa.table(
+        {
+            "country": ["UK", "UK", "USA"],
+            "city": ["London", "Cowes", "Boise"],
+            "avg_price": [10.0, 30.0, 20.0],
+        }
+    )
+    xs = distinct_x(table, ["country"], "bar")
+    assert xs == ["country", "city"]
+    labels, series = prepare_series(table, "bar", xs, ["avg_price"])
+    # Averages are drawn as they are, never summed per country
+    assert labels == ["UK-Cowes", "USA-Boise", "UK-London"]
+    assert series == {"avg_price": [30.0, 20.0, 10.0]}
+
+
+def test_rows_no_column_tells_apart_are_not_charted():
+    table = pa.table({"country": ["UK", "UK", "USA"], "avg_price": [1.0, 3.0, 2.0]})
+    assert distinct_x(table, ["country"], "bar") is None
+    assert build_chart(table, "bar") is None
+
+
+def test_distinct_x_is_kept():
+    table = pa.table({"country": ["UK", "USA"], "avg_price": [1.0, 2.0]})
+    assert distinct_x(table, ["country"], "pie") == ["country"]
+
+
+def test_missing_measures_are_charted():
+    table = pa.table(
+        {"country": ["UK", "USA", "France"], "avg_price": [1.0, None, 2.0]}
+    )
+    for visualization_type in ("bar", "line", "pie"):
+        assert build_chart(table, visualization_type) is not None
+    labels, series = prepare_series(table, "pie", ["country"], ["avg_price"])
+    assert labels == ["France", "UK"]
+    labels, _ = prepare_series(table, "bar", ["country"], ["avg_price"])
+    assert labels == ["France", "UK", "USA"]
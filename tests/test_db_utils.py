@@ -0,0 +1,13 @@
+from backend.utils.db_utils import unique_names
+
+
+def test_unique_names_suffixes_repeated_columns():
+    assert unique_names(["order_id", "order_id", "quantity"]) == [
+        "order_id",
+        "order_id_2",
+        "quantity",
+    ]
+
+
+def test_unique_names_skips_existing_suffixes():
+    assert unique_names(["id", "id", "id_2"]) == ["id", "id_3", "id_2"]
@@ -0,0 +1,55 @@
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("sqlglot")
+
+from backend.utils.duckdb_snapshot import DuckDBSnapshot, to_duckdb_sql  # noqa: E402
+
+
+@pytest.fixture
+def connection():
+    connection = duckdb.connect()
+    connection.execute(
+        "CREATE TABLE order_details"
+        " (order_id SMALLINT, quantity SMALLINT, unit_price FLOAT)"
+    )
+    connection.execute(
+        "INSERT INTO order_details VALUES (1, 5, 2.5), (1, 2, 1.0), (2, 7, 4.0)"
+    )
+    yield connection
+    connection.close()
+
+
+def _run(connection, query: str) -> list[tuple]:
+    schema = DuckDBSnapshot._read_schema(connection)
+    return connection.execute(to_duckdb_sql(query, schema)).fetchall()
+
+
+def test_integer_division_truncates_like_postgres(connection):
+    assert _run(connection, "SELECT 7/2, -7/2") == [(3, -3)]
+    assert _run(connection, "SELECT SUM(quantity)/COUNT(*) FROM order_details") == [
+        (4,)
+    ]
+    assert _run(
+        connection,
+        "SELECT order_id, quantity/2 AS half FROM order_details"
+        " WHERE quantity/3 >= 1 ORDER BY order_id",
+    ) == [(1, 2), (2, 3)]
+
+
+def test_other_divisions_are_unchanged(connection):
+    assert _run(connection, "SELECT 7/2.0") == [(3.5,)]
+    assert _run(
+        connection,
+        "SELECT unit_price/2 FROM order_details WHERE order_id = 2",
+    ) == [(2.0,)]
+
+
+def test_output_names_are_kept(connection):
+    cursor = connection.execute(
+        to_duckdb_sql(
+            "SELECT order_id, quantity/2 AS half FROM order_details",
+            DuckDBSnapshot._read_schema(connection),
+        )
+    )
+    assert [column[0] for column in cursor.description] == ["order_id", "half"]
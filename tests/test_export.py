@@ -0,0 +1,52 @@
+import io
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backend.utils.arrow_utils import POSTGRES_ARROW_TYPES
+from backend.utils.export import write_parquet_chunks
+
+_NUMERIC = 1700
+
+
+def _read(chunks) -> pa.Table:
+    return pq.read_table(io.BytesIO(b"".join(write_parquet_chunks(chunks))))
+
+
+def test_first_chunk_does_not_fix_the_types_of_later_chunks():
+    columns = ["id", "note", "price"]
+    # Types the driver does not know are inferred from the first chunk
+    types = [None, None, None]
+    chunks = [
+        (columns, types, [(1, None, Decimal("0.99")), (2, None, Decimal("1.5"))]),
+        (columns, types, [(3, 42, Decimal("12.345")), (4, None, Decimal("7"))]),
+    ]
+
+    table = _read(chunks)
+
+    assert table.column("note").to_pylist() == [None, None, "42", None]
+    assert table.schema.field("price").type == pa.float64()
+    assert table.column("price").to_pylist() == [0.99, 1.5, 12.345, 7.0]
+
+
+def test_postgres_types_come_from_the_cursor():
+    columns = ["quantity", "unit_price"]
+    types = [POSTGRES_ARROW_TYPES[23], POSTGRES_ARROW_TYPES[_NUMERIC]]
+    chunks = [
+        (columns, types, [(None, Decimal("0.99"))]),
+        (columns, types, [(5, Decimal("1.25")), (7, Decimal("10.5"))]),
+    ]
+
+    table = _read(chunks)
+
+    assert table.schema.field("quantity").type == pa.int32()
+    assert table.column("quantity").to_pylist() == [None, 5, 7]
+    assert table.column("unit_price").to_pylist() == [0.99, 1.25, 10.5]
+
+
+def test_empty_result_has_the_cursor_schema():
+    table = _read([(["id"], [POSTGRES_ARROW_TYPES[23]], [])])
+
+    assert table.num_rows == 0
+    assert table.schema.field("id").type == pa.int32()
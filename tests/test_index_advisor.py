@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from backend.index_advisor import IndexAdvisor
+
+pytest.importorskip("sqlglot")
+
+_QUERY = "SELECT * FROM orders WHERE customer_id = 'ALFKI'"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'orders.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE orders (order_id INTEGER PRIMARY KEY, customer_id TEXT)"
+        )
+    yield engine
+    engine.dispose()
+
+
+def test_indexes_are_dropped_when_the_after_measurement_fails(engine, monkeypatch):
+    advisor = IndexAdvisor(engine, repeat=1)
+    measure = advisor._measure
+    calls = []
+
+    def failing_measure(connection, sql):
+        calls.append(sql)
+        if len(calls) == 2:
+            raise RuntimeError("canceling statement due to statement timeout")
+        return measure(connection, sql)
+
+    monkeypatch.setattr(advisor, "_measure", failing_measure)
+    workload = [{"shape": _QUERY, "sql": _QUERY, "count": 3, "total_seconds": 1.0}]
+
+    advice = advisor.advise(workload, apply=True)
+
+    assert advice["shapes"][0]["error"] == (
+        "canceling statement due to statement timeout"
+    )
+    assert advice["recommendations"] == []
+    assert inspect(engine).get_indexes("orders") == []
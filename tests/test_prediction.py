@@ -0,0 +1,47 @@
+import asyncio
+from contextlib import ExitStack
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from backend.routers.prediction import _AdmittedStreamingResponse
+from backend.utils.admission import AdmissionController
+
+
+def _admitted_response(controller):
+    def events():
+        yield b"{}\n"
+
+    admission = ExitStack()
+    admission.enter_context(controller.admit("client"))
+    return _AdmittedStreamingResponse(events(), admission)
+
+
+def test_slot_released_when_client_disconnects_before_first_chunk():
+    controller = AdmissionController(1, 0, 1, 1)
+    response = _admitted_response(controller)
+
+    async def send(message):
+        raise OSError("client went away")
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response(scope, None, send))
+
+    assert controller._active == 0
+    assert not controller._in_flight
+
+
+def test_slot_released_after_stream():
+    controller = AdmissionController(1, 0, 1, 1)
+    response = _admitted_response(controller)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    asyncio.run(response(scope, None, send))
+
+    assert sent[-1]["more_body"] is False
+    assert controller._active == 0
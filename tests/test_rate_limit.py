@@ -0,0 +1,47 @@
+import httpx
+import openai
+
+from backend.utils import rate_limit
+from backend.utils.rate_limit import AdaptiveRateLimiter, call_with_rate_limit
+
+
+def _server_error(headers=None):
+    request = httpx.Request("POST", "https://llm.example/v1/chat/completions")
+    response = httpx.Response(503, headers=headers, request=request)
+    return openai.InternalServerError(
+        "Service unavailable", response=response, body=None
+    )
+
+
+def _flaky(errors):
+    errors = iter(errors)
+
+    def call():
+        error = next(errors, None)
+        if error is not None:
+            raise error
+        return "answer"
+
+    return call
+
+
+def test_transient_errors_are_retried_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, "sleep", sleeps.append)
+    limiter = AdaptiveRateLimiter(rate=100, burst=10, min_rate=1, max_rate=100)
+    call = _flaky([_server_error(), _server_error({"Retry-After": "7"})])
+
+    assert call_with_rate_limit(limiter, call) == "answer"
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= rate_limit.RETRY_BASE_DELAY
+    assert sleeps[1] == 7.0
+
+
+def test_backoff_grows_and_is_capped():
+    for attempt in range(10):
+        delay = rate_limit._backoff_seconds(attempt, None)
+        assert (
+            0
+            <= delay
+            <= min(rate_limit.RETRY_MAX_DELAY, rate_limit.RETRY_BASE_DELAY * 2**attempt)
+        )
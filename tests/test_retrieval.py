@@ -0,0 +1,34 @@
+import pytest
+
+from backend.agent.retrieval import SchemaIndex
+
+
+@pytest.fixture
+def index():
+    index = SchemaIndex()
+    # Indexed by hand, so no database is needed
+    index._versions["northwind"] = {"customers": "v1"}
+    index._column_values["northwind/customers"] = {"country": {"UK", "USA"}}
+    for value in ("UK", "USA"):
+        index.value_lookup.add(
+            f"northwind/customers/country/{value}",
+            value,
+            ("northwind", "customers", "country", value),
+        )
+    return index
+
+
+def test_check_literals_suggests_values(index):
+    query = "SELECT * FROM customers WHERE country = 'U.K.'"
+    warnings = index.check_literals("northwind", query)
+    assert len(warnings) == 1
+    assert "'UK'" in warnings[0]
+    assert index.check_literals("northwind", query.replace("U.K.", "UK")) == []
+
+
+def test_disabled_index_checks_nothing(index):
+    index.enabled = False
+    query = "SELECT * FROM customers WHERE country = 'U.K.'"
+    assert index.check_literals("northwind", query) == []
+    with pytest.raises(RuntimeError):
+        index.lookup("U.K.", "northwind")
@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine
+
+from backend.rollups import ROLLUPS, RollupManager
+
+
+def test_unresolved_datasource_is_retried():
+    manager = RollupManager(ROLLUPS, refresh_interval=0.01)
+    calls = []
+
+    def get_engine(datasource):
+        calls.append(datasource)
+        if len(calls) == 1:
+            raise ValueError(f"Unknown datasource '{datasource}'")
+        return create_engine("sqlite://")
+
+    manager.start(get_engine)
+    manager._thread.join(timeout=5)
+
+    # The thread survived the error and stopped at the non-Postgres engine
+    assert calls == ["northwind", "northwind"]
+    assert not manager._thread.is_alive()
@@ -0,0 +1,23 @@
+import time
+
+from backend.utils.run_log import RunLog
+
+
+def test_runs_older_than_the_retention_are_pruned(tmp_path):
+    run_log = RunLog(tmp_path / "run_log.sqlite3", retention_days=1)
+    with run_log.run("old", "Top customers?"):
+        run_log.log_query("sql_db_query", "northwind", "SELECT 1", 0.1, 1)
+    with run_log.run("new", "Top products?"):
+        run_log.log_query("sql_db_query", "northwind", "SELECT 2", 0.1, 1)
+    connection = run_log._connection()
+    two_days_ago = time.time() - 2 * 86400
+    with connection:
+        for table in ("runs", "queries"):
+            connection.execute(
+                f"UPDATE {table} SET started_at = ? WHERE run_id = 'old'",
+                (two_days_ago,),
+            )
+
+    assert run_log.prune() == 1
+    assert connection.execute("SELECT run_id FROM runs").fetchall() == [("new",)]
+    assert connection.execute("SELECT run_id FROM queries").fetchall() == [("new",)]
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from backend.agent import tools
+from backend.agent.tools import sql_db_query
+from backend.database import DataSource, datasources
+
+
+@pytest.fixture
+def sqlite_datasource(tmp_path, monkeypatch):
+    # Always run the query, never reuse a cached result
+    monkeypatch.setattr(tools, "SQL_CACHE_TTL", 0)
+    source = datasources.register(
+        DataSource("test_sqlite", f"sqlite:///{tmp_path / 'test.db'}", "Test data")
+    )
+    yield source.name
+    datasources._sources.pop(source.name)
+
+
+def test_sql_db_query_with_repeated_column_names(sqlite_datasource):
+    text, table, _ = sql_db_query(
+        query="SELECT 1 AS a, 2 AS a",
+        reasoning="Both sides of a join have an id",
+        visualization_type="bar",
+        datasource=sqlite_datasource,
+    )
+    assert not text.startswith("Error"), text
+    assert table.column_names == ["a", "a_2"]
+
+
+def test_sql_db_schema_returns_database_errors(sqlite_datasource, monkeypatch):
+    def describe(datasource, tables):
+        raise RuntimeError("cached plan must not change result type")
+
+    monkeypatch.setattr(tools, "list_tables", lambda datasource: ["orders"])
+    monkeypatch.setattr(tools, "describe_tables", describe)
+    result = tools.sql_db_schema(table_names="orders", datasource=sqlite_datasource)
+    assert result == "Error: cached plan must not change result type"
+
+
+@pytest.mark.parametrize("enabled", ["true", "false"])
+def test_retrieval_tools_follow_retrieval_enabled(enabled):
+    # The tools are registered at import, so import them in a fresh process
+    code = (
+        "from backend.agent.tools import registry;"
+        "print(sorted(registry.list_tools_by_names()))"
+    )
+    env = {**os.environ, "RETRIEVAL_ENABLED": enabled, "PYTHONPATH": "src"}
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    ).stdout
+    for tool in ("find_relevant_tables", "lookup_values"):
+        assert (tool in output) == (enabled == "true")
@@ -0,0 +1,12 @@
+from backend import warmup
+
+
+def test_failed_warmup_is_retried_until_ready(monkeypatch):
+    outcomes = iter([False, False, True])
+    monkeypatch.setattr(warmup, "warmup", lambda: next(outcomes))
+    monkeypatch.setattr(warmup, "WARMUP_RETRY_DELAY", 0)
+    monkeypatch.setattr(warmup, "_warmup_thread", None)
+
+    warmup.start_warmup().join(timeout=5)
+
+    assert next(outcomes, None) is None